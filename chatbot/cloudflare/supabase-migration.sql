@@ -11,8 +11,13 @@
 --   page_num    int
 --   chunk_index int
 --   content     text
+--   token_count int   (added below)
 --   embedding   vector(1536)
 
+-- Token count of each chunk, stored at ingest so the chatbot packs its context
+-- window without re-tokenizing. Existing rows keep 0 and are counted at query time.
+ALTER TABLE chatbot_chunks ADD COLUMN IF NOT EXISTS token_count int NOT NULL DEFAULT 0;
+
 CREATE OR REPLACE FUNCTION match_chunks(
   query_embedding vector(1536),
   collection_name text,
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Recall@k vs latency report for the FAISS index types (flat / HNSW / IVF-PQ).
+
+Usage:
+    python scripts/bench_index.py --n 200000 --dim 1536
+    python scripts/bench_index.py --collection default --k 5
+    python scripts/bench_index.py --json data/bench/index_report.json
+
+Builds each index type with the current settings (HNSW_M, IVF_NLIST, PQ_M, ...),
+then sweeps efSearch (HNSW) and nprobe (IVF-PQ). Recall is measured against exact
+inner-product search; latency is per single query, which is how /api/v1/query searches.
+Use the output to pick FAISS_INDEX_TYPE / HNSW_EF_SEARCH / IVF_NPROBE before ingesting.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+# Allow running from project root without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Load .env before importing settings
+from dotenv import load_dotenv
+load_dotenv()
+
+import faiss
+import numpy as np
+
+from chatbot.adapters import vector_adapter
+from chatbot.config import get_settings
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s — %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+HNSW_EF_SWEEP = [16, 32, 64, 128, 256]
+IVF_NPROBE_SWEEP = [1, 2, 4, 8, 16, 32, 64]
+
+
+def make_vectors(n: int, dim: int, clusters: int = 0, seed: int = 0) -> np.ndarray:
+    """
+    L2-normalized float32 vectors. clusters > 0 draws them around random centroids,
+    which is closer to real embedding distributions than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    if clusters > 0:
+        centroids = rng.standard_normal((clusters, dim)).astype(np.float32)
+        vectors = centroids[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    else:
+        vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def make_queries(vectors: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Perturbed copies of random corpus vectors — queries that have true neighbours."""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    queries = picks + 0.1 * rng.standard_normal(picks.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    _, ids = index.search(queries, k)
+    return ids
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f[:k]) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def latency_percentiles(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+    }
+
+
+def timed_single_queries(index: faiss.Index, queries: np.ndarray, k: int) -> tuple[np.ndarray, List[float]]:
+    found = np.empty((len(queries), k), dtype=np.int64)
+    timings: List[float] = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i : i + 1], k)
+        timings.append(time.perf_counter() - start)
+        found[i] = ids[0]
+    return found, timings
+
+
+def load_collection_vectors(collection: str) -> np.ndarray:
+    """Reconstruct the stored (normalized) vectors of an existing flat or HNSW collection."""
+    settings = get_settings()
+    if not vector_adapter.load_index(settings.data_indexed_dir, collection):
+        raise FileNotFoundError(f"No index for collection '{collection}' in {settings.data_indexed_dir}")
+    index, _ = vector_adapter._index_cache[collection]
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def run(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    index_types: List[str],
+) -> List[dict]:
+    truth = exact_neighbours(vectors, queries, k)
+    rows: List[dict] = []
+
+    for index_type in index_types:
+        settings = get_settings()
+        sample = None
+        if index_type == "ivfpq":
+            rng = np.random.default_rng(0)
+            size = min(len(vectors), settings.index_train_size)
+            sample = vectors[rng.choice(len(vectors), size, replace=False)]
+
+        start = time.perf_counter()
+        index, config = vector_adapter.build_faiss_index(index_type, vectors.shape[1], sample)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        if config["type"] == "hnsw":
+            sweep = [("ef_search", ef) for ef in HNSW_EF_SWEEP]
+        elif config["type"] == "ivfpq":
+            sweep = [("nprobe", p) for p in IVF_NPROBE_SWEEP if p <= config["nlist"]]
+        else:
+            sweep = [(None, None)]
+
+        for param, value in sweep:
+            if param:
+                vector_adapter.apply_search_params(index, {**config, param: value})
+            found, timings = timed_single_queries(index, queries, k)
+            rows.append({
+                "type": config["type"],
+                "param": param,
+                "value": value,
+                f"recall@{k}": round(recall_at_k(found, truth), 4),
+                **latency_percentiles(timings),
+                "build_s": round(build_seconds, 2),
+                "size_mb": round(size_mb, 1),
+                "config": config,
+            })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Report recall@k vs latency for FAISS index types and search parameters.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--collection", default=None, help="Use vectors from an existing collection instead of synthetic data")
+    parser.add_argument("--n", type=int, default=100_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="Synthetic vector dimension")
+    parser.add_argument("--clusters", type=int, default=256, help="Synthetic clusters (0 = uniform)")
+    parser.add_argument("--queries", type=int, default=500, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Neighbours per query")
+    parser.add_argument("--types", default="flat,hnsw,ivfpq", help="Comma-separated index types")
+    parser.add_argument("--json", default=None, help="Also write the rows to this JSON file")
+    args = parser.parse_args()
+
+    if args.collection:
+        vectors = load_collection_vectors(args.collection)
+    else:
+        vectors = make_vectors(args.n, args.dim, args.clusters)
+    queries = make_queries(vectors, args.queries)
+    logger.info("Benchmarking %d vectors (dim=%d), %d queries, k=%d", len(vectors), vectors.shape[1], len(queries), args.k)
+
+    rows = run(vectors, queries, args.k, [t.strip() for t in args.types.split(",")])
+
+    print()
+    print(f"{'type':<7} {'param':<10} {'value':>6} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'size MB':>8}")
+    for row in rows:
+        print(
+            f"{row['type']:<7} {row['param'] or '-':<10} {row['value'] if row['value'] is not None else '-':>6} "
+            f"{row[f'recall@{args.k}']:>9.4f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} "
+            f"{row['build_s']:>8.2f} {row['size_mb']:>8.1f}"
+        )
+
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n": len(vectors), "dim": int(vectors.shape[1]), "k": args.k, "rows": rows}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
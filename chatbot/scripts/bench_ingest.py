@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Ingestion throughput report: per-stage timings, chunks/s, peak RSS and index size.
+
+Usage:
+    python scripts/bench_ingest.py
+    python scripts/bench_ingest.py --docs 200 --pages 20 --formats pdf,txt,html
+    python scripts/bench_ingest.py --embed-latency-ms 150 --json data/bench/ingest_report.json
+
+Generates a synthetic corpus (PDF / TXT / HTML for ingest(), PDF / DOCX / XLSX for the
+upload path ingest_file()) and embeds it against a local stub of the OpenAI embeddings
+API (OPENAI_BASE_URL), so runs are free, offline and repeatable. --embed-latency-ms adds
+a fixed delay per embeddings request to model the network. The embedding cache is disabled.
+
+ingest_file() stores into Supabase when SUPABASE_DB_URL is set; otherwise the insert is
+replaced by a no-op and its "store" time is reported as 0.
+
+Stage times come from IngestionResult / UploadResult.stage_seconds; load and split run in
+worker processes and are summed over them, so they can exceed wall-clock time.
+Peak RSS is the high-water mark of this process (and, separately, of its worker processes).
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+# Allow running from project root without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Load .env before importing settings
+from dotenv import load_dotenv
+load_dotenv()
+
+import numpy as np
+
+# ingest() logs every file; keep the report readable
+logging.basicConfig(
+    level=logging.WARNING,
+    format="%(asctime)s %(levelname)s — %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+INGEST_FORMATS = ("pdf", "txt", "html")
+UPLOAD_FORMATS = ("pdf", "docx", "xlsx")
+
+
+# ── Synthetic corpus ──────────────────────────────────────────────────────────
+
+class TextGenerator:
+    """Seeded pseudo-English: a fixed vocabulary with a Zipf-like word distribution."""
+
+    def __init__(self, seed: int = 0, vocab_size: int = 5000) -> None:
+        self.rng = np.random.default_rng(seed)
+        letters = np.array(list("etaoinshrdlucmfwypvbgkqjxz"))
+        weights = np.linspace(2.0, 0.1, len(letters))
+        weights /= weights.sum()
+        self.vocab = [
+            "".join(self.rng.choice(letters, size=self.rng.integers(2, 11), p=weights))
+            for _ in range(vocab_size)
+        ]
+        ranks = np.arange(1, vocab_size + 1, dtype=np.float64)
+        self.p = (1 / ranks) / (1 / ranks).sum()
+
+    def sentence(self) -> str:
+        words = self.rng.choice(self.vocab, size=self.rng.integers(6, 20), p=self.p)
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self, words: int) -> str:
+        sentences: List[str] = []
+        count = 0
+        while count < words:
+            sentences.append(self.sentence())
+            count += len(sentences[-1].split())
+        return " ".join(sentences)
+
+    def page(self, words: int) -> List[str]:
+        """A page as paragraphs of ~80 words."""
+        return [self.paragraph(min(80, words - i)) for i in range(0, words, 80)]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _wrap(text: str, width: int = 95) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    return lines + ([line] if line else [])
+
+
+def write_pdf(path: str, pages: List[List[str]]) -> None:
+    """Minimal text-layer PDF (Helvetica, one content stream per page) — no PDF library needed."""
+    objects: List[bytes] = [b"", b""]  # 1: catalog, 2: page tree (filled in last)
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")  # 3
+    kids = []
+    for paragraphs in pages:
+        lines = [line for p in paragraphs for line in _wrap(p) + [""]][:62]
+        body = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) '" for l in lines) + " ET"
+        stream = body.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode(), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_corpus(
+    directory: str,
+    fmt: str,
+    docs: int,
+    pages: int,
+    words: int,
+    xlsx_rows: int,
+    gen: TextGenerator,
+) -> List[str]:
+    """Write docs synthetic files of one format; returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(docs):
+        path = os.path.join(directory, f"doc_{i:05d}.{fmt}")
+        content = [gen.page(words) for _ in range(pages)]
+        if fmt == "pdf":
+            write_pdf(path, content)
+        elif fmt == "txt":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(p for page in content for p in page))
+        elif fmt == "html":
+            body = "\n".join(
+                f"<h2>Section {n + 1}</h2>\n" + "\n".join(f"<p>{p}</p>" for p in page)
+                for n, page in enumerate(content)
+            )
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"<html><head><title>Doc {i}</title></head><body>\n{body}\n</body></html>")
+        elif fmt == "docx":
+            import docx  # python-docx
+
+            document = docx.Document()
+            for page in content:
+                for p in page:
+                    document.add_paragraph(p)
+            table = document.add_table(rows=0, cols=3)
+            for r in range(20):
+                cells = table.add_row().cells
+                cells[0].text, cells[1].text, cells[2].text = f"ITEM-{r:03d}", gen.sentence(), str(r * 7)
+            document.save(path)
+        elif fmt == "xlsx":
+            import openpyxl
+
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet("Data")
+            ws.append(["id", "region", "description", "units", "price"])
+            for r in range(xlsx_rows):
+                ws.append([r, f"R{r % 12}", gen.sentence(), int(gen.rng.integers(1, 500)), round(float(gen.rng.random()) * 100, 2)])
+            wb.save(path)
+        else:
+            raise ValueError(f"Unknown format '{fmt}'")
+        paths.append(path)
+    return paths
+
+
+# ── Stub embedding server ─────────────────────────────────────────────────────
+
+class _EmbeddingHandler(BaseHTTPRequestHandler):
+    """POST /v1/embeddings with the OpenAI request/response shape; vectors are a hash of the text."""
+
+    dim = 1536
+    latency = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self) -> None:  # noqa: N802 — http.server naming
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            type(self).requests += 1
+
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.blake2b(str(text).encode("utf-8"), digest_size=8).digest(), "little")
+            vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            vec /= np.linalg.norm(vec)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vec.tobytes()).decode("ascii")
+            else:
+                embedding = vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(t)) // 4 for t in inputs)
+        payload = json.dumps({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args) -> None:  # silence per-request logging
+        pass
+
+
+def start_stub_server(dim: int, latency_ms: float) -> ThreadingHTTPServer:
+    _EmbeddingHandler.dim = dim
+    _EmbeddingHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ── Measurements ──────────────────────────────────────────────────────────────
+
+def peak_rss_mb() -> Dict[str, float]:
+    """ru_maxrss is KiB on Linux, bytes on macOS."""
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / (1024 * 1024)
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+        "peak_rss_workers_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1),
+    }
+
+
+def directory_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return round(total / 1e6, 2)
+
+
+def bench_ingest(input_dir: str, indexed_dir: str) -> dict:
+    from chatbot.services.ingestion_service import ingest
+
+    start = time.perf_counter()
+    result = ingest(input_dir=input_dir, indexed_dir=indexed_dir, collection="bench", full=True)
+    wall = time.perf_counter() - start
+    return {
+        "path": "ingest",
+        "documents": result.documents_processed,
+        "chunks": result.total_chunks,
+        "wall_s": round(wall, 2),
+        "chunks_per_s": round(result.total_chunks / wall, 1) if wall else 0.0,
+        "stages": result.stage_seconds,
+        "index_mb": directory_mb(result.index_path),
+        **peak_rss_mb(),
+    }
+
+
+def bench_ingest_file(paths: List[str], fmt: str) -> dict:
+    from chatbot.services.ingestion_service import ingest_file
+
+    stages: Dict[str, float] = {}
+    chunks = 0
+    start = time.perf_counter()
+    for path in paths:
+        result = ingest_file(path, collection="bench-upload")
+        chunks += result.chunks_indexed
+        for stage, seconds in result.stage_seconds.items():
+            stages[stage] = round(stages.get(stage, 0.0) + seconds, 3)
+    wall = time.perf_counter() - start
+    return {
+        "path": f"ingest_file ({fmt})",
+        "documents": len(paths),
+        "chunks": chunks,
+        "wall_s": round(wall, 2),
+        "chunks_per_s": round(chunks / wall, 1) if wall else 0.0,
+        "stages": stages,
+        "index_mb": None,
+        **peak_rss_mb(),
+    }
+
+
+def print_table(rows: List[dict]) -> None:
+    stage_names: List[str] = []
+    for row in rows:
+        stage_names.extend(s for s in row["stages"] if s not in stage_names)
+    print()
+    print(f"{'path':<20} {'docs':>6} {'chunks':>8} {'wall s':>8} {'chunks/s':>9} {'RSS MB':>8} {'index MB':>9}  stages (s)")
+    for row in rows:
+        stages = "  ".join(f"{s}={row['stages'][s]:.2f}" for s in stage_names if s in row["stages"])
+        index_mb = f"{row['index_mb']:.2f}" if row["index_mb"] is not None else "-"
+        print(
+            f"{row['path']:<20} {row['documents']:>6} {row['chunks']:>8} {row['wall_s']:>8.2f} "
+            f"{row['chunks_per_s']:>9.1f} {row['peak_rss_mb']:>8.1f} {index_mb:>9}  {stages}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingest() and ingest_file() on a synthetic corpus against a stub embedding server.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--docs", type=int, default=20, help="Documents per format")
+    parser.add_argument("--pages", type=int, default=10, help="Pages (sections) per document")
+    parser.add_argument("--words", type=int, default=400, help="Words per page")
+    parser.add_argument("--xlsx-rows", type=int, default=5000, help="Rows per XLSX sheet")
+    parser.add_argument("--formats", default="pdf,txt,html,docx,xlsx", help="Comma-separated formats to generate")
+    parser.add_argument("--upload-docs", type=int, default=3, help="Files per format sent through ingest_file()")
+    parser.add_argument("--dim", type=int, default=1536, help="Stub embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Simulated latency per embeddings request")
+    parser.add_argument("--workdir", default=None, help="Keep the corpus and index here (default: a temp dir, removed)")
+    parser.add_argument("--json", default=None, help="Also write the rows to this JSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chatbot-bench-")
+    server = start_stub_server(args.dim, args.embed_latency_ms)
+
+    # Must be set before the first get_settings() call
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ.setdefault("API_KEY", "bench")  # required by Settings, unused here
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["ENABLE_SEMANTIC_CACHE"] = "false"
+
+    from chatbot.adapters import supabase_adapter
+    from chatbot.config import get_settings
+
+    get_settings.cache_clear()
+    if not get_settings().supabase_db_url:
+        supabase_adapter.insert_chunks = lambda collection, chunks, embeddings: list(range(len(chunks)))
+
+    try:
+        gen = TextGenerator(args.seed)
+        input_dir = os.path.join(workdir, "input")
+        start = time.perf_counter()
+        for fmt in formats:
+            if fmt in INGEST_FORMATS:
+                write_corpus(input_dir, fmt, args.docs, args.pages, args.words, args.xlsx_rows, gen)
+        upload_paths = {
+            fmt: write_corpus(os.path.join(workdir, "upload", fmt), fmt, args.upload_docs, args.pages, args.words, args.xlsx_rows, gen)
+            for fmt in formats if fmt in UPLOAD_FORMATS
+        }
+        print(f"Corpus written to {workdir} in {time.perf_counter() - start:.1f}s ({directory_mb(workdir):.1f} MB)")
+
+        rows: List[dict] = []
+        if any(fmt in INGEST_FORMATS for fmt in formats):
+            rows.append(bench_ingest(input_dir, os.path.join(workdir, "indexed")))
+        for fmt, paths in upload_paths.items():
+            rows.append(bench_ingest_file(paths, fmt))
+
+        print_table(rows)
+        print(f"\nStub embedding requests: {_EmbeddingHandler.requests}")
+
+        if args.json:
+            os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "rows": rows}, f, indent=2)
+            print(f"Wrote {args.json}")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
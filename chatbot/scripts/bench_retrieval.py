@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Retrieval latency / throughput / recall report for vector_adapter.search and supabase_adapter.search.
+
+Usage:
+    python scripts/bench_retrieval.py
+    python scripts/bench_retrieval.py --sizes 10000,100000,1000000 --concurrency 1,8,32
+    python scripts/bench_retrieval.py --backends faiss,supabase --json data/bench/retrieval.json
+    python scripts/bench_retrieval.py --baseline data/bench/retrieval.json --max-regression 0.2
+
+Unlike bench_index.py, which times raw FAISS indexes, this goes through the adapters the query
+pipeline calls: IndexWriter builds a real collection (FAISS_INDEX_TYPE, chunk store, mmap
+load), and every query is a full search() call including normalization and chunk decoding.
+
+For each corpus size and backend it reports p50/p95/p99 single-query latency, QPS with N
+threads issuing single searches concurrently, and recall@k against exact inner-product search.
+
+Supabase backend:
+    With SUPABASE_DB_URL set, vectors are inserted into chatbot_chunks under a throwaway
+    collection (removed afterwards) and searched through the pool. A local pgvector works:
+        docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=bench pgvector/pgvector:pg16
+    (create chatbot_chunks per cloudflare/supabase-migration.sql; the column is vector(1536),
+    so keep --dim 1536). Without SUPABASE_DB_URL, an in-process stand-in replaces the database
+    with an exact numpy scan: the numbers then cover the adapter (pool, SQL, row mapping),
+    not Postgres, and are labelled "supabase-standin".
+
+--baseline compares this run with an earlier --json report and exits 1 when p95 latency or
+QPS regress by more than --max-regression, or recall drops by more than --max-recall-drop.
+
+Memory: the corpus, the exact-search copy and the index are all in RAM —
+1M x 1536 float32 is ~6 GB per copy; lower --dim for a quick 1M run.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+# Allow running from project root without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Load .env before importing settings
+from dotenv import load_dotenv
+load_dotenv()
+
+import numpy as np
+
+from bench_index import exact_neighbours, latency_percentiles, make_queries, make_vectors, recall_at_k
+
+logger = logging.getLogger(__name__)
+
+BUILD_BATCH = 50_000
+SearchFn = Callable[[np.ndarray], List[int]]
+
+
+# ── FAISS backend ─────────────────────────────────────────────────────────────
+
+def _metadata(start: int, count: int) -> List[dict]:
+    return [
+        {"text": f"chunk {i}", "source": f"doc-{i // 100}.txt", "page_num": 0, "chunk_index": i % 100, "token_count": 2}
+        for i in range(start, start + count)
+    ]
+
+
+def build_faiss(vectors: np.ndarray, indexed_dir: str, collection: str) -> float:
+    """Build and load a collection through IndexWriter; returns build seconds."""
+    from chatbot.adapters import vector_adapter
+
+    start = time.perf_counter()
+    writer = vector_adapter.IndexWriter(indexed_dir, collection)
+    for offset in range(0, len(vectors), BUILD_BATCH):
+        batch = vectors[offset : offset + BUILD_BATCH]
+        writer.add(batch, _metadata(offset, len(batch)))
+    writer.commit()
+    return time.perf_counter() - start
+
+
+def faiss_search(collection: str, k: int) -> SearchFn:
+    from chatbot.adapters import vector_adapter
+
+    return lambda q: [c.vector_id for c in vector_adapter.search(q.tolist(), k=k, collection=collection)]
+
+
+# ── Supabase backend ──────────────────────────────────────────────────────────
+
+class _StandInCursor:
+    """
+    Answers supabase_adapter.search() from a numpy array with an exact cosine scan (pgvector
+    without an ANN index); the set_config() tuning prefix is accepted and ignored.
+    """
+
+    def __init__(self, table: "_StandInTable") -> None:
+        self.table = table
+        self._rows: list = []
+
+    def __enter__(self) -> "_StandInCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, query: str, params=None) -> None:
+        if "chatbot_search" not in query and "FROM chatbot_chunks" not in query:
+            self._rows = []
+            return
+        vec = next(p for p in params if isinstance(p, (list, np.ndarray)))
+        k = int(params[-1])
+        self._rows = self.table.search(np.asarray(vec, dtype=np.float32), k)
+
+    def fetchall(self) -> list:
+        return self._rows
+
+
+class _StandInConnection:
+    closed = 0
+
+    def __init__(self, table: "_StandInTable") -> None:
+        self.table = table
+
+    def cursor(self) -> _StandInCursor:
+        return _StandInCursor(self.table)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+
+class _StandInTable:
+    def __init__(self, vectors: np.ndarray) -> None:
+        self.vectors = vectors  # already L2-normalized
+
+    def search(self, query: np.ndarray, k: int) -> list:
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.vectors @ query
+        top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), f"chunk {i}", f"doc-{i // 100}.txt", 0, 2, float(scores[i])) for i in top]
+
+
+def install_standin(vectors: np.ndarray) -> None:
+    """Route supabase_adapter.connection() to an in-process table holding these vectors."""
+    from chatbot.adapters import supabase_adapter
+
+    table = _StandInTable(vectors)
+
+    @contextmanager
+    def connection():
+        yield _StandInConnection(table)
+
+    supabase_adapter.connection = connection
+
+
+def load_supabase(vectors: np.ndarray, collection: str) -> float:
+    """Insert the corpus into chatbot_chunks (ids offset by the first inserted row); returns seconds."""
+    from chatbot.adapters import supabase_adapter
+
+    start = time.perf_counter()
+    supabase_adapter.delete_collection(collection)
+    for offset in range(0, len(vectors), 1000):
+        batch = vectors[offset : offset + 1000]
+        supabase_adapter.insert_chunks(collection, _metadata(offset, len(batch)), batch.tolist())
+    return time.perf_counter() - start
+
+
+def supabase_search(collection: str, k: int, id_offset: int = 0) -> SearchFn:
+    from chatbot.adapters import supabase_adapter
+
+    return lambda q: [c.vector_id - id_offset for c in supabase_adapter.search(collection, q.tolist(), k=k)]
+
+
+def _first_row_id(collection: str) -> int:
+    from chatbot.adapters import supabase_adapter
+
+    with supabase_adapter.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT min(id) FROM chatbot_chunks WHERE collection = %s", (collection,))
+        return int(cur.fetchone()[0])
+
+
+# ── Measurement ───────────────────────────────────────────────────────────────
+
+def measure(search: SearchFn, queries: np.ndarray, truth: np.ndarray, concurrency: List[int], warmup: int) -> dict:
+    k = truth.shape[1]
+    for q in queries[:warmup]:
+        search(q)
+
+    found = np.full((len(queries), k), -1, dtype=np.int64)
+    timings: List[float] = []
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        ids = search(q)
+        timings.append(time.perf_counter() - start)
+        found[i, : len(ids)] = ids[:k]
+
+    qps: Dict[str, float] = {}
+    for threads in concurrency:
+        counter = iter(range(len(queries)))
+        lock = threading.Lock()
+
+        def worker() -> None:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                search(queries[i])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for _ in range(threads):
+                pool.submit(worker)
+        qps[str(threads)] = round(len(queries) / (time.perf_counter() - start), 1)
+
+    return {f"recall@{k}": round(recall_at_k(found, truth), 4), **latency_percentiles(timings), "qps": qps}
+
+
+def compare(rows: List[dict], baseline: dict, k: int, max_regression: float, max_recall_drop: float) -> List[str]:
+    """Regressions of this run against a baseline report, as human-readable lines."""
+    previous = {(r["backend"], r["n"]): r for r in baseline.get("rows", [])}
+    problems: List[str] = []
+    for row in rows:
+        old = previous.get((row["backend"], row["n"]))
+        if old is None:
+            continue
+        label = f"{row['backend']} n={row['n']}"
+        if row["p95_ms"] > old["p95_ms"] * (1 + max_regression):
+            problems.append(f"{label}: p95 {old['p95_ms']:.3f} → {row['p95_ms']:.3f} ms")
+        for threads, value in row["qps"].items():
+            before = old.get("qps", {}).get(threads)
+            if before and value < before * (1 - max_regression):
+                problems.append(f"{label}: QPS@{threads} {before:.1f} → {value:.1f}")
+        key = f"recall@{k}"
+        if key in old and row[key] < old[key] - max_recall_drop:
+            problems.append(f"{label}: {key} {old[key]:.4f} → {row[key]:.4f}")
+    return problems
+
+
+def print_table(rows: List[dict], k: int, concurrency: List[int]) -> None:
+    qps_headers = "".join(f"{'QPS@' + str(c):>10}" for c in concurrency)
+    print()
+    print(f"{'backend':<17} {'n':>9} {'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'build s':>8}{qps_headers}")
+    for row in rows:
+        qps = "".join(f"{row['qps'][str(c)]:>10.1f}" for c in concurrency)
+        print(
+            f"{row['backend']:<17} {row['n']:>9} {row[f'recall@{k}']:>9.4f} {row['p50_ms']:>8.3f} "
+            f"{row['p95_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['build_s']:>8.2f}{qps}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark vector_adapter / supabase_adapter search latency, QPS and recall.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated corpus sizes")
+    parser.add_argument("--dim", type=int, default=1536, help="Vector dimension")
+    parser.add_argument("--clusters", type=int, default=256, help="Synthetic clusters (0 = uniform)")
+    parser.add_argument("--queries", type=int, default=500, help="Queries per measurement")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed queries before measuring")
+    parser.add_argument("--k", type=int, default=5, help="Neighbours per query")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated thread counts for QPS")
+    parser.add_argument("--backends", default="faiss,supabase", help="Comma-separated backends")
+    parser.add_argument("--index-type", default=None, help="Override FAISS_INDEX_TYPE (flat | hnsw | ivfpq)")
+    parser.add_argument("--json", default=None, help="Also write the rows to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Earlier --json report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative p95 / QPS regression")
+    parser.add_argument("--max-recall-drop", type=float, default=0.01, help="Allowed absolute recall drop")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s — %(message)s", force=True)
+    if args.index_type:
+        os.environ["FAISS_INDEX_TYPE"] = args.index_type
+    os.environ.setdefault("API_KEY", "bench")  # required by Settings, unused here
+
+    from chatbot.config import get_settings
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    live_supabase = "supabase" in backends and bool(settings.supabase_db_url)
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-retrieval-")
+
+    rows: List[dict] = []
+    try:
+        for n in sizes:
+            vectors = make_vectors(n, args.dim, args.clusters)
+            queries = make_queries(vectors, args.queries)
+            truth = exact_neighbours(vectors, queries, args.k)
+            print(f"n={n}: corpus and exact neighbours ready")
+
+            for backend in backends:
+                collection = f"bench_{n}"
+                if backend == "faiss":
+                    name = f"faiss-{settings.faiss_index_type}"
+                    build_s = build_faiss(vectors, workdir, collection)
+                    search = faiss_search(collection, args.k)
+                elif backend == "supabase" and live_supabase:
+                    name = "supabase"
+                    collection = f"bench_retrieval_{n}"
+                    build_s = load_supabase(vectors, collection)
+                    search = supabase_search(collection, args.k, _first_row_id(collection))
+                elif backend == "supabase":
+                    name = "supabase-standin"
+                    start = time.perf_counter()
+                    install_standin(vectors)
+                    build_s = time.perf_counter() - start
+                    search = supabase_search(collection, args.k)
+                else:
+                    raise SystemExit(f"Unknown backend '{backend}'")
+
+                try:
+                    result = measure(search, queries, truth, concurrency, args.warmup)
+                finally:
+                    if name == "supabase":
+                        from chatbot.adapters import supabase_adapter
+                        supabase_adapter.delete_collection(collection)
+                    elif backend == "faiss":
+                        from chatbot.adapters import vector_adapter
+                        vector_adapter.unload_index(collection)
+                rows.append({"backend": name, "n": n, "dim": args.dim, **result, "build_s": round(build_s, 2)})
+                print(f"  {name}: done")
+            del vectors, queries, truth
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(rows, args.k, concurrency)
+
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "k": args.k, "rows": rows}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(rows, json.load(f), args.k, args.max_regression, args.max_recall_drop)
+        if problems:
+            print(f"\nRegressions against {args.baseline}:")
+            for line in problems:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
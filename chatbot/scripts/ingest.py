@@ -5,11 +5,17 @@ Document ingestion script for the Personal RAG Chatbot.
 Usage:
     python scripts/ingest.py
     python scripts/ingest.py --input data/input --collection default
+    python scripts/ingest.py --full
     python scripts/ingest.py --help
 
 Loads all .pdf, .txt, .md, and .html files from the input directory,
 chunks them, embeds them using the configured embedding model, and
 saves the FAISS index to data/indexed/<collection>/.
+
+Re-runs are incremental: manifest.json in the index directory records each
+file's size, mtime, SHA-256 and vector id range, so only new or changed files
+are re-embedded and vectors of deleted files are tombstoned. --full forces a
+complete rebuild.
 """
 from __future__ import annotations
 
@@ -25,6 +31,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
 from dotenv import load_dotenv
 load_dotenv()
 
+from chatbot.adapters import embedding_cache, vision_cache
 from chatbot.services.ingestion_service import ingest
 
 logging.basicConfig(
@@ -54,6 +61,11 @@ def main() -> None:
         default=None,
         help="Collection name for the index (default: DEFAULT_COLLECTION from .env)",
     )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the manifest and rebuild the whole index from scratch",
+    )
     args = parser.parse_args()
 
     print("=" * 60)
@@ -65,14 +77,24 @@ def main() -> None:
             input_dir=args.input,
             indexed_dir=args.output,
             collection=args.collection,
+            full=args.full,
         )
         print()
         print("✓ Ingestion complete.")
         print(f"  Documents processed : {result.documents_processed}")
+        print(f"  Documents unchanged : {result.documents_unchanged}")
+        print(f"  Documents removed   : {result.documents_removed}")
         print(f"  Total chunks created: {result.total_chunks}")
         print(f"  Vectors indexed     : {result.vectors_indexed}")
+        cache_stats = embedding_cache.stats()
+        print(f"  Embedding cache     : {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+        vision_stats = vision_cache.stats()
+        if vision_stats["hits"] or vision_stats["misses"]:
+            print(f"  Vision cache        : {vision_stats['hits']} hits / {vision_stats['misses']} misses")
         print(f"  Index saved to      : {result.index_path}")
         print(f"  Time elapsed        : {result.elapsed_seconds}s")
+        stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in result.stage_seconds.items())
+        print(f"  Stages              : {stages}")
         print()
         print("You can now start the chatbot and query your documents.")
     except FileNotFoundError as exc:
@@ -32,9 +32,21 @@ def upload_file(path: str) -> None:
             )
         resp.raise_for_status()
         data = resp.json()
+        # Ingestion runs in the background — poll the job until it finishes
+        while data["status"] in ("queued", "running"):
+            time.sleep(1.0)
+            resp = httpx.get(
+                f"{API_BASE}/api/v1/upload/{data['job_id']}",
+                headers={"x-api-key": API_KEY},
+                timeout=30.0,
+            )
+            resp.raise_for_status()
+            data = resp.json()
         elapsed = time.time() - start
-        chunks = data.get("chunks_stored", data.get("chunk_count", "?"))
-        print(f"done — {chunks} chunks stored ({elapsed:.1f}s)")
+        if data["status"] == "failed":
+            print(f"FAILED ({data['error']})")
+            return
+        print(f"done — {data['chunks_indexed']} chunks stored ({elapsed:.1f}s)")
     except httpx.HTTPStatusError as e:
         print(f"FAILED (HTTP {e.response.status_code}: {e.response.text})")
     except FileNotFoundError:
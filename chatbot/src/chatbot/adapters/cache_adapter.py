@@ -1,21 +1,33 @@
 from __future__ import annotations
 
+import base64
 import json
 import logging
-from typing import Dict, List, Optional
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+import numpy as np
 import redis as redis_lib
+import redis.asyncio as aredis_lib
 
+from chatbot.adapters import llm_adapter
 from chatbot.config import get_settings
 
 logger = logging.getLogger(__name__)
 
-# Module-level Redis client (None = not connected)
+# Module-level Redis clients (None = not connected); the async one serves the API's event loop
 _redis: Optional[redis_lib.Redis] = None
+_aredis: Optional[aredis_lib.Redis] = None
 _redis_available: bool = False
 
-# In-memory fallback: session_id → list of message dicts
-_memory_store: Dict[str, List[dict]] = {}
+# In-memory fallback: session_id → (monotonic expiry, messages, summary), oldest write first
+_memory_store: "OrderedDict[str, Tuple[float, List[dict], str]]" = OrderedDict()
+_memory_lock = threading.Lock()
 
 
 def init_redis() -> bool:
@@ -23,7 +35,7 @@ def init_redis() -> bool:
     Attempt to connect to Redis. Returns True if successful.
     Falls back to in-memory dict silently if Redis is unavailable.
     """
-    global _redis, _redis_available
+    global _redis, _aredis, _redis_available
     settings = get_settings()
 
     try:
@@ -38,6 +50,16 @@ def init_redis() -> bool:
         )
         _redis = redis_lib.Redis(connection_pool=pool)
         _redis.ping()
+        # Connects lazily, inside whichever event loop first uses it
+        _aredis = aredis_lib.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            password=settings.redis_password or None,
+            max_connections=10,
+            socket_connect_timeout=3,
+            decode_responses=True,
+        )
         _redis_available = True
         logger.info("Redis connected: %s:%d", settings.redis_host, settings.redis_port)
         return True
@@ -52,61 +74,458 @@ def is_redis_connected() -> bool:
 
 
 def _make_key(session_id: str) -> str:
-    return f"chat_history:{session_id}"
+    # A Redis list, one JSON message per element ("v2": the original keys held one JSON blob
+    # and simply expire after CACHE_TTL)
+    return f"chat_history:v2:{session_id}"
+
+
+def _summary_key(session_id: str) -> str:
+    return f"chat_summary:v1:{session_id}"
+
+
+def _turn(question: str, answer: str) -> List[dict]:
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+def _stored_messages(settings) -> int:
+    """
+    Messages kept per session. With summaries on, twice the prompt window: turns older than
+    the window stay stored until the background summary has folded them in.
+    """
+    max_msgs = settings.max_history_turns * 2
+    return max_msgs * 2 if settings.enable_history_summary else max_msgs
+
+
+def _with_summary(messages: List[dict], summary: Optional[str]) -> List[dict]:
+    if not summary:
+        return messages
+    return [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] + messages
+
+
+# ── In-memory fallback ────────────────────────────────────────────────────────
+# Ordered by last write. Every write gets the same CACHE_TTL, so the oldest entry is
+# always the first to expire: expiry and the MEMORY_HISTORY_MAX_SESSIONS cap both pop from the front.
+
+def _memory_get(session_id: str, max_msgs: int) -> List[dict]:
+    with _memory_lock:
+        entry = _memory_store.get(session_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return []
+        return _with_summary(entry[1][-max_msgs:], entry[2])
+
+
+def _memory_append(session_id: str, messages: List[dict], max_msgs: int) -> None:
+    settings = get_settings()
+    now = time.monotonic()
+    with _memory_lock:
+        entry = _memory_store.pop(session_id, None)
+        current, summary = (entry[1], entry[2]) if entry and entry[0] > now else ([], "")
+        _memory_store[session_id] = (now + settings.cache_ttl, (current + messages)[-max_msgs:], summary)
+        while _memory_store:
+            oldest, (expires_at, _, _) = next(iter(_memory_store.items()))
+            if expires_at > now and len(_memory_store) <= settings.memory_history_max_sessions:
+                break
+            del _memory_store[oldest]
+
+
+def _get_pipeline(pipe, session_id: str, max_msgs: int):
+    """The last max_msgs messages and the rolling summary, in one round trip (no MULTI needed)."""
+    pipe.lrange(_make_key(session_id), -max_msgs, -1)
+    pipe.get(_summary_key(session_id))
+    return pipe
 
 
 def get_history(session_id: str) -> List[dict]:
-    """Retrieve the last MAX_HISTORY_TURNS*2 messages for a session."""
+    """
+    Retrieve the last MAX_HISTORY_TURNS*2 messages for a session, preceded by a system message
+    holding the rolling summary of older turns when ENABLE_HISTORY_SUMMARY has produced one.
+    """
     settings = get_settings()
     max_msgs = settings.max_history_turns * 2
 
     if _redis_available and _redis:
         try:
-            raw = _redis.get(_make_key(session_id))
-            if raw:
-                messages = json.loads(raw)
-                return messages[-max_msgs:]
-            return []
+            if not settings.enable_history_summary:
+                return [json.loads(m) for m in _redis.lrange(_make_key(session_id), -max_msgs, -1)]
+            raw, summary = _get_pipeline(_redis.pipeline(transaction=False), session_id, max_msgs).execute()
+            return _with_summary([json.loads(m) for m in raw], summary)
         except Exception as exc:
             logger.warning("Redis get_history failed: %s", exc)
 
-    # In-memory fallback
-    messages = _memory_store.get(session_id, [])
-    return messages[-max_msgs:]
+    return _memory_get(session_id, max_msgs)
+
+
+def _save_pipeline(pipe, session_id: str, question: str, answer: str, max_msgs: int, ttl: int):
+    """Append + trim + refresh TTL, queued on one MULTI/EXEC pipeline: a single round trip, atomic per turn."""
+    key = _make_key(session_id)
+    pipe.rpush(key, *(json.dumps(m) for m in _turn(question, answer)))
+    pipe.ltrim(key, -max_msgs, -1)
+    pipe.expire(key, ttl)
+    if get_settings().enable_history_summary:
+        pipe.expire(_summary_key(session_id), ttl)
+    return pipe
 
 
 def save_history(session_id: str, question: str, answer: str) -> None:
-    """Append a new user+assistant turn to the session history."""
+    """Append a new user+assistant turn to the session history (then maybe summarise, in the background)."""
     settings = get_settings()
-    max_msgs = settings.max_history_turns * 2
+    max_msgs = _stored_messages(settings)
+
+    try:
+        if _redis_available and _redis:
+            try:
+                _save_pipeline(_redis.pipeline(), session_id, question, answer, max_msgs, settings.cache_ttl).execute()
+                return
+            except Exception as exc:
+                logger.warning("Redis save_history failed: %s", exc)
 
-    current = get_history(session_id)
-    current.append({"role": "user", "content": question})
-    current.append({"role": "assistant", "content": answer})
+        _memory_append(session_id, _turn(question, answer), max_msgs)
+    finally:
+        schedule_summary(session_id)
 
-    # Trim to max
-    trimmed = current[-max_msgs:]
 
-    if _redis_available and _redis:
+async def aget_history(session_id: str) -> List[dict]:
+    """Async get_history (redis.asyncio); same in-memory fallback."""
+    settings = get_settings()
+    max_msgs = settings.max_history_turns * 2
+
+    if _redis_available and _aredis:
         try:
-            _redis.setex(
-                _make_key(session_id),
-                settings.cache_ttl,
-                json.dumps(trimmed),
-            )
-            return
+            if not settings.enable_history_summary:
+                return [json.loads(m) for m in await _aredis.lrange(_make_key(session_id), -max_msgs, -1)]
+            raw, summary = await _get_pipeline(_aredis.pipeline(transaction=False), session_id, max_msgs).execute()
+            return _with_summary([json.loads(m) for m in raw], summary)
         except Exception as exc:
-            logger.warning("Redis save_history failed: %s", exc)
+            logger.warning("Redis get_history failed: %s", exc)
 
-    # In-memory fallback
-    _memory_store[session_id] = trimmed
+    return _memory_get(session_id, max_msgs)
+
+
+async def asave_history(session_id: str, question: str, answer: str) -> None:
+    """Async save_history (redis.asyncio); same trimming, in-memory fallback and background summary."""
+    settings = get_settings()
+    max_msgs = _stored_messages(settings)
+
+    try:
+        if _redis_available and _aredis:
+            try:
+                pipe = _save_pipeline(_aredis.pipeline(), session_id, question, answer, max_msgs, settings.cache_ttl)
+                await pipe.execute()
+                return
+            except Exception as exc:
+                logger.warning("Redis save_history failed: %s", exc)
+
+        _memory_append(session_id, _turn(question, answer), max_msgs)
+    finally:
+        schedule_summary(session_id)
 
 
 def clear_history(session_id: str) -> None:
-    """Delete all history for a session."""
+    """Delete all history (and the rolling summary) for a session."""
     if _redis_available and _redis:
         try:
-            _redis.delete(_make_key(session_id))
+            _redis.delete(_make_key(session_id), _summary_key(session_id))
         except Exception as exc:
             logger.warning("Redis clear_history failed: %s", exc)
-    _memory_store.pop(session_id, None)
+    with _memory_lock:
+        _memory_store.pop(session_id, None)
+
+
+# ── Rolling history summary ───────────────────────────────────────────────────
+# After a turn is saved, a background thread checks the session: once the stored turns exceed
+# HISTORY_SUMMARY_THRESHOLD_TOKENS (or the prompt window), all but the last
+# HISTORY_SUMMARY_KEEP_TURNS are folded into the session summary by the summarizer and removed
+# from the list. The fold only commits if those turns are still at the head of the list —
+# a turn appended meanwhile is kept, a concurrent fold or clear wins. Nothing here runs on
+# the request path; a failed or skipped fold is simply retried after the next turn.
+
+# (previous summary, messages to fold in, oldest first) → new summary
+Summarizer = Callable[[str, List[dict]], str]
+
+_SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a documentation assistant. "
+    "Merge the new messages into the current summary. Keep facts, names, numbers, decisions and "
+    "anything the user may refer back to; drop pleasantries. Write at most {max_tokens} tokens "
+    "and reply with the updated summary only.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{messages}"
+)
+
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+_summarizing: Set[str] = set()  # sessions with a fold in flight in this process
+_summarizing_lock = threading.Lock()
+_summarizer: Optional[Summarizer] = None
+
+
+def llm_summarize(summary: str, messages: List[dict]) -> str:
+    """Default summarizer: one chat completion with the configured LLM provider."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = _SUMMARY_PROMPT.format(
+        max_tokens=get_settings().history_summary_max_tokens,
+        summary=summary or "(none yet)",
+        messages=transcript,
+    )
+    return llm_adapter.chat_completion([{"role": "user", "content": prompt}]).strip()
+
+
+def set_summarizer(summarizer: Optional[Summarizer]) -> None:
+    """Plug in another summarizer (e.g. a local model or an extractive one); None restores llm_summarize."""
+    global _summarizer
+    _summarizer = summarizer
+
+
+def schedule_summary(session_id: str) -> Optional[Future]:
+    """Queue a background fold check for the session; returns at once (None if disabled or already queued)."""
+    if not get_settings().enable_history_summary:
+        return None
+    with _summarizing_lock:
+        if session_id in _summarizing:
+            return None
+        _summarizing.add(session_id)
+    try:
+        return _summary_pool.submit(_summarize_session, session_id)
+    except RuntimeError:  # interpreter shutting down
+        with _summarizing_lock:
+            _summarizing.discard(session_id)
+        return None
+
+
+def _fold_count(messages: List[dict]) -> int:
+    """How many of the oldest messages to fold into the summary (0 = leave the history alone)."""
+    settings = get_settings()
+    keep = settings.history_summary_keep_turns * 2
+    if len(messages) <= keep:
+        return 0
+    over_window = len(messages) > settings.max_history_turns * 2
+    tokens = sum(llm_adapter.count_tokens(m["content"]) for m in messages)
+    if not over_window and tokens <= settings.history_summary_threshold_tokens:
+        return 0
+    return len(messages) - keep
+
+
+def _summarize_session(session_id: str) -> bool:
+    """Fold old turns into the summary if the history is over budget; True if a fold was committed."""
+    try:
+        if _redis_available and _redis:
+            raw = _redis.lrange(_make_key(session_id), 0, -1)
+            summary = _redis.get(_summary_key(session_id)) or ""
+            messages = [json.loads(m) for m in raw]
+        else:
+            with _memory_lock:
+                entry = _memory_store.get(session_id)
+                if entry is None or entry[0] <= time.monotonic():
+                    return False
+                messages, summary = list(entry[1]), entry[2]
+            raw = None
+
+        fold = _fold_count(messages)
+        if not fold:
+            return False
+        new_summary = (_summarizer or llm_summarize)(summary, messages[:fold])
+
+        if raw is not None:
+            return _redis_commit_fold(session_id, raw[:fold], new_summary)
+        return _memory_commit_fold(session_id, messages[:fold], new_summary)
+    except Exception as exc:
+        logger.warning("History summary for session %s failed: %s", session_id, exc)
+        return False
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard(session_id)
+
+
+def _redis_commit_fold(session_id: str, folded: List[str], summary: str) -> bool:
+    key = _make_key(session_id)
+    with _redis.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.lrange(key, 0, len(folded) - 1) != folded:
+                return False
+            pipe.multi()
+            pipe.ltrim(key, len(folded), -1)
+            pipe.set(_summary_key(session_id), summary, ex=get_settings().cache_ttl)
+            pipe.execute()
+        except redis_lib.WatchError:
+            return False
+    logger.info("Folded %d messages into the summary of session %s", len(folded), session_id)
+    return True
+
+
+def _memory_commit_fold(session_id: str, folded: List[dict], summary: str) -> bool:
+    with _memory_lock:
+        entry = _memory_store.get(session_id)
+        if entry is None or entry[1][: len(folded)] != folded:
+            return False
+        # Not a write by the user: keep the session's place in the expiry order
+        _memory_store[session_id] = (entry[0], entry[1][len(folded):], summary)
+    return True
+
+
+# ── Semantic answer cache ─────────────────────────────────────────────────────
+# Per collection and generation, Redis holds a list of "<entry id>:<base64 float32 vector>"
+# question entries, a hash of entry id → {answer, sources}, and a count of entries evicted from
+# the head of the list (so list index i is entry number evicted + i). Entry ids are random, so
+# an entry never depends on its list position. Each process mirrors the list locally and only
+# fetches entries appended since its last lookup, re-reading its last mirrored entry to check
+# that the list is still the one it mirrored (it may have expired and been refilled, or the
+# eviction count read may be out of step with a concurrent eviction).
+# invalidate_semantic_cache() bumps the generation, orphaning the old keys until they expire.
+
+
+@dataclass
+class _SemanticMirror:
+    generation: int
+    base: int  # entry number (eviction count + list index) of ids[0]
+    ids: List[str]
+    matrix: np.ndarray  # normalised vectors aligned with ids
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.ids)
+
+
+_semantic_mirror: Dict[str, _SemanticMirror] = {}
+_semantic_lock = threading.Lock()  # guards _semantic_mirror only — never held across Redis calls
+
+
+def _semantic_keys(collection: str, generation: int) -> Tuple[str, str, str]:
+    prefix = f"semantic_cache:v2:{collection}:{generation}"
+    return f"{prefix}:vectors", f"{prefix}:answers", f"{prefix}:evicted"
+
+
+def _parse_semantic_entry(raw: str) -> Tuple[str, np.ndarray]:
+    entry_id, _, encoded = raw.partition(":")
+    return entry_id, np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+
+def _generation_key(collection: str) -> str:
+    return f"semantic_cache:{collection}:generation"
+
+
+def _normalise(vector: List[float]) -> np.ndarray:
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def _sync_semantic_mirror(collection: str, generation: int) -> _SemanticMirror:
+    """Bring the collection's mirror up to date with Redis: Redis calls unlocked, the swap locked."""
+    vectors_key, _, evicted_key = _semantic_keys(collection, generation)
+    with _semantic_lock:
+        current = _semantic_mirror.get(collection)
+    evicted = int(_redis.get(evicted_key) or 0)
+
+    mirror = current
+    if mirror is None or mirror.generation != generation:
+        mirror = _SemanticMirror(generation, evicted, [], np.empty((0, 0), np.float32))
+    elif mirror.base < evicted:  # drop entries evicted since the last lookup
+        drop = min(evicted - mirror.base, len(mirror.ids))
+        mirror = _SemanticMirror(generation, mirror.base + drop, mirror.ids[drop:], mirror.matrix[drop:])
+
+    fetched = None
+    if mirror.ids:
+        fetched = _redis.lrange(vectors_key, mirror.end - 1 - evicted, -1)
+        if not fetched or _parse_semantic_entry(fetched[0])[0] != mirror.ids[-1]:
+            fetched = None  # list expired and was refilled, or evicted moved under us: refetch all
+        else:
+            fetched = fetched[1:]
+    if fetched is None:
+        mirror = _SemanticMirror(generation, evicted, [], np.empty((0, 0), np.float32))
+        fetched = _redis.lrange(vectors_key, 0, -1)
+
+    if fetched:
+        entries = [_parse_semantic_entry(v) for v in fetched]
+        rows = np.stack([vector for _, vector in entries])
+        mirror = _SemanticMirror(
+            generation,
+            mirror.base,
+            mirror.ids + [entry_id for entry_id, _ in entries],
+            rows if not len(mirror.matrix) else np.vstack([mirror.matrix, rows]),
+        )
+
+    with _semantic_lock:
+        latest = _semantic_mirror.get(collection)
+        # Another lookup may have synced meanwhile: keep whichever mirror is further along
+        if latest is current or latest is None or (latest.generation, latest.end) <= (generation, mirror.end):
+            _semantic_mirror[collection] = mirror
+    return mirror
+
+
+def semantic_lookup(collection: str, query_vector: List[float]) -> Optional[dict]:
+    """
+    Return {"answer", "sources"} cached for a question whose embedding is within
+    SEMANTIC_CACHE_MAX_DISTANCE (cosine) of query_vector, or None.
+    Always None without Redis.
+    """
+    if not (_redis_available and _redis):
+        return None
+    settings = get_settings()
+    try:
+        generation = int(_redis.get(_generation_key(collection)) or 0)
+        mirror = _sync_semantic_mirror(collection, generation)
+        if not mirror.ids:
+            return None
+        similarities = mirror.matrix @ _normalise(query_vector)
+        best = int(np.argmax(similarities))
+        if 1.0 - float(similarities[best]) > settings.semantic_cache_max_distance:
+            return None
+        _, answers_key, _ = _semantic_keys(collection, generation)
+        raw = _redis.hget(answers_key, mirror.ids[best])
+        if not raw:
+            return None  # evicted since the mirror was synced
+        logger.info("Semantic cache hit (collection='%s', similarity=%.4f)", collection, similarities[best])
+        return json.loads(raw)
+    except Exception as exc:
+        logger.warning("Redis semantic_lookup failed: %s", exc)
+        return None
+
+
+def semantic_store(collection: str, query_vector: List[float], answer: str, sources: List[dict]) -> None:
+    """
+    Cache an answer under its question embedding for the collection's current generation.
+    Beyond SEMANTIC_CACHE_MAX_ENTRIES the oldest entries are evicted.
+    """
+    if not (_redis_available and _redis):
+        return
+    settings = get_settings()
+    try:
+        generation = int(_redis.get(_generation_key(collection)) or 0)
+        vectors_key, answers_key, evicted_key = _semantic_keys(collection, generation)
+        entry_id = uuid.uuid4().hex
+        encoded = base64.b64encode(_normalise(query_vector).tobytes()).decode("ascii")
+        pipe = _redis.pipeline()
+        # Answer first: a lookup that sees the vector can always fetch its answer
+        pipe.hset(answers_key, entry_id, json.dumps({"answer": answer, "sources": sources}))
+        pipe.rpush(vectors_key, f"{entry_id}:{encoded}")
+        for key in (vectors_key, answers_key, evicted_key):
+            pipe.expire(key, settings.semantic_cache_ttl)
+        length = pipe.execute()[1]
+
+        excess = length - settings.semantic_cache_max_entries
+        if excess > 0:
+            # Pop the head and count it in one transaction, so lookups can realign their mirrors
+            pipe = _redis.pipeline()
+            pipe.lrange(vectors_key, 0, excess - 1)
+            pipe.ltrim(vectors_key, excess, -1)
+            pipe.incrby(evicted_key, excess)
+            pipe.expire(evicted_key, settings.semantic_cache_ttl)
+            popped = pipe.execute()[0]
+            if popped:
+                _redis.hdel(answers_key, *[_parse_semantic_entry(raw)[0] for raw in popped])
+    except Exception as exc:
+        logger.warning("Redis semantic_store failed: %s", exc)
+
+
+def invalidate_semantic_cache(collection: str) -> None:
+    """Drop every cached answer for a collection — call whenever it is re-indexed."""
+    if not get_settings().enable_semantic_cache:
+        return
+    if not _redis_available:
+        init_redis()  # ingestion runs outside the API process
+    if not (_redis_available and _redis):
+        return
+    try:
+        _redis.incr(_generation_key(collection))
+        logger.info("Semantic cache invalidated for collection '%s'", collection)
+    except Exception as exc:
+        logger.warning("Redis invalidate_semantic_cache failed: %s", exc)
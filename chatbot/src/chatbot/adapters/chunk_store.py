@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+"""
+Columnar, memory-mapped chunk metadata for one FAISS collection.
+
+Layout (row = FAISS vector id):
+    chunks_text.bin     UTF-8 chunk texts, concatenated
+    chunks_offsets.npy  int64[n + 1]  byte offsets into chunks_text.bin
+    chunks_source.npy   int32[n]      index into sources.json
+    chunks_page.npy     int32[n]      0-indexed page number
+    chunks_chunk.npy    int32[n]      chunk index within the page
+    chunks_tokens.npy   int32[n]      cl100k_base token count (0 = unknown)
+    chunks_deleted.npy  uint8[n]      1 = tombstoned
+    sources.json        list of source filenames
+
+Everything is opened with mmap, so resident memory and load time do not grow with
+corpus text size; get() decodes only the rows a search actually returns.
+"""
+
+import json
+import logging
+import mmap
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TEXT_FILE = "chunks_text.bin"
+SOURCES_FILE = "sources.json"
+# column name → (file, dtype)
+COLUMNS = {
+    "offsets": ("chunks_offsets.npy", np.int64),
+    "source": ("chunks_source.npy", np.int32),
+    "page_num": ("chunks_page.npy", np.int32),
+    "chunk_index": ("chunks_chunk.npy", np.int32),
+    "token_count": ("chunks_tokens.npy", np.int32),
+    "deleted": ("chunks_deleted.npy", np.uint8),
+}
+# Added after the first release; stores written before then read as zeros
+OPTIONAL_COLUMNS = {"token_count"}
+
+
+def exists(path: str) -> bool:
+    return all(
+        os.path.exists(os.path.join(path, name))
+        for name in [TEXT_FILE, SOURCES_FILE] + [f for c, (f, _) in COLUMNS.items() if c not in OPTIONAL_COLUMNS]
+    )
+
+
+class ChunkStore:
+    """Read-only view over a collection's chunk columns."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, SOURCES_FILE), encoding="utf-8") as f:
+            self.sources: List[str] = json.load(f)
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, (filename, dtype) in COLUMNS.items():
+            file = os.path.join(path, filename)
+            if name in OPTIONAL_COLUMNS and not os.path.exists(file):
+                self.columns[name] = np.zeros(len(self.columns["offsets"]) - 1, dtype)
+            else:
+                self.columns[name] = np.load(file, mmap_mode="r")
+        with open(os.path.join(path, TEXT_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.deleted_count = int(np.count_nonzero(self.columns["deleted"]))
+
+    def __len__(self) -> int:
+        return len(self.columns["source"])
+
+    @property
+    def live_count(self) -> int:
+        return len(self) - self.deleted_count
+
+    def get(self, vector_id: int) -> Optional[dict]:
+        """Decode one row; None if the id is out of range or tombstoned."""
+        if vector_id < 0 or vector_id >= len(self) or self.columns["deleted"][vector_id]:
+            return None
+        offsets = self.columns["offsets"]
+        start, end = int(offsets[vector_id]), int(offsets[vector_id + 1])
+        return {
+            "text": self._text[start:end].decode("utf-8"),
+            "source": self.sources[int(self.columns["source"][vector_id])],
+            "page_num": int(self.columns["page_num"][vector_id]),
+            "chunk_index": int(self.columns["chunk_index"][vector_id]),
+            "token_count": int(self.columns["token_count"][vector_id]),
+        }
+
+
+class ChunkStoreWriter:
+    """
+    Appends rows to (or rebuilds) a chunk store.
+
+    Texts are streamed to disk as rows are added — to the live text file when appending
+    (readers only see bytes covered by their own offsets), or to a temp file for a rebuild.
+    The small per-row columns are buffered and written atomically by commit().
+    """
+
+    def __init__(self, path: str, append: bool = False) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._append = append and exists(path)
+
+        if self._append:
+            base = ChunkStore(path)
+            self._sources = list(base.sources)
+            self._base = {name: np.array(col) for name, col in base.columns.items()}
+            self._text_file = os.path.join(path, TEXT_FILE)
+        else:
+            self._sources = []
+            self._base = {name: np.zeros(1 if name == "offsets" else 0, dtype) for name, (_, dtype) in COLUMNS.items()}
+            self._text_file = os.path.join(path, TEXT_FILE + ".tmp")
+
+        self._source_ids = {name: i for i, name in enumerate(self._sources)}
+        self._text = None  # opened on first write so an unused writer leaves no files behind
+        self._offset = int(self._base["offsets"][-1])
+        self._new: Dict[str, List[int]] = {name: [] for name in COLUMNS}
+        self._removed: List[int] = []
+
+    def _text_handle(self):
+        if self._text is None:
+            self._text = open(self._text_file, "ab" if self._append else "wb")
+            self._text.truncate(self._offset)  # drop bytes left behind by an interrupted run
+        return self._text
+
+    def __len__(self) -> int:
+        return len(self._base["source"]) + len(self._new["source"])
+
+    @property
+    def deleted_count(self) -> int:
+        deleted = set(np.flatnonzero(self._base["deleted"]).tolist()) | set(self._removed)
+        return len(deleted)
+
+    def add(self, rows: Iterable[dict]) -> None:
+        text = self._text_handle()
+        for row in rows:
+            data = row["text"].encode("utf-8")
+            text.write(data)
+            self._offset += len(data)
+            source = row["source"]
+            if source not in self._source_ids:
+                self._source_ids[source] = len(self._sources)
+                self._sources.append(source)
+            self._new["offsets"].append(self._offset)
+            self._new["source"].append(self._source_ids[source])
+            self._new["page_num"].append(int(row.get("page_num", 0)))
+            self._new["chunk_index"].append(int(row.get("chunk_index", 0)))
+            self._new["token_count"].append(int(row.get("token_count", 0)))
+            self._new["deleted"].append(0)
+
+    def add_deleted(self, count: int) -> None:
+        """Reserve tombstoned rows (ids with no chunk, e.g. gaps in legacy metadata)."""
+        for _ in range(count):
+            self._new["offsets"].append(self._offset)
+            self._new["source"].append(0)
+            self._new["page_num"].append(0)
+            self._new["chunk_index"].append(0)
+            self._new["token_count"].append(0)
+            self._new["deleted"].append(1)
+
+    def remove(self, vector_ids: Iterable[int]) -> None:
+        self._removed.extend(int(v) for v in vector_ids)
+
+    def commit(self) -> None:
+        text = self._text_handle()
+        text.flush()
+        os.fsync(text.fileno())
+        text.close()
+        self._text = None
+
+        written = []
+        for name, (filename, dtype) in COLUMNS.items():
+            column = np.concatenate([self._base[name], np.asarray(self._new[name], dtype=dtype)])
+            if name == "deleted" and self._removed:
+                ids = np.asarray([v for v in self._removed if 0 <= v < len(column)], dtype=np.int64)
+                column[ids] = 1
+            target = os.path.join(self.path, filename)
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, column)
+            written.append(target)
+        with open(os.path.join(self.path, SOURCES_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump(self._sources, f)
+        written.append(os.path.join(self.path, SOURCES_FILE))
+
+        if not self._append:
+            os.replace(self._text_file, os.path.join(self.path, TEXT_FILE))
+        for target in written:
+            os.replace(target + ".tmp", target)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from chatbot.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Module-level SQLite connection (None = not opened yet / cache disabled)
+_conn: Optional[sqlite3.Connection] = None
+_conn_path: Optional[str] = None
+_lock = threading.Lock()
+_total_bytes: int = 0
+
+# A hit only rewrites last_used when the stored value is older than this (seconds)
+_TOUCH_INTERVAL = 60.0
+
+# Counters since process start
+_hits: int = 0
+_misses: int = 0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model     TEXT    NOT NULL,
+    text_hash BLOB    NOT NULL,
+    vector    BLOB    NOT NULL,
+    size      INTEGER NOT NULL,
+    last_used REAL    NOT NULL,
+    PRIMARY KEY (model, text_hash)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS embeddings_last_used;
+-- Covers the eviction scan and the size total without reading the vector blobs
+CREATE INDEX IF NOT EXISTS embeddings_last_used_size ON embeddings (last_used, size);
+"""
+
+
+def _get_conn() -> Optional[sqlite3.Connection]:
+    """Open (or reopen after a path change) the cache file. Returns None if EMBEDDING_CACHE_PATH is empty."""
+    global _conn, _conn_path, _total_bytes
+    path = get_settings().embedding_cache_path
+    if not path:
+        return None
+    if _conn is not None and _conn_path == path:
+        return _conn
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")  # ingest script and API process may share the file
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _total_bytes = _stored_bytes(conn)
+    _conn, _conn_path = conn, path
+    logger.info("Embedding cache opened: %s (%.1f MB)", path, _total_bytes / 1e6)
+    return _conn
+
+
+def _stored_bytes(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+
+def _text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def get_many(model: str, texts: List[str]) -> List[Optional[List[float]]]:
+    """
+    Return cached embeddings aligned with texts; None where the (model, text) pair is not cached.
+    Blocking SQLite I/O: async callers run it in a worker thread.
+    """
+    global _hits, _misses
+    with _lock:
+        conn = _get_conn()
+        if conn is None:
+            _misses += len(texts)
+            return [None] * len(texts)
+
+        hashes = [_text_hash(t) for t in texts]
+        found: Dict[bytes, List[float]] = {}
+        stale: List[bytes] = []
+        now = time.time()
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+            part = unique[i : i + 500]
+            rows = conn.execute(
+                "SELECT text_hash, vector, last_used FROM embeddings WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(part))})",
+                [model, *part],
+            ).fetchall()
+            for text_hash, blob, last_used in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if now - last_used > _TOUCH_INTERVAL:
+                    stale.append(text_hash)
+
+        # LRU touch: one write transaction per call, and only for rows not touched recently
+        if stale:
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in stale],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        results = [found.get(h) for h in hashes]
+        hits = sum(1 for r in results if r is not None)
+        _hits += hits
+        _misses += len(results) - hits
+        return results
+
+
+def put_many(model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+    """Store embeddings as float32 blobs, then evict least-recently-used rows beyond EMBEDDING_CACHE_MAX_MB."""
+    with _lock:
+        conn = _get_conn()
+        if conn is None or not texts:
+            return
+
+        now = time.time()
+        conn.execute("BEGIN")
+        try:
+            for text, embedding in zip(texts, embeddings):
+                blob = np.asarray(embedding, dtype=np.float32).tobytes()
+                conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (model, _text_hash(text), blob, len(blob), now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        _evict(conn)
+
+
+def _evict(conn: sqlite3.Connection) -> None:
+    """Drop the least-recently-used rows until the cache is back under 90% of its budget."""
+    global _total_bytes
+    max_bytes = get_settings().embedding_cache_max_mb * 1024 * 1024
+    # Other processes (ingest script, API) write the same file, so a running total would drift
+    _total_bytes = _stored_bytes(conn)
+    if _total_bytes <= max_bytes:
+        return
+
+    to_free = _total_bytes - int(max_bytes * 0.9)
+    victims: List[tuple] = []
+    freed = 0
+    for model, text_hash, size in conn.execute(
+        "SELECT model, text_hash, size FROM embeddings ORDER BY last_used"
+    ):
+        victims.append((model, text_hash))
+        freed += size
+        if freed >= to_free:
+            break
+
+    conn.execute("BEGIN")
+    conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", victims)
+    conn.execute("COMMIT")
+    _total_bytes -= freed
+    logger.info("Embedding cache evicted %d entries (now %.1f MB)", len(victims), _total_bytes / 1e6)
+
+
+def stats() -> dict:
+    """Hit / miss counters since process start plus current cache size."""
+    total = _hits + _misses
+    return {
+        "hits": _hits,
+        "misses": _misses,
+        "hit_rate": round(_hits / total, 4) if total else 0.0,
+        "size_bytes": _total_bytes,
+    }
+
+
+def close() -> None:
+    global _conn, _conn_path
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        _conn, _conn_path = None, None
@@ -1,44 +1,35 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import logging
-from typing import List
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 
-from openai import AzureOpenAI, OpenAI
+import tiktoken
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    AzureOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from chatbot.adapters import embedding_cache, llm_pool, vision_cache
 from chatbot.config import get_settings
 
 logger = logging.getLogger(__name__)
 
-# Separate clients: chat can be Groq/Ollama/OpenAI; embed is always OpenAI
-_chat_client: OpenAI | None = None
+# Chat goes through the endpoint pool in llm_pool (Groq/Ollama/OpenAI); embed is always OpenAI, vision always Groq
 _embed_client: OpenAI | None = None
-
-
-def _get_chat_client() -> OpenAI:
-    global _chat_client
-    if _chat_client is None:
-        settings = get_settings()
-        if settings.llm_provider == "groq":
-            _chat_client = OpenAI(
-                base_url="https://api.groq.com/openai/v1",
-                api_key=settings.groq_api_key,
-            )
-        elif settings.llm_provider == "ollama":
-            _chat_client = OpenAI(
-                base_url=f"{settings.ollama_base_url}/v1",
-                api_key="ollama",
-            )
-        # elif settings.llm_provider == "azure_openai":
-        #     _chat_client = AzureOpenAI(
-        #         azure_endpoint=settings.azure_openai_endpoint,
-        #         api_key=settings.azure_openai_api_key,
-        #         api_version=settings.azure_openai_api_version,
-        #     )
-        else:
-            _chat_client = OpenAI(api_key=settings.openai_api_key)
-    return _chat_client
+_async_embed_client: AsyncOpenAI | None = None
+_vision_client: OpenAI | None = None
 
 
 def _get_embed_client() -> OpenAI:
@@ -46,22 +37,142 @@ def _get_embed_client() -> OpenAI:
     global _embed_client
     if _embed_client is None:
         settings = get_settings()
-        _embed_client = OpenAI(api_key=settings.openai_api_key or None)
+        _embed_client = OpenAI(api_key=settings.openai_api_key or None, base_url=settings.openai_base_url or None)
     return _embed_client
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), reraise=True)
+def _get_async_embed_client() -> AsyncOpenAI:
+    """Async counterpart of _get_embed_client — only valid inside one long-lived event loop."""
+    global _async_embed_client
+    if _async_embed_client is None:
+        settings = get_settings()
+        _async_embed_client = AsyncOpenAI(api_key=settings.openai_api_key or None, base_url=settings.openai_base_url or None)
+    return _async_embed_client
+
+
+# In-process LRU of query embeddings: (model, text) → vector
+_query_cache: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _query_cache_get(key: Tuple[str, str]) -> Optional[List[float]]:
+    with _query_cache_lock:
+        if key in _query_cache:
+            _query_cache.move_to_end(key)
+            return _query_cache[key]
+    return None
+
+
+def _query_cache_put(key: Tuple[str, str], vector: List[float]) -> None:
+    size = get_settings().query_embedding_cache_size
+    if size <= 0:
+        return
+    with _query_cache_lock:
+        _query_cache[key] = vector
+        while len(_query_cache) > size:
+            _query_cache.popitem(last=False)
+
+
 def embed_query(text: str) -> List[float]:
-    """Embed a single text string into a float vector."""
+    """Embed a single text string into a float vector. Repeat questions are served from an LRU."""
+    key = (get_settings().embedding_model, text)
+    vector = _query_cache_get(key)
+    if vector is None:
+        vector = _embed_query_uncached(text, key[0])
+        _query_cache_put(key, vector)
+    return vector
+
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """
+    Embed many questions, preserving input order. LRU hits and duplicates are skipped; the rest
+    go out in as few requests as EMBEDDING_BATCH_MAX_ITEMS / EMBEDDING_BATCH_MAX_TOKENS allow.
+    """
     settings = get_settings()
+    vectors = [_query_cache_get((settings.embedding_model, t)) for t in texts]
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if missing:
+        fresh = dict(zip(missing, _embed_uncached(missing, settings.embedding_batch_max_items)))
+        for text, vector in fresh.items():
+            _query_cache_put((settings.embedding_model, text), vector)
+        vectors = [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+    return vectors  # type: ignore[return-value]
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), reraise=True)
+def _embed_query_uncached(text: str, model: str) -> List[float]:
     client = _get_embed_client()
-    model = settings.embedding_model  # always text-embedding-3-small via OpenAI
-    response = client.embeddings.create(model=model, input=text)
+    response = client.embeddings.create(model=model, input=text)  # always OpenAI
+    return response.data[0].embedding
+
+
+async def aembed_query(text: str) -> List[float]:
+    """Async embed_query — shares its LRU."""
+    key = (get_settings().embedding_model, text)
+    vector = _query_cache_get(key)
+    if vector is None:
+        vector = await _aembed_query_uncached(text, key[0])
+        _query_cache_put(key, vector)
+    return vector
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), reraise=True)
+async def _aembed_query_uncached(text: str, model: str) -> List[float]:
+    response = await _get_async_embed_client().embeddings.create(model=model, input=text)
     return response.data[0].embedding
 
 
-def embed_texts(texts: List[str], batch_size: int = 100) -> List[List[float]]:
-    """Embed a list of texts in batches of batch_size."""
+def _merge_cached(
+    texts: List[str],
+    cached: List[Optional[List[float]]],
+    missing: List[str],
+    fresh: List[List[float]],
+) -> List[List[float]]:
+    embedding_cache.put_many(get_settings().embedding_model, missing, fresh)
+    by_text = dict(zip(missing, fresh))
+    return [vec if vec is not None else by_text[text] for text, vec in zip(texts, cached)]
+
+
+def _cache_lookup(texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+    """Return (cached embeddings aligned with texts, unique texts that still need embedding)."""
+    cached = embedding_cache.get_many(get_settings().embedding_model, texts)
+    missing = list(dict.fromkeys(text for text, vec in zip(texts, cached) if vec is None))
+    return cached, missing
+
+
+def embed_texts(
+    texts: List[str],
+    batch_size: int = 100,
+    token_counts: Optional[Dict[str, int]] = None,
+) -> List[List[float]]:
+    """
+    Embed a list of texts, preserving input order.
+    Texts already in the embedding cache (or repeated within texts) are not sent to the API.
+    token_counts, if given, maps texts to already-known token counts so batch planning
+    doesn't tokenize them again; texts missing from it are counted as usual.
+    """
+    if not texts:
+        return []
+    cached, missing = _cache_lookup(texts)
+    if not missing:
+        return cached  # type: ignore[return-value]
+    return _merge_cached(texts, cached, missing, _embed_uncached(missing, batch_size, token_counts))
+
+
+def _embed_uncached(
+    texts: List[str],
+    batch_size: int,
+    token_counts: Optional[Dict[str, int]] = None,
+) -> List[List[float]]:
+    """
+    Runs the concurrent async path when called outside an event loop;
+    inside a running loop it falls back to sequential batches of batch_size.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_aembed_texts_with_fresh_client(texts, token_counts))
+
     settings = get_settings()
     all_embeddings: List[List[float]] = []
     for i in range(0, len(texts), batch_size):
@@ -71,6 +182,190 @@ def embed_texts(texts: List[str], batch_size: int = 100) -> List[List[float]]:
     return all_embeddings
 
 
+# ── Async embedding (concurrent batches under a token-per-minute budget) ──────
+
+_encoder: Optional[tiktoken.Encoding] = None
+_encoder_failed = False
+
+
+def count_tokens(text: str) -> int:
+    """cl100k_base token count; falls back to a chars/4 estimate if tiktoken can't load its encoding."""
+    global _encoder, _encoder_failed
+    if _encoder is None and not _encoder_failed:
+        try:
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception as exc:
+            logger.warning("tiktoken unavailable (%s) — estimating tokens as chars/4", exc)
+            _encoder_failed = True
+    if _encoder is not None:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def plan_embedding_batches(
+    texts: List[str],
+    max_tokens: int,
+    max_items: int,
+    token_counter: Callable[[str], int] = count_tokens,
+) -> List[Tuple[int, int, int]]:
+    """
+    Split texts into contiguous batches bounded by token count and item count.
+    Returns [(start, end, tokens)] spans over the input list, in order.
+    A single text larger than max_tokens gets a batch of its own.
+    """
+    batches: List[Tuple[int, int, int]] = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        n = token_counter(text)
+        if i > start and (tokens + n > max_tokens or i - start >= max_items):
+            batches.append((start, i, tokens))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts), tokens))
+    return batches
+
+
+class _TokenBudget:
+    """
+    Process-wide token-per-minute bucket shared by every in-flight embedding request.
+    Thread-safe so concurrent event loops (e.g. ingestion threads) draw from one budget.
+    """
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, n: int) -> float:
+        """Take n tokens if available; otherwise return seconds to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            n = min(n, self.capacity)
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate
+
+    async def acquire(self, n: int) -> None:
+        while (wait := self._reserve(n)) > 0:
+            await asyncio.sleep(wait)
+
+    def drain(self) -> None:
+        """Empty the bucket after a 429 so all in-flight workers slow down, not just the one that was throttled."""
+        with self._lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+
+_token_budget: Optional[_TokenBudget] = None
+
+
+def _get_token_budget() -> _TokenBudget:
+    global _token_budget
+    if _token_budget is None:
+        _token_budget = _TokenBudget(get_settings().embedding_tpm_limit)
+    return _token_budget
+
+
+def _retry_after_seconds(exc: Exception, attempt: int) -> float:
+    """Honour the server's retry-after header when present; otherwise exponential backoff with jitter."""
+    response = getattr(exc, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        if header is not None:
+            return float(header)
+    except ValueError:
+        pass
+    return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+async def _aembed_batch(
+    client: AsyncOpenAI,
+    batch: List[str],
+    tokens: int,
+    semaphore: asyncio.Semaphore,
+) -> List[List[float]]:
+    settings = get_settings()
+    budget = _get_token_budget()
+    attempt = 0
+    async with semaphore:
+        while True:
+            await budget.acquire(tokens)
+            try:
+                response = await client.embeddings.create(model=settings.embedding_model, input=batch)
+                return [item.embedding for item in response.data]
+            except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as exc:
+                if attempt >= settings.embedding_max_retries:
+                    raise
+                if isinstance(exc, RateLimitError):
+                    budget.drain()
+                delay = _retry_after_seconds(exc, attempt)
+                attempt += 1
+                logger.warning(
+                    "Embedding batch of %d failed (%s) — retry %d in %.1fs",
+                    len(batch), type(exc).__name__, attempt, delay,
+                )
+                await asyncio.sleep(delay)
+
+
+async def aembed_texts(texts: List[str], client: Optional[AsyncOpenAI] = None) -> List[List[float]]:
+    """
+    Embed texts with up to EMBEDDING_CONCURRENCY batches in flight.
+    Batches are sized by token count (EMBEDDING_BATCH_MAX_TOKENS / _MAX_ITEMS), throttled by
+    EMBEDDING_TPM_LIMIT, and retried with backoff on 429 / transient errors.
+    Cached texts are skipped. Results are returned in input order.
+    """
+    if not texts:
+        return []
+    # The SQLite cache is blocking I/O — keep it off the event loop
+    cached, missing = await asyncio.to_thread(_cache_lookup, texts)
+    if not missing:
+        return cached  # type: ignore[return-value]
+    fresh = await _aembed_uncached(missing, client)
+    return await asyncio.to_thread(_merge_cached, texts, cached, missing, fresh)
+
+
+async def _aembed_uncached(
+    texts: List[str],
+    client: Optional[AsyncOpenAI] = None,
+    token_counts: Optional[Dict[str, int]] = None,
+) -> List[List[float]]:
+    settings = get_settings()
+    client = client or _get_async_embed_client()
+    known = token_counts or {}
+    batches = plan_embedding_batches(
+        texts,
+        max_tokens=settings.embedding_batch_max_tokens,
+        max_items=settings.embedding_batch_max_items,
+        token_counter=lambda text: known.get(text) or count_tokens(text),
+    )
+    logger.info(
+        "Embedding %d texts in %d batches (concurrency=%d)",
+        len(texts), len(batches), settings.embedding_concurrency,
+    )
+    semaphore = asyncio.Semaphore(settings.embedding_concurrency)
+    results = await asyncio.gather(*(
+        _aembed_batch(client, texts[start:end], tokens, semaphore)
+        for start, end, tokens in batches
+    ))
+    return [embedding for batch in results for embedding in batch]
+
+
+async def _aembed_texts_with_fresh_client(
+    texts: List[str],
+    token_counts: Optional[Dict[str, int]] = None,
+) -> List[List[float]]:
+    """asyncio.run() creates a new loop each call — give it a client whose connections live in that loop."""
+    settings = get_settings()
+    async with AsyncOpenAI(api_key=settings.openai_api_key or None, base_url=settings.openai_base_url or None) as client:
+        return await _aembed_uncached(texts, client=client, token_counts=token_counts)
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), reraise=True)
 def _embed_batch(batch: List[str], model: str) -> List[List[float]]:
     client = _get_embed_client()
@@ -78,43 +373,111 @@ def _embed_batch(batch: List[str], model: str) -> List[List[float]]:
     return [item.embedding for item in response.data]
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), reraise=True)
 def chat_completion(messages: List[dict]) -> str:
-    """Call the LLM with a list of messages and return the response text."""
+    """
+    Call the LLM with a list of messages and return the response text. Routed by llm_pool,
+    which fails over between endpoints; retries happen there, not here.
+    """
     settings = get_settings()
-    client = _get_chat_client()
-    model = settings.groq_model if settings.llm_provider == "groq" else settings.llm_model
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=settings.llm_temperature,
-        max_tokens=settings.llm_max_tokens,
-    )
-    return response.choices[0].message.content or ""
+
+    def call(endpoint: llm_pool.Endpoint) -> str:
+        response = endpoint.client.chat.completions.create(
+            model=endpoint.model,
+            messages=messages,
+            temperature=settings.llm_temperature,
+            max_tokens=settings.llm_max_tokens,
+        )
+        return response.choices[0].message.content or ""
+
+    return llm_pool.get_pool().complete(call)
+
+
+async def achat_completion(messages: List[dict]) -> str:
+    """Async chat_completion — the event loop keeps serving other requests while the LLM generates."""
+    settings = get_settings()
+
+    async def call(endpoint: llm_pool.Endpoint) -> str:
+        response = await endpoint.async_client.chat.completions.create(
+            model=endpoint.model,
+            messages=messages,
+            temperature=settings.llm_temperature,
+            max_tokens=settings.llm_max_tokens,
+        )
+        return response.choices[0].message.content or ""
+
+    return await llm_pool.get_pool().acomplete(call)
+
+
+async def astream_chat_completion(messages: List[dict]) -> AsyncIterator[str]:
+    """
+    Yield answer text as the LLM generates it, from the best pool endpoint. Fails over only
+    until the stream opens and is neither retried nor hedged — tokens may already have been sent.
+    """
+    settings = get_settings()
+    last_exc: Optional[Exception] = None
+    for endpoint in llm_pool.get_pool().ranked():
+        start = time.perf_counter()
+        try:
+            stream = await endpoint.async_client.chat.completions.create(
+                model=endpoint.model,
+                messages=messages,
+                temperature=settings.llm_temperature,
+                max_tokens=settings.llm_max_tokens,
+                stream=True,
+            )
+        except Exception as exc:
+            endpoint.record(time.perf_counter() - start, ok=False)
+            logger.warning("LLM endpoint %s failed to open a stream (%s)", endpoint.name, exc)
+            last_exc = exc
+            continue
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            endpoint.record(time.perf_counter() - start, ok=False)
+            raise
+        endpoint.record(time.perf_counter() - start, ok=True)
+        return
+    assert last_exc is not None
+    raise last_exc
+
+
+def _get_vision_client() -> OpenAI:
+    """Groq's OpenAI-compatible API, shared by every vision call (one connection pool)."""
+    global _vision_client
+    if _vision_client is None:
+        _vision_client = OpenAI(
+            base_url="https://api.groq.com/openai/v1",
+            api_key=get_settings().groq_api_key,
+        )
+    return _vision_client
 
 
 def vision_extract(image_bytes: bytes) -> str:
     """
     Send an image to Groq vision and return the extracted text / description.
-    Uses llama-3.2-11b-vision-preview via Groq's OpenAI-compatible API.
+    Uses GROQ_VISION_MODEL via Groq's OpenAI-compatible API. The image is downscaled and
+    deduplicated by vision_cache first, so repeated logos, pages and uploads are sent once.
     Falls back gracefully and returns an empty string on error.
     """
     settings = get_settings()
-    client = OpenAI(
-        base_url="https://api.groq.com/openai/v1",
-        api_key=settings.groq_api_key,
-    )
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
+    return vision_cache.extract(image_bytes, settings.groq_vision_model, _vision_request)
+
+
+def _vision_request(image: vision_cache.PreparedImage) -> Optional[str]:
+    """One vision call; None on error (so the result is not cached)."""
+    b64 = base64.b64encode(image.data).decode("utf-8")
     try:
-        response = client.chat.completions.create(
-            model=settings.groq_vision_model,
+        response = _get_vision_client().chat.completions.create(
+            model=get_settings().groq_vision_model,
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/png;base64,{b64}"},
+                            "image_url": {"url": f"data:{image.mime};base64,{b64}"},
                         },
                         {
                             "type": "text",
@@ -132,7 +495,7 @@ def vision_extract(image_bytes: bytes) -> str:
         return response.choices[0].message.content or ""
     except Exception as exc:
         logger.warning("Groq vision extraction failed: %s", exc)
-        return ""
+        return None
 
 
 def moderate(text: str) -> bool:
@@ -157,3 +520,39 @@ def moderate(text: str) -> bool:
     except Exception as exc:
         logger.warning("Moderation API call failed (failing open): %s", exc)
         return True  # Fail open — don't block users when moderation is unavailable
+
+
+async def amoderate(text: str) -> bool:
+    """Async moderate() — same skip and fail-open rules."""
+    settings = get_settings()
+    if settings.llm_provider in ("ollama", "groq", "azure_openai"):
+        return True
+
+    try:
+        response = await _get_async_embed_client().moderations.create(input=text)
+        flagged = response.results[0].flagged
+        if flagged:
+            logger.warning("Content moderation flagged input. Categories: %s", response.results[0].categories)
+        return not flagged
+    except Exception as exc:
+        logger.warning("Moderation API call failed (failing open): %s", exc)
+        return True
+
+
+def moderate_many(texts: List[str], batch_size: int = 32) -> List[bool]:
+    """moderate() for many texts, batch_size inputs per API call. Same skip / fail-open rules."""
+    settings = get_settings()
+    if settings.llm_provider in ("ollama", "groq", "azure_openai"):
+        return [True] * len(texts)
+
+    client = _get_embed_client()
+    safe: List[bool] = []
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i : i + batch_size]
+        try:
+            response = client.moderations.create(input=batch)
+            safe.extend(not result.flagged for result in response.results)
+        except Exception as exc:
+            logger.warning("Moderation API call failed (failing open): %s", exc)
+            safe.extend([True] * len(batch))
+    return safe
@@ -0,0 +1,308 @@
+"""
+Pool of chat endpoints (provider + model) with health-aware routing, failover and hedged requests.
+
+LLM_ENDPOINTS lists them, e.g. "groq:llama-3.1-8b-instant,openai:gpt-4o-mini"; empty means the
+single LLM_PROVIDER endpoint, which behaves like one plain client. For every completion the pool:
+  - ranks healthy endpoints by rolling median latency inflated by error rate (endpoints never
+    called go first, so every endpoint gets measured; ones that have only failed go last);
+  - with LLM_HEDGE, sends the same request to the runner-up (or the same endpoint again, if it is
+    alone) once the first has outlived its own rolling p95 (never sooner than LLM_HEDGE_MIN_MS),
+    and keeps whichever answers first (async: the loser is cancelled; sync: an HTTP call cannot
+    be interrupted, so the loser finishes in the background and only updates its statistics);
+  - on an error, fails over to the next endpoint.
+An endpoint whose error rate over the last LLM_HEALTH_WINDOW calls reaches LLM_UNHEALTHY_ERROR_RATE
+is skipped for LLM_COOLDOWN_SECONDS, then tried again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
+
+from chatbot import metrics
+from chatbot.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Calls an endpoint needs before its p95 and error rate are trusted
+_MIN_SAMPLES = 5
+
+_llm_latency = metrics.histogram("chatbot_llm_seconds", "Chat completion latency per endpoint", label="endpoint")
+
+
+def _client_kwargs(provider: str) -> dict:
+    settings = get_settings()
+    if provider == "groq":
+        return {"base_url": "https://api.groq.com/openai/v1", "api_key": settings.groq_api_key}
+    if provider == "ollama":
+        return {"base_url": f"{settings.ollama_base_url}/v1", "api_key": "ollama"}
+    # openai (and azure_openai, which has no chat client of its own yet)
+    return {"api_key": settings.openai_api_key, "base_url": settings.openai_base_url or None}
+
+
+class Endpoint:
+    """One provider/model pair: its clients and rolling latency / error statistics."""
+
+    def __init__(self, provider: str, model: str, window: int, max_retries: int = 2) -> None:
+        self.provider = provider
+        self.model = model
+        self.name = f"{provider}:{model}"
+        self.max_retries = max_retries  # retries inside the OpenAI client (with backoff)
+        self.cooldown_until = 0.0
+        self.failures_since_success = 0
+        self._latencies: Deque[float] = deque(maxlen=window)  # seconds, successful calls only
+        self._errors: Deque[bool] = deque(maxlen=window)  # True per failed call
+        self._lock = threading.Lock()
+        self._client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            self._client = OpenAI(max_retries=self.max_retries, **_client_kwargs(self.provider))
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Only valid inside one long-lived event loop, like the other async clients."""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(max_retries=self.max_retries, **_client_kwargs(self.provider))
+        return self._async_client
+
+    def record(self, seconds: float, ok: bool) -> None:
+        settings = get_settings()
+        with self._lock:
+            self._errors.append(not ok)
+            if ok:
+                self._latencies.append(seconds)
+                self.failures_since_success = 0
+            else:
+                self.failures_since_success += 1
+                # The window is kept across the cooldown: an endpoint that fails again on its
+                # first call back goes straight back into cooldown
+                if len(self._errors) >= _MIN_SAMPLES and self._error_rate() >= settings.llm_unhealthy_error_rate:
+                    self.cooldown_until = time.monotonic() + settings.llm_cooldown_seconds
+                    logger.warning("LLM endpoint %s unhealthy (error rate %.0f%%) — skipping it for %ss",
+                                   self.name, 100 * self._error_rate(), settings.llm_cooldown_seconds)
+        if ok:
+            _llm_latency.observe(seconds, self.name)
+
+    def _error_rate(self) -> float:
+        return sum(self._errors) / len(self._errors) if self._errors else 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Rolling latency quantile in seconds; None until _MIN_SAMPLES calls succeeded."""
+        with self._lock:
+            if len(self._latencies) < _MIN_SAMPLES:
+                return None
+            return float(np.quantile(np.fromiter(self._latencies, dtype=float), q))
+
+    def rank_key(self) -> Tuple[int, float]:
+        """
+        Sort key, lowest first: never-called endpoints (explored first), then measured ones by
+        expected latency (median / success rate, × 1 + failures since their last success), then
+        endpoints that have failed without ever succeeding, fewest failures first.
+        """
+        with self._lock:
+            if self._latencies:
+                median = float(np.median(np.fromiter(self._latencies, dtype=float)))
+                return 1, median / max(1.0 - self._error_rate(), 0.05) * (1 + self.failures_since_success)
+            if self.failures_since_success:
+                return 2, float(self.failures_since_success)
+            return 0, 0.0
+
+    def stats(self) -> dict:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        with self._lock:
+            return {
+                "healthy": self.healthy(),
+                "calls": len(self._errors),
+                "error_rate": round(self._error_rate(), 3),
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+
+
+def _timed(endpoint: Endpoint, call: Callable[[Endpoint], T]) -> T:
+    start = time.perf_counter()
+    try:
+        result = call(endpoint)
+    except Exception:
+        endpoint.record(time.perf_counter() - start, ok=False)
+        raise
+    endpoint.record(time.perf_counter() - start, ok=True)
+    return result
+
+
+async def _atimed(endpoint: Endpoint, call: Callable[[Endpoint], Awaitable[T]]) -> T:
+    # A cancelled hedge loser raises CancelledError (not an Exception) and is not recorded
+    start = time.perf_counter()
+    try:
+        result = await call(endpoint)
+    except Exception:
+        endpoint.record(time.perf_counter() - start, ok=False)
+        raise
+    endpoint.record(time.perf_counter() - start, ok=True)
+    return result
+
+
+# Module-level threads for hedged sync calls: the primary and the backup each run on one
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+class LLMPool:
+    def __init__(self, endpoints: List[Endpoint]) -> None:
+        if not endpoints:
+            raise ValueError("LLM pool needs at least one endpoint")
+        self.endpoints = endpoints
+
+    def ranked(self) -> List[Endpoint]:
+        """Healthy endpoints by expected latency, then those cooling down (soonest back first) as a last resort."""
+        healthy = [e for e in self.endpoints if e.healthy()]
+        cooling = sorted((e for e in self.endpoints if not e.healthy()), key=lambda e: e.cooldown_until)
+        return sorted(healthy, key=lambda e: e.rank_key()) + cooling
+
+    def hedge_after(self, endpoint: Endpoint) -> Optional[float]:
+        """Seconds to wait on endpoint before hedging; None when hedging is off or its p95 is not known yet."""
+        settings = get_settings()
+        if not settings.llm_hedge:
+            return None
+        p95 = endpoint.quantile(0.95)
+        if p95 is None:
+            return None
+        return max(p95, settings.llm_hedge_min_ms / 1000)
+
+    def complete(self, call: Callable[[Endpoint], T]) -> T:
+        """call(endpoint) on the best endpoint, hedging and failing over as configured (blocking)."""
+        remaining = self.ranked()
+        last_exc: Optional[BaseException] = None
+        while remaining:
+            primary = remaining.pop(0)
+            deadline = self.hedge_after(primary)
+            if deadline is None:
+                try:
+                    return _timed(primary, call)
+                except Exception as exc:
+                    last_exc = exc
+                    logger.warning("LLM endpoint %s failed (%s)%s", primary.name, exc,
+                                   " — failing over" if remaining else "")
+                    continue
+
+            # Primary and (past the deadline) backup both run on _hedge_pool; the first success wins
+            futures = [_hedge_pool.submit(_timed, primary, call)]
+            done, _ = wait(futures, timeout=deadline)
+            if not done:
+                backup = remaining.pop(0) if remaining else primary
+                logger.info("LLM endpoint %s slower than %.0f ms — hedging on %s", primary.name, deadline * 1000, backup.name)
+                futures.append(_hedge_pool.submit(_timed, backup, call))
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()  # a loser still running finishes in the background
+                    last_exc = future.exception()
+            logger.warning("LLM request failed (%s)%s", last_exc, " — failing over" if remaining else "")
+        assert last_exc is not None
+        raise last_exc
+
+    async def acomplete(self, call: Callable[[Endpoint], Awaitable[T]]) -> T:
+        """Async complete(): the hedge loser is cancelled as soon as a winner answers."""
+        remaining = self.ranked()
+        last_exc: Optional[BaseException] = None
+        while remaining:
+            primary = remaining.pop(0)
+            deadline = self.hedge_after(primary)
+            if deadline is None:
+                try:
+                    return await _atimed(primary, call)
+                except Exception as exc:
+                    last_exc = exc
+                    logger.warning("LLM endpoint %s failed (%s)%s", primary.name, exc,
+                                   " — failing over" if remaining else "")
+                    continue
+
+            tasks = [asyncio.ensure_future(_atimed(primary, call))]
+            try:
+                done, _ = await asyncio.wait(tasks, timeout=deadline)
+                if not done:
+                    backup = remaining.pop(0) if remaining else primary
+                    logger.info("LLM endpoint %s slower than %.0f ms — hedging on %s", primary.name, deadline * 1000, backup.name)
+                    tasks.append(asyncio.ensure_future(_atimed(backup, call)))
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            return task.result()
+                        last_exc = task.exception()
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+            logger.warning("LLM request failed (%s)%s", last_exc, " — failing over" if remaining else "")
+        assert last_exc is not None
+        raise last_exc
+
+    def stats(self) -> Dict[str, dict]:
+        return {e.name: e.stats() for e in self.endpoints}
+
+
+def _configured_endpoints() -> List[Endpoint]:
+    settings = get_settings()
+    window = settings.llm_health_window
+    entries = [e.strip() for e in settings.llm_endpoints.split(",") if e.strip()]
+    if not entries:
+        model = settings.groq_model if settings.llm_provider == "groq" else settings.llm_model
+        return [Endpoint(settings.llm_provider, model, window)]
+    # The one place a failed call is repeated: the client's own retries for a lone endpoint,
+    # failover (no client retries) once there are several
+    max_retries = 2 if len(entries) == 1 else 0
+    endpoints = []
+    for entry in entries:
+        provider, sep, model = entry.partition(":")  # model names may contain ':' (ollama tags)
+        if not sep or not model:
+            raise ValueError(f"LLM_ENDPOINTS entry '{entry}' is not provider:model")
+        endpoints.append(Endpoint(provider, model, window, max_retries))
+    return endpoints
+
+
+# Module-level pool, built from settings on first use
+_pool: Optional[LLMPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> LLMPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LLMPool(_configured_endpoints())
+            logger.info("LLM pool: %s", ", ".join(e.name for e in _pool.endpoints))
+        return _pool
+
+
+def reset() -> None:
+    """Forget the pool and its statistics (rebuilt from settings on next use)."""
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def stats() -> Dict[str, dict]:
+    """Per-endpoint health for /health; empty until the first completion."""
+    with _pool_lock:
+        pool = _pool
+    return pool.stats() if pool is not None else {}
@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+"""
+BM25 inverted index over a collection's chunk store, for hybrid (sparse + dense) retrieval.
+
+Layout (CSR postings, doc id = FAISS vector id):
+    bm25_terms.bin         UTF-8 vocabulary, sorted, concatenated
+    bm25_term_offsets.npy  int64[V + 1]  byte offsets into bm25_terms.bin
+    bm25_indptr.npy        int64[V + 1]  postings range of each term
+    bm25_docs.npy          int32[nnz]    doc ids, ascending within a term
+    bm25_tf.npy            uint16[nnz]   term frequency in that doc
+    bm25_doclen.npy        int32[N]      tokens per doc (0 for tombstoned rows)
+    bm25_meta.json         {"docs": live docs, "avgdl": ..., "version": ..., "rows": ..., "text_bytes": ...}
+
+All arrays are memory-mapped; a query touches only the postings of its own terms.
+build() indexes the whole chunk store; update() (incremental ingestion) only tokenizes rows
+appended since and zeroes the length of rows tombstoned since.
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chatbot.adapters.chunk_store import ChunkStore
+from chatbot.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+TERMS_FILE = "bm25_terms.bin"
+META_FILE = "bm25_meta.json"
+ARRAYS = {
+    "term_offsets": "bm25_term_offsets.npy",
+    "indptr": "bm25_indptr.npy",
+    "docs": "bm25_docs.npy",
+    "tf": "bm25_tf.npy",
+    "doclen": "bm25_doclen.npy",
+}
+
+# Identifiers such as "AB-1234" or "v2.1" are kept whole and also split into their parts
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "what when where which who why will with".split()
+)
+
+# Module-level cache: index directory → loaded SparseIndex
+_cache: Dict[str, "SparseIndex"] = {}
+_cache_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if len(token) > 1 and any(sep in token for sep in "-./"):
+            tokens.extend(part for part in re.split(r"[-./]", token) if part and part not in _STOPWORDS)
+    return tokens
+
+
+def exists(path: str) -> bool:
+    return all(os.path.exists(os.path.join(path, f)) for f in [TERMS_FILE, META_FILE, *ARRAYS.values()])
+
+
+# ── Build ──────────────────────────────────────────────────────────────────────
+
+def _postings(store: ChunkStore, start: int, doclen: np.ndarray) -> Tuple[Dict[str, int], array, array, array]:
+    """Tokenize live rows [start, len(store)); fills doclen and returns (vocab, term ids, doc ids, tfs)."""
+    vocab: Dict[str, int] = {}
+    term_ids, doc_ids, tfs = array("i"), array("i"), array("H")
+    for vid in range(start, len(store)):
+        row = store.get(vid)
+        if row is None:
+            continue
+        counts = Counter(tokenize(row["text"]))
+        doclen[vid] = sum(counts.values())
+        for term, tf in counts.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            doc_ids.append(vid)
+            tfs.append(min(tf, 65535))
+    return vocab, term_ids, doc_ids, tfs
+
+
+def build(path: str) -> int:
+    """
+    (Re)build the BM25 index from the chunk store in path; tombstoned rows are skipped.
+    Returns the number of documents indexed.
+    """
+    store = ChunkStore(path)
+    doclen = np.zeros(len(store), dtype=np.int32)
+    vocab, term_ids, doc_ids, tfs = _postings(store, 0, doclen)
+
+    # Renumber terms in sorted order so lookups can binary-search the mmapped vocabulary
+    terms = sorted(vocab)
+    remap = np.empty(len(vocab), dtype=np.int64)
+    remap[[vocab[t] for t in terms]] = np.arange(len(terms))
+    term_col = remap[np.frombuffer(term_ids, dtype=np.int32)] if term_ids else np.zeros(0, np.int64)
+    docs = np.frombuffer(doc_ids, dtype=np.int32) if doc_ids else np.zeros(0, np.int32)
+    tf = np.frombuffer(tfs, dtype=np.uint16) if tfs else np.zeros(0, np.uint16)
+    return _write(path, store, terms, term_col, docs, tf, doclen)
+
+
+def update(path: str) -> int:
+    """
+    Bring the BM25 index in path up to date with its chunk store, touching only what changed:
+    rows appended since the last build are tokenized and their postings merged in, rows
+    tombstoned since get a zero length (search skips them; their postings stay until the next
+    build(), like the FAISS vectors). Falls back to build() when there is no index yet or the
+    chunk store was rewritten underneath it. Returns the number of live documents.
+    """
+    if not exists(path):
+        return build(path)
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    store = ChunkStore(path)
+    rows = meta.get("rows")
+    if rows is None or rows > len(store) or int(store.columns["offsets"][rows]) != meta.get("text_bytes"):
+        return build(path)  # older index, or the store was rebuilt since
+
+    old_doclen = np.load(os.path.join(path, ARRAYS["doclen"]))
+    doclen = np.zeros(len(store), dtype=np.int32)
+    doclen[:rows] = old_doclen
+    doclen[np.flatnonzero(store.columns["deleted"][:rows])] = 0
+    if rows == len(store) and np.array_equal(doclen, old_doclen):
+        return meta["docs"]  # nothing appended or tombstoned
+
+    vocab, term_ids, doc_ids, tfs = _postings(store, rows, doclen)
+    old = {name: np.load(os.path.join(path, f)) for name, f in ARRAYS.items() if name != "doclen"}
+    with open(os.path.join(path, TERMS_FILE), "rb") as f:
+        blob = f.read()
+
+    offsets_old = old["term_offsets"]
+    old_terms = [blob[offsets_old[i]:offsets_old[i + 1]].decode("utf-8") for i in range(len(offsets_old) - 1)]
+    terms = sorted(set(old_terms).union(vocab))
+    position = {t: i for i, t in enumerate(terms)}
+    old_remap = np.array([position[t] for t in old_terms], dtype=np.int64)
+    new_remap = np.empty(len(vocab), dtype=np.int64)
+    for term, i in vocab.items():
+        new_remap[i] = position[term]
+
+    # Old postings first: new doc ids are all higher, so the stable sort keeps them ascending
+    old_col = old_remap[np.repeat(np.arange(len(old_terms)), np.diff(old["indptr"]))]
+    new_col = new_remap[np.frombuffer(term_ids, dtype=np.int32)] if term_ids else np.zeros(0, np.int64)
+    term_col = np.concatenate([old_col, new_col])
+    docs = np.concatenate([old["docs"], np.frombuffer(doc_ids, dtype=np.int32) if doc_ids else np.zeros(0, np.int32)])
+    tf = np.concatenate([old["tf"], np.frombuffer(tfs, dtype=np.uint16) if tfs else np.zeros(0, np.uint16)])
+    return _write(path, store, terms, term_col, docs, tf, doclen)
+
+
+def _write(
+    path: str,
+    store: ChunkStore,
+    terms: List[str],
+    term_col: np.ndarray,
+    docs: np.ndarray,
+    tf: np.ndarray,
+    doclen: np.ndarray,
+) -> int:
+    """Sort postings by term (stable: doc ids stay ascending) and write the index files."""
+    order = np.argsort(term_col, kind="stable")
+    encoded = [t.encode("utf-8") for t in terms]
+    arrays = {
+        "term_offsets": np.concatenate([[0], np.cumsum([len(b) for b in encoded], dtype=np.int64)]).astype(np.int64),
+        "indptr": np.concatenate([[0], np.cumsum(np.bincount(term_col, minlength=len(terms)))]).astype(np.int64),
+        "docs": docs[order],
+        "tf": tf[order],
+        "doclen": doclen,
+    }
+    live = int(np.count_nonzero(doclen))
+    meta = {
+        "version": VERSION,
+        "docs": live,
+        "avgdl": float(doclen.sum()) / live if live else 0.0,
+        # Chunk store rows covered, and where their text ends: update() indexes rows from here on
+        "rows": len(store),
+        "text_bytes": int(store.columns["offsets"][len(store)]),
+    }
+
+    # Temp names + os.replace, like the FAISS index and chunk store
+    written = []
+    with open(os.path.join(path, TERMS_FILE + ".tmp"), "wb") as f:
+        f.write(b"".join(encoded))
+    written.append(TERMS_FILE)
+    for name, filename in ARRAYS.items():
+        with open(os.path.join(path, filename + ".tmp"), "wb") as f:
+            np.save(f, arrays[name])
+        written.append(filename)
+    with open(os.path.join(path, META_FILE + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    written.append(META_FILE)
+    for filename in written:
+        os.replace(os.path.join(path, filename + ".tmp"), os.path.join(path, filename))
+
+    with _cache_lock:
+        _cache.pop(path, None)
+    logger.info("BM25 index written: %d docs, %d terms, %d postings, path=%s", live, len(terms), len(arrays["docs"]), path)
+    return live
+
+
+# ── Query ──────────────────────────────────────────────────────────────────────
+
+class SparseIndex:
+    """Read-only, memory-mapped BM25 index."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.docs: int = meta["docs"]
+        self.avgdl: float = meta["avgdl"]
+        self.arrays = {name: np.load(os.path.join(path, f), mmap_mode="r") for name, f in ARRAYS.items()}
+        with open(os.path.join(path, TERMS_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._terms = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def _term(self, i: int) -> bytes:
+        offsets = self.arrays["term_offsets"]
+        return self._terms[int(offsets[i]) : int(offsets[i + 1])]
+
+    def term_id(self, term: str) -> Optional[int]:
+        """Binary search over the sorted vocabulary."""
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self.arrays["term_offsets"]) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.arrays["term_offsets"]) - 1 and self._term(lo) == key:
+            return lo
+        return None
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (vector_id, BM25 score) pairs, best first."""
+        settings = get_settings()
+        k1, b = settings.bm25_k1, settings.bm25_b
+        indptr, docs, tf, doclen = (self.arrays[n] for n in ("indptr", "docs", "tf", "doclen"))
+
+        hit_docs: List[np.ndarray] = []
+        hit_scores: List[np.ndarray] = []
+        for term, qtf in Counter(tokenize(query)).items():
+            tid = self.term_id(term)
+            if tid is None:
+                continue
+            start, end = int(indptr[tid]), int(indptr[tid + 1])
+            d = np.asarray(docs[start:end])
+            live = doclen[d] > 0  # update() leaves tombstoned rows' postings in place
+            d = d[live]
+            if not len(d):
+                continue
+            df = len(d)
+            idf = math.log(1 + (self.docs - df + 0.5) / (df + 0.5))
+            f = np.asarray(tf[start:end], dtype=np.float32)[live]
+            norm = k1 * (1 - b + b * doclen[d] / self.avgdl)
+            hit_docs.append(d)
+            hit_scores.append(qtf * idf * f * (k1 + 1) / (f + norm))
+
+        if not hit_docs:
+            return []
+        unique, inverse = np.unique(np.concatenate(hit_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(int(unique[i]), float(scores[i])) for i in top]
+
+
+def load(path: str) -> Optional[SparseIndex]:
+    """Cached SparseIndex for an index directory; None if no BM25 index has been built there."""
+    with _cache_lock:
+        if path not in _cache:
+            if not exists(path):
+                return None
+            _cache[path] = SparseIndex(path)
+        return _cache[path]
+
+
+def search(indexed_dir: str, collection: str, query: str, k: int) -> List[Tuple[int, float]]:
+    index = load(os.path.join(indexed_dir, collection))
+    if index is None:
+        logger.warning("No BM25 index for collection '%s' — run scripts/ingest.py with ENABLE_HYBRID_SEARCH=true", collection)
+        return []
+    return index.search(query, k)
@@ -1,37 +1,133 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import List
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
 
+import numpy as np
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from pgvector.psycopg2 import register_vector
 
+from chatbot import metrics
 from chatbot.adapters.vector_adapter import RetrievedChunk
 from chatbot.config import get_settings
 
 logger = logging.getLogger(__name__)
 
-
-def get_conn() -> psycopg2.extensions.connection:
-    """Open a new psycopg2 connection to Supabase using SUPABASE_DB_URL."""
+_SEARCH_SQL = """
+    SELECT id, content, source, page_num, token_count,
+           1 - (embedding <=> {vec}) AS score{columns}
+    FROM chatbot_chunks
+    WHERE collection = {collection}
+    ORDER BY embedding <=> {vec}
+    LIMIT {k}
+"""
+# Two prepared variants: the stored embedding is only transferred when a caller needs it (MMR)
+_PREPARED_SEARCHES = {
+    name: f"PREPARE {name}(vector, text, int) AS "
+    + _SEARCH_SQL.format(vec="$1", collection="$2", k="$3", columns=columns)
+    for name, columns in (("chatbot_search", ""), ("chatbot_search_embeddings", ", embedding"))
+}
+
+_pool_wait = metrics.histogram(
+    "chatbot_supabase_pool_wait_seconds", "Time spent waiting for a pooled Supabase connection"
+)
+_query_latency = metrics.histogram(
+    "chatbot_supabase_query_seconds", "Supabase query latency, connection checkout excluded", label="op"
+)
+
+
+class _VectorConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """ThreadedConnectionPool whose connections have pgvector registered and search prepared once."""
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        register_vector(conn)
+        if get_settings().supabase_prepared_statements:
+            with conn.cursor() as cur:
+                for statement in _PREPARED_SEARCHES.values():
+                    cur.execute(statement)
+            conn.commit()
+        return conn
+
+
+# Module-level pool; psycopg2 raises instead of blocking when it is exhausted, so a
+# semaphore sized to maxconn makes callers queue (up to SUPABASE_POOL_TIMEOUT) instead
+_pool: Optional[_VectorConnectionPool] = None
+_pool_slots: Optional[threading.BoundedSemaphore] = None
+_pool_lock = threading.Lock()
+
+
+def init_pool() -> None:
+    """Create the pool and open SUPABASE_POOL_MIN connections now (called from the app lifespan)."""
+    global _pool, _pool_slots
     settings = get_settings()
-    conn = psycopg2.connect(settings.supabase_db_url)
-    register_vector(conn)
-    return conn
+    with _pool_lock:
+        if _pool is not None:
+            return
+        _pool = _VectorConnectionPool(
+            settings.supabase_pool_min, settings.supabase_pool_max, settings.supabase_db_url
+        )
+        _pool_slots = threading.BoundedSemaphore(settings.supabase_pool_max)
+    logger.info(
+        "Supabase connection pool ready (min=%d, max=%d)", settings.supabase_pool_min, settings.supabase_pool_max
+    )
+
+
+def close_pool() -> None:
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool, _pool_slots = None, None
+
+
+@contextmanager
+def connection() -> Iterator[psycopg2.extensions.connection]:
+    """
+    Borrow a pooled connection (the pool is created lazily if the lifespan did not warm it).
+    The transaction is committed on success and rolled back on error; broken connections are discarded.
+    """
+    if _pool is None:
+        init_pool()
+    pool, slots = _pool, _pool_slots
+
+    start = time.perf_counter()
+    if not slots.acquire(timeout=get_settings().supabase_pool_timeout):
+        raise TimeoutError("Timed out waiting for a Supabase connection from the pool.")
+    try:
+        conn = pool.getconn()
+        _pool_wait.observe(time.perf_counter() - start)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        slots.release()
 
 
 def insert_chunks(
     collection: str,
     chunks: List[dict],
     embeddings: List[List[float]],
-) -> None:
+) -> List[int]:
     """
-    Batch-insert chunks + their embeddings into chatbot_chunks.
-    Each chunk dict must have: text, source, page_num, chunk_index.
+    Batch-insert chunks + their embeddings into chatbot_chunks and return the new row ids.
+    Each chunk dict must have: text, source, page_num, chunk_index; token_count is optional
+    (0 = unknown, counted at query time).
     """
     if not chunks:
-        return
+        return []
 
     rows = [
         (
@@ -40,56 +136,78 @@ def insert_chunks(
             chunks[i].get("page_num", 0),
             chunks[i].get("chunk_index", i),
             chunks[i]["text"],
+            chunks[i].get("token_count", 0),
             embeddings[i],
         )
         for i in range(len(chunks))
     ]
 
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            psycopg2.extras.execute_values(
-                cur,
-                """
-                INSERT INTO chatbot_chunks
-                    (collection, source, page_num, chunk_index, content, embedding)
-                VALUES %s
-                """,
-                rows,
-                template="(%s, %s, %s, %s, %s, %s::vector)",
-            )
-        conn.commit()
-        logger.info("Inserted %d chunks into Supabase (collection='%s')", len(rows), collection)
-    finally:
-        conn.close()
+    with connection() as conn, _query_latency.time("insert"), conn.cursor() as cur:
+        inserted = psycopg2.extras.execute_values(
+            cur,
+            """
+            INSERT INTO chatbot_chunks
+                (collection, source, page_num, chunk_index, content, token_count, embedding)
+            VALUES %s
+            RETURNING id
+            """,
+            rows,
+            template="(%s, %s, %s, %s, %s, %s, %s::vector)",
+            fetch=True,
+        )
+    logger.info("Inserted %d chunks into Supabase (collection='%s')", len(rows), collection)
+    return [row[0] for row in inserted]
+
+
+def delete_chunks(ids: List[int]) -> None:
+    """Delete chunks by row id (rolls back a partially stored upload)."""
+    if not ids:
+        return
+    with connection() as conn, _query_latency.time("delete"), conn.cursor() as cur:
+        cur.execute("DELETE FROM chatbot_chunks WHERE id = ANY(%s)", (list(ids),))
+    logger.info("Deleted %d chunks from Supabase", len(ids))
 
 
 def search(
     collection: str,
     query_vec: List[float],
     k: int = 5,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    with_embeddings: bool = False,
 ) -> List[RetrievedChunk]:
     """
     Cosine similarity search using pgvector <=> operator.
     Returns up to k chunks ordered by similarity (highest first).
+    ef_search / probes override PGVECTOR_HNSW_EF_SEARCH / PGVECTOR_IVFFLAT_PROBES for this query;
+    they are applied with set_config(..., is_local => true) in the same round trip as the search.
+    with_embeddings=True also returns each chunk's stored vector, e.g. for MMR.
     """
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, content, source, page_num,
-                       1 - (embedding <=> %s::vector) AS score
-                FROM chatbot_chunks
-                WHERE collection = %s
-                ORDER BY embedding <=> %s::vector
-                LIMIT %s
-                """,
-                (query_vec, collection, query_vec, k),
-            )
-            rows = cur.fetchall()
-    finally:
-        conn.close()
+    settings = get_settings()
+    ef_search = ef_search or settings.pgvector_hnsw_ef_search
+    probes = probes or settings.pgvector_ivfflat_probes
+
+    if settings.supabase_prepared_statements:
+        statement = "chatbot_search_embeddings" if with_embeddings else "chatbot_search"
+        query = f"EXECUTE {statement}(%s::vector, %s, %s)"
+        params: list = [query_vec, collection, k]
+    else:
+        columns = ", embedding" if with_embeddings else ""
+        query = _SEARCH_SQL.format(vec="%s::vector", collection="%s", k="%s", columns=columns)
+        params = [query_vec, collection, query_vec, k]
+
+    tuning = []
+    if ef_search:
+        tuning.append(("hnsw.ef_search", ef_search))
+    if probes:
+        tuning.append(("ivfflat.probes", probes))
+    if tuning:
+        query = "SELECT " + ", ".join("set_config(%s, %s, true)" for _ in tuning) + "; " + query
+        params = [v for name, value in tuning for v in (name, str(value))] + params
+
+    with connection() as conn, _query_latency.time("search"), conn.cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
 
     return [
         RetrievedChunk(
@@ -97,33 +215,41 @@ def search(
             text=row[1],
             source=row[2],
             page_num=row[3] or 0,
-            score=float(row[4]),
+            score=float(row[5]),
+            token_count=row[4] or 0,
+            embedding=np.asarray(row[6], dtype=np.float32) if with_embeddings else None,
         )
         for row in rows
     ]
 
 
+async def asearch(
+    collection: str,
+    query_vec: List[float],
+    k: int = 5,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    with_embeddings: bool = False,
+) -> List[RetrievedChunk]:
+    """
+    search() for the event loop. psycopg2 has no async API, so the pooled query runs on a worker
+    thread; the pool bounds how many run at once.
+    """
+    return await asyncio.to_thread(search, collection, query_vec, k, ef_search, probes, with_embeddings)
+
+
 def delete_collection(collection: str) -> None:
     """Delete all chunks for a given collection."""
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM chatbot_chunks WHERE collection = %s", (collection,))
-        conn.commit()
-        logger.info("Deleted collection '%s' from Supabase", collection)
-    finally:
-        conn.close()
+    with connection() as conn, _query_latency.time("delete"), conn.cursor() as cur:
+        cur.execute("DELETE FROM chatbot_chunks WHERE collection = %s", (collection,))
+    logger.info("Deleted collection '%s' from Supabase", collection)
 
 
 def collection_exists(collection: str) -> bool:
     """Return True if at least one chunk exists for the collection."""
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT 1 FROM chatbot_chunks WHERE collection = %s LIMIT 1",
-                (collection,),
-            )
-            return cur.fetchone() is not None
-    finally:
-        conn.close()
+    with connection() as conn, _query_latency.time("exists"), conn.cursor() as cur:
+        cur.execute(
+            "SELECT 1 FROM chatbot_chunks WHERE collection = %s LIMIT 1",
+            (collection,),
+        )
+        return cur.fetchone() is not None
@@ -1,16 +1,30 @@
 from __future__ import annotations
 
+import json
 import logging
+import math
 import os
 import pickle
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import faiss
 import numpy as np
 
+from chatbot.adapters import chunk_store
+from chatbot.adapters.chunk_store import ChunkStore, ChunkStoreWriter
+from chatbot.config import get_settings
+
 logger = logging.getLogger(__name__)
 
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+# Types whose bulk data FAISS can memory-map on read (IVF inverted lists); flat and HNSW
+# are always copied to the heap by faiss.read_index.
+MMAP_INDEX_TYPES = ("ivfpq",)
+
 
 @dataclass
 class RetrievedChunk:
@@ -19,89 +33,460 @@ class RetrievedChunk:
     page_num: int  # 0-indexed from loader, converted to 1-indexed in response
     score: float   # Higher = more similar (inner product after L2 normalization)
     vector_id: int
+    token_count: int = 0  # stored at ingest; 0 = unknown (counted on demand)
+    embedding: Optional[np.ndarray] = None  # stored vector, only when asked for (with_embeddings=True)
 
 
-# Module-level cache: collection_name → (faiss_index, metadata_dict)
-_index_cache: Dict[str, Tuple[faiss.Index, Dict[int, dict]]] = {}
+@dataclass
+class IndexResidency:
+    type: str
+    vectors: int
+    mmap: bool
+    load_seconds: float
+    resident_bytes: int  # heap copy of the index — counted against INDEX_MEMORY_BUDGET_MB
+    mapped_bytes: int    # file-backed pages (mmapped lists + chunk store), reclaimable by the OS
+
+
+# Module-level cache: collection_name → (faiss_index, memory-mapped chunk store),
+# ordered least- to most-recently used so cold collections can be evicted
+_index_cache: "OrderedDict[str, Tuple[faiss.Index, ChunkStore]]" = OrderedDict()
+_residency: Dict[str, IndexResidency] = {}
+_cache_lock = threading.RLock()
 
 
 def _index_path(indexed_dir: str, collection: str) -> str:
     return os.path.join(indexed_dir, collection)
 
 
-def load_index(indexed_dir: str, collection: str = "default") -> bool:
+# ── Index types (flat / HNSW / IVF-PQ) ────────────────────────────────────────
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest divisor of dimension that is ≤ dimension / 16 (e.g. 96 for 1536 → 16 dims per code byte)."""
+    target = max(1, dimension // 16)
+    return max(m for m in range(1, target + 1) if dimension % m == 0)
+
+
+def build_faiss_index(
+    index_type: str,
+    dimension: int,
+    training_vectors: Optional[np.ndarray] = None,
+) -> Tuple[faiss.Index, dict]:
     """
-    Load FAISS index and metadata from disk into module-level cache.
-    Returns True if loaded successfully, False if index files not found.
-    Thread-safe for concurrent reads; not safe for concurrent writes.
+    Create an empty (trained, if needed) inner-product index of the requested type.
+    Returns (index, config) where config is what gets recorded in index.json.
+    IVF-PQ needs training_vectors; with too few of them it falls back to flat.
     """
-    if collection in _index_cache:
-        return True  # Already cached
+    settings = get_settings()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}'. Supported: {INDEX_TYPES}")
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+        config = {
+            "type": "hnsw",
+            "m": settings.hnsw_m,
+            "ef_construction": settings.hnsw_ef_construction,
+            "ef_search": settings.hnsw_ef_search,
+        }
+    elif index_type == "ivfpq":
+        n_train = 0 if training_vectors is None else len(training_vectors)
+        nlist = settings.ivf_nlist or int(4 * math.sqrt(max(n_train, 1)))
+        nlist = max(1, min(nlist, n_train // 39))  # FAISS wants ≥ 39 training points per centroid
+        nbits = settings.pq_nbits
+        if n_train < max(2 ** nbits, 39 * nlist):
+            logger.warning(
+                "Only %d vectors to train IVF-PQ (need ≥ %d) — using a flat index instead",
+                n_train, max(2 ** nbits, 39 * nlist),
+            )
+            return build_faiss_index("flat", dimension)
+        m = settings.pq_m or _pq_subquantizers(dimension)
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        index.train(training_vectors)
+        config = {"type": "ivfpq", "nlist": nlist, "pq_m": m, "pq_nbits": nbits, "nprobe": settings.ivf_nprobe}
+    else:
+        index = faiss.IndexFlatIP(dimension)
+        config = {"type": "flat"}
+
+    config["dimension"] = dimension
+    apply_search_params(index, config)
+    return index, config
+
+
+def apply_search_params(index: faiss.Index, config: dict) -> None:
+    """Set efSearch / nprobe on an index from its recorded config."""
+    if config.get("type") == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = int(config["ef_search"])
+    elif config.get("type") == "ivfpq":
+        faiss.extract_index_ivf(index).nprobe = int(config["nprobe"])
+
+
+def _migrate_pickled_metadata(path: str) -> None:
+    """Convert a legacy index.pkl (Dict[int, dict]) into the columnar chunk store, once."""
+    meta_file = os.path.join(path, "index.pkl")
+    if chunk_store.exists(path) or not os.path.exists(meta_file):
+        return
+    with open(meta_file, "rb") as f:
+        metadata: Dict[int, dict] = pickle.load(f)
+
+    writer = ChunkStoreWriter(path)
+    next_id = 0
+    for vid in sorted(metadata):
+        writer.add_deleted(vid - next_id)  # ids missing from the dict were tombstoned
+        writer.add([metadata[vid]])
+        next_id = vid + 1
+    writer.commit()
+    logger.info("Migrated %s to the columnar chunk store (%d chunks)", meta_file, len(metadata))
+
+
+def _read_index_config(path: str) -> dict:
+    """index.json records how the index was built; indexes from before it existed are flat."""
+    config_file = os.path.join(path, "index.json")
+    if not os.path.exists(config_file):
+        return {"type": "flat"}
+    with open(config_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def set_search_params(
+    collection: str,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+) -> None:
+    """Tune a loaded collection at runtime (e.g. from a benchmark) without rewriting index.json."""
+    index, _ = _index_cache[collection]
+    index = faiss.downcast_index(index)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+
+
+def _dir_bytes(path: str, names: Iterable[str]) -> int:
+    return sum(os.path.getsize(os.path.join(path, n)) for n in names if os.path.exists(os.path.join(path, n)))
+
 
-    path = _index_path(indexed_dir, collection)
+def _read_faiss(path: str, config: dict) -> Tuple[faiss.Index, IndexResidency]:
+    """Read index.faiss, memory-mapping it when the type allows; also measure what it costs."""
     faiss_file = os.path.join(path, "index.faiss")
-    meta_file = os.path.join(path, "index.pkl")
+    use_mmap = get_settings().faiss_mmap and config["type"] in MMAP_INDEX_TYPES
+
+    start = time.perf_counter()
+    index = faiss.read_index(faiss_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if use_mmap else 0)
+
+    # IVF indexes need an id → list map to reconstruct vectors (MMR). Built here, before the
+    # index is shared: building it later would mutate an index other threads are searching
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    load_seconds = time.perf_counter() - start
+
+    file_bytes = os.path.getsize(faiss_file)
+    mapped = 0
+    if use_mmap:
+        mapped = min(file_bytes, index.ntotal * (ivf.code_size + 8))  # codes + int64 ids per vector
+    direct_map_bytes = index.ntotal * 8 if ivf is not None else 0  # one int64 per vector, in RAM
+    store_files = [chunk_store.TEXT_FILE] + [f for f, _ in chunk_store.COLUMNS.values()]
+    residency = IndexResidency(
+        type=config["type"],
+        vectors=index.ntotal,
+        mmap=use_mmap,
+        load_seconds=round(load_seconds, 4),
+        resident_bytes=file_bytes - mapped + direct_map_bytes,
+        mapped_bytes=mapped + _dir_bytes(path, store_files),
+    )
+    return index, residency
+
 
-    if not os.path.exists(faiss_file) or not os.path.exists(meta_file):
+def _evict_cold(keep: str) -> None:
+    """Unload least-recently-used collections until resident bytes fit INDEX_MEMORY_BUDGET_MB."""
+    budget = get_settings().index_memory_budget_mb * 1024 * 1024
+    if budget <= 0:
+        return
+    while sum(r.resident_bytes for r in _residency.values()) > budget:
+        victim = next((name for name in _index_cache if name != keep), None)
+        if victim is None:
+            break  # a single collection larger than the budget stays resident
+        _index_cache.pop(victim)
+        freed = _residency.pop(victim).resident_bytes
+        logger.info("FAISS index evicted: collection='%s' (%.1f MB freed)", victim, freed / 1e6)
+
+
+def _load(path: str, collection: str) -> bool:
+    faiss_file = os.path.join(path, "index.faiss")
+    if os.path.exists(faiss_file):
+        _migrate_pickled_metadata(path)
+    if not os.path.exists(faiss_file) or not chunk_store.exists(path):
         logger.warning("FAISS index not found at %s. Run scripts/ingest.py first.", path)
         return False
 
-    index = faiss.read_index(faiss_file)
-    with open(meta_file, "rb") as f:
-        metadata: Dict[int, dict] = pickle.load(f)
+    config = _read_index_config(path)
+    index, residency = _read_faiss(path, config)
+    apply_search_params(index, config)
+    store = ChunkStore(path)
 
-    _index_cache[collection] = (index, metadata)
+    _index_cache[collection] = (index, store)
+    _index_cache.move_to_end(collection)
+    _residency[collection] = residency
+    _evict_cold(keep=collection)
     logger.info(
-        "FAISS index loaded: collection='%s', vectors=%d, path=%s",
-        collection, index.ntotal, path,
+        "FAISS index loaded: collection='%s', type=%s, vectors=%d, mmap=%s, %.3fs, path=%s",
+        collection, config["type"], index.ntotal, residency.mmap, residency.load_seconds, path,
     )
     return True
 
 
+def load_index(indexed_dir: str, collection: str = "default") -> bool:
+    """
+    Load FAISS index and chunk store from disk into module-level cache (no-op if resident).
+    Returns True if loaded successfully, False if index files not found.
+    Loading may evict the least-recently-used collections to stay within INDEX_MEMORY_BUDGET_MB.
+    """
+    with _cache_lock:
+        if collection in _index_cache:
+            _index_cache.move_to_end(collection)
+            return True  # Already cached
+        return _load(_index_path(indexed_dir, collection), collection)
+
+
 def reload_index(indexed_dir: str, collection: str = "default") -> bool:
     """Force-reload index from disk (clears cache entry first)."""
-    _index_cache.pop(collection, None)
-    return load_index(indexed_dir, collection)
+    with _cache_lock:
+        unload_index(collection)
+        return load_index(indexed_dir, collection)
+
+
+def unload_index(collection: str) -> None:
+    with _cache_lock:
+        _index_cache.pop(collection, None)
+        _residency.pop(collection, None)
 
 
 def is_index_loaded(collection: str = "default") -> bool:
     return collection in _index_cache
 
 
+def residency_stats() -> Dict[str, dict]:
+    """Per-collection load time and memory footprint, least- to most-recently used."""
+    with _cache_lock:
+        return {name: asdict(_residency[name]) for name in _index_cache if name in _residency}
+
+
 def search(
     query_vector: List[float],
     k: int = 5,
     collection: str = "default",
+    with_embeddings: bool = False,
 ) -> List[RetrievedChunk]:
     """
     Search the FAISS index for the k most similar chunks.
     Returns a list of RetrievedChunk sorted by score descending.
     """
-    if collection not in _index_cache:
-        raise RuntimeError(f"FAISS index for collection '{collection}' is not loaded.")
+    return search_batch([query_vector], k=k, collection=collection, with_embeddings=with_embeddings)[0]
+
 
-    index, metadata = _index_cache[collection]
+def search_batch(
+    query_vectors: Union[np.ndarray, List[List[float]]],
+    k: int = 5,
+    collection: str = "default",
+    with_embeddings: bool = False,
+) -> List[List[RetrievedChunk]]:
+    """
+    Search many queries at once: one index.search over the (n, d) matrix, which FAISS
+    parallelizes across queries internally. Returns one score-sorted list per query row.
+    with_embeddings=True also fills each chunk's stored (normalized) vector, e.g. for MMR.
+    """
+    with _cache_lock:
+        if collection not in _index_cache:
+            raise RuntimeError(f"FAISS index for collection '{collection}' is not loaded.")
+        index, store = _index_cache[collection]
+        _index_cache.move_to_end(collection)
+
+    # Normalize query vectors for cosine similarity (inner-product index)
+    vecs = np.array(query_vectors, dtype=np.float32, ndmin=2)
+    if len(vecs) == 0:
+        return []
+    faiss.normalize_L2(vecs)
+
+    # Tombstoned vectors stay in the index — over-fetch to compensate
+    scores, ids = index.search(vecs, k + store.deleted_count)
+
+    batch: List[List[RetrievedChunk]] = []
+    for row_scores, row_ids in zip(scores, ids):
+        results: List[RetrievedChunk] = []
+        for score, vid in zip(row_scores, row_ids):
+            if vid == -1:
+                continue  # FAISS returns -1 when fewer than k results exist
+            chunk = _to_chunk(store, int(vid), float(score))
+            if chunk is None:
+                continue  # Tombstoned (file deleted or changed since it was indexed)
+            results.append(chunk)
+            if len(results) == k:
+                break
+        if with_embeddings:
+            _attach_embeddings(index, results)
+        batch.append(results)
+    return batch
+
+
+def _attach_embeddings(index: faiss.Index, chunks: List[RetrievedChunk]) -> None:
+    """Fill chunk.embedding from the index: exact for flat / HNSW, PQ-decoded for IVF-PQ."""
+    if not chunks:
+        return
+    ids = np.array([c.vector_id for c in chunks], dtype=np.int64)
+    try:
+        vectors = index.reconstruct_batch(ids)  # IVF: uses the direct map built by _read_faiss
+    except RuntimeError as exc:
+        logger.warning("Cannot reconstruct stored vectors from this index: %s", exc)
+        return
+    for chunk, vector in zip(chunks, vectors):
+        chunk.embedding = vector
+
+
+def _to_chunk(store: ChunkStore, vector_id: int, score: float) -> Optional[RetrievedChunk]:
+    meta = store.get(vector_id)  # decodes only this row's text
+    if meta is None:
+        return None
+    return RetrievedChunk(
+        text=meta.get("text", ""),
+        source=meta.get("source", "unknown"),
+        page_num=meta.get("page_num", 0),
+        score=score,
+        vector_id=vector_id,
+        token_count=meta.get("token_count", 0),
+    )
 
-    # Normalize query vector for cosine similarity (IndexFlatIP)
-    vec = np.array([query_vector], dtype=np.float32)
-    faiss.normalize_L2(vec)
 
-    scores, ids = index.search(vec, k)
+def get_chunks(
+    hits: Iterable[Tuple[int, float]],
+    collection: str = "default",
+    with_embeddings: bool = False,
+) -> List[RetrievedChunk]:
+    """RetrievedChunks for (vector_id, score) pairs found elsewhere (e.g. BM25); tombstoned ids are dropped."""
+    with _cache_lock:
+        if collection not in _index_cache:
+            raise RuntimeError(f"FAISS index for collection '{collection}' is not loaded.")
+        index, store = _index_cache[collection]
+    chunks = [c for c in (_to_chunk(store, vid, score) for vid, score in hits) if c is not None]
+    if with_embeddings:
+        _attach_embeddings(index, chunks)
+    return chunks
+
+
+class IndexWriter:
+    """
+    Builds or extends the on-disk FAISS index + chunk store for one collection.
 
-    results: List[RetrievedChunk] = []
-    for score, vid in zip(scores[0], ids[0]):
-        if vid == -1:
-            continue  # FAISS returns -1 when fewer than k results exist
-        meta = metadata.get(int(vid), {})
-        results.append(RetrievedChunk(
-            text=meta.get("text", ""),
-            source=meta.get("source", "unknown"),
-            page_num=meta.get("page_num", 0),
-            score=float(score),
-            vector_id=int(vid),
-        ))
+    With append=False a fresh index of FAISS_INDEX_TYPE is built (IVF-PQ buffers the first
+    INDEX_TRAIN_SIZE vectors and trains on them before adding). With append=True the existing
+    index is opened and new vectors get ids continuing from its ntotal; removed ids are
+    tombstoned (flagged in the chunk store, the vector stays until the next full rebuild).
+    Nothing is written until commit().
+    """
 
-    return results
+    def __init__(self, indexed_dir: str, collection: str = "default", append: bool = False) -> None:
+        self.collection = collection
+        self.path = _index_path(indexed_dir, collection)
+        self.index_type = get_settings().faiss_index_type
+        self._index: Optional[faiss.Index] = None
+        self._config: dict = {}
+        self._pending: List[np.ndarray] = []  # vectors waiting for IVF-PQ training
+        self._pending_count = 0
+
+        faiss_file = os.path.join(self.path, "index.faiss")
+        if append and os.path.exists(faiss_file):
+            _migrate_pickled_metadata(self.path)
+        append = append and os.path.exists(faiss_file) and chunk_store.exists(self.path)
+        if append:
+            self._index = faiss.read_index(faiss_file)
+            self._config = _read_index_config(self.path)
+            self.index_type = self._config["type"]
+        self._store = ChunkStoreWriter(self.path, append=append)
+
+    @property
+    def next_id(self) -> int:
+        return (self._index.ntotal if self._index is not None else 0) + self._pending_count
+
+    @property
+    def live_count(self) -> int:
+        return len(self._store) - self._store.deleted_count
+
+    @property
+    def tombstone_count(self) -> int:
+        return self._store.deleted_count
+
+    def add(self, embeddings: Union[np.ndarray, List[List[float]]], metadata: List[dict]) -> int:
+        """L2-normalize and add embeddings; returns the vector id assigned to the first one."""
+        start = self.next_id
+        if len(embeddings) == 0:
+            return start
+
+        vectors = np.array(embeddings, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        self._store.add(metadata)
+
+        if self._index is not None:
+            self._index.add(vectors)
+        elif self.index_type == "ivfpq":
+            self._pending.append(vectors)
+            self._pending_count += len(vectors)
+            if self._pending_count >= get_settings().index_train_size:
+                self._build()
+        else:
+            self._index, self._config = build_faiss_index(self.index_type, vectors.shape[1])
+            self._index.add(vectors)
+        return start
+
+    def _build(self) -> None:
+        """Train an index on (a sample of) the buffered vectors, then add all of them."""
+        vectors = np.vstack(self._pending)
+        train_size = get_settings().index_train_size
+        sample = vectors
+        if len(vectors) > train_size:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), train_size, replace=False)]
+        self._index, self._config = build_faiss_index(self.index_type, vectors.shape[1], sample)
+        self._index.add(vectors)
+        self._pending, self._pending_count = [], 0
+
+    def remove(self, vector_ids: Iterable[int]) -> None:
+        """Tombstone vector ids so search() no longer returns them."""
+        self._store.remove(vector_ids)
+
+    def commit(self) -> None:
+        """Write index.faiss + chunk store + index.json and refresh the in-memory cache."""
+        if self._index is None and self._pending:
+            self._build()
+        if self._index is None:
+            raise ValueError(f"Nothing to write for collection '{self.collection}'.")
+        self.index_type = self._config["type"]  # what was actually built (IVF-PQ may fall back to flat)
+
+        os.makedirs(self.path, exist_ok=True)
+        faiss_file = os.path.join(self.path, "index.faiss")
+        config_file = os.path.join(self.path, "index.json")
+
+        # Write to temp names first, so no file is ever seen half-written. The files are then
+        # replaced one by one: each swap is atomic, the set is not, so a load_index from another
+        # process between the swaps can pair old and new files (in this process, queries switch
+        # over only at the reload below)
+        faiss.write_index(self._index, faiss_file + ".tmp")
+        with open(config_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._config, f, indent=2)
+        self._store.commit()
+        os.replace(faiss_file + ".tmp", faiss_file)
+        os.replace(config_file + ".tmp", config_file)
+
+        # Reload from disk (memory-mapped where possible) so the app can serve queries
+        # immediately after ingestion and the residency budget accounts for it
+        with _cache_lock:
+            unload_index(self.collection)
+            _load(self.path, self.collection)
+
+        logger.info(
+            "FAISS index saved: collection='%s', type=%s, vectors=%d, tombstoned=%d, path=%s",
+            self.collection, self._config["type"], self._index.ntotal, self.tombstone_count, self.path,
+        )
 
 
 def save_index(
@@ -111,30 +496,9 @@ def save_index(
     collection: str = "default",
 ) -> None:
     """
-    Build a new FAISS IndexFlatIP, add all embeddings, and save index + metadata to disk.
+    Build a new FAISS index (FAISS_INDEX_TYPE), add all embeddings, and save index + metadata to disk.
     Embeddings are L2-normalized before indexing for cosine similarity.
     """
-    path = _index_path(indexed_dir, collection)
-    os.makedirs(path, exist_ok=True)
-
-    vectors = np.array(embeddings, dtype=np.float32)
-    faiss.normalize_L2(vectors)
-
-    dimension = vectors.shape[1]
-    index = faiss.IndexFlatIP(dimension)
-    index.add(vectors)
-
-    faiss_file = os.path.join(path, "index.faiss")
-    meta_file = os.path.join(path, "index.pkl")
-
-    faiss.write_index(index, faiss_file)
-    with open(meta_file, "wb") as f:
-        pickle.dump(metadata, f)
-
-    # Update the in-memory cache so the app can serve queries immediately after ingestion
-    _index_cache[collection] = (index, metadata)
-
-    logger.info(
-        "FAISS index saved: collection='%s', vectors=%d, path=%s",
-        collection, index.ntotal, path,
-    )
+    writer = IndexWriter(indexed_dir, collection)
+    writer.add(embeddings, [metadata[i] for i in sorted(metadata)])
+    writer.commit()
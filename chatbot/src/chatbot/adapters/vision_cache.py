@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+"""
+Image preparation and result cache for llm_adapter.vision_extract.
+
+  - prepare(): detects the real image type from its magic bytes, downscales so the longest side
+    is at most VISION_MAX_SIDE (finer detail is resampled away by the model anyway) and re-encodes
+    types the API does not accept (TIFF, BMP) as PNG. Pillow is imported on first use.
+  - Every image is keyed by the SHA-256 of its file bytes. With VISION_DEDUP=perceptual, a
+    cache miss also looks for entries with the same 256-bit difference hash (dHash), so a logo
+    or page re-encoded in another format can share a result. The dHash only nominates a
+    candidate: it is reused only if the SHA-256 of its decoded pixels equals ours. Pages that
+    differ in a few digits can share a dHash, so a dHash match alone is never trusted.
+  - extract(): looks the key up in an in-process LRU and the SQLite file at VISION_CACHE_PATH
+    (shared with the ingest script, so re-uploads skip the vision call); concurrent requests for
+    the same key wait for the first one instead of calling the API again.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from chatbot.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Image types the vision API accepts as-is
+_API_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/gif"}
+
+# dHash grid: _HASH_SIZE² bits
+_HASH_SIZE = 16
+
+# Results kept in process (whether or not the SQLite cache is enabled)
+_RECENT_SIZE = 512
+
+# v2: keyed by file SHA-256 (v1 rows were keyed by dHash alone and are not trusted)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vision_results_v2 (
+    model      TEXT NOT NULL,
+    image_hash TEXT NOT NULL,
+    phash      TEXT,
+    pixel_hash TEXT,
+    text       TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (model, image_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS vision_results_v2_phash ON vision_results_v2 (model, phash);
+"""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime: str
+    key: str  # SHA-256 of the original file bytes
+    phash: Optional[str] = None  # dHash (VISION_DEDUP=perceptual only)
+    pixel_hash: Optional[str] = None  # SHA-256 of the decoded pixels (VISION_DEDUP=perceptual only)
+
+
+def sniff_mime(data: bytes) -> Optional[str]:
+    """Image MIME type from the leading magic bytes; None if unrecognised."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if data.startswith(b"BM"):
+        return "image/bmp"
+    return None
+
+
+def _perceptual_hash(img) -> str:
+    """Difference hash: brightness gradients of a (_HASH_SIZE+1)×_HASH_SIZE greyscale thumbnail."""
+    from PIL import Image
+
+    small = img.convert("L").resize((_HASH_SIZE + 1, _HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def _pixel_hash(img) -> str:
+    digest = hashlib.sha256(f"{img.mode}:{img.size}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def prepare(image_bytes: bytes) -> PreparedImage:
+    """Downscale / re-encode image_bytes for the vision API and compute its cache key."""
+    settings = get_settings()
+    mime = sniff_mime(image_bytes)
+    key = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        from PIL import Image
+
+        with Image.open(BytesIO(image_bytes)) as img:
+            img.load()
+            phash = pixel_hash = None
+            if settings.vision_dedup == "perceptual":
+                phash, pixel_hash = _perceptual_hash(img), _pixel_hash(img)
+            max_side = settings.vision_max_side
+            oversized = max_side > 0 and max(img.size) > max_side
+            if not oversized and mime in _API_MIME_TYPES:
+                return PreparedImage(image_bytes, mime, key, phash, pixel_hash)
+
+            out = img.copy()
+            if oversized:
+                out.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            # JPEG stays JPEG; everything else (scans, screenshots, TIFF) goes lossless
+            fmt = "JPEG" if mime == "image/jpeg" else "PNG"
+            if fmt == "JPEG" and out.mode != "RGB":
+                out = out.convert("RGB")
+            elif out.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+                out = out.convert("RGB")
+            buf = BytesIO()
+            out.save(buf, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+        logger.debug("Vision image %s %s → %s %s (%d → %d bytes)", mime, img.size, fmt, out.size,
+                     len(image_bytes), buf.tell())
+        return PreparedImage(buf.getvalue(), f"image/{fmt.lower()}", key, phash, pixel_hash)
+    except Exception as exc:
+        logger.warning("Could not decode image (%s) — sending it unchanged", exc)
+        return PreparedImage(image_bytes, mime or "image/png", key)
+
+
+# ── Result cache ───────────────────────────────────────────────────────────────
+
+@dataclass
+class _Entry:
+    text: str
+    phash: Optional[str]
+    pixel_hash: Optional[str]
+
+
+# Module-level SQLite connection (None = not opened yet / cache disabled) and in-process LRU
+_conn: Optional[sqlite3.Connection] = None
+_conn_path: Optional[str] = None
+_lock = threading.Lock()
+_recent: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+
+# Keys being extracted right now → set when their result is stored (or the call failed)
+_inflight: Dict[Tuple[str, str], threading.Event] = {}
+
+# Counters since process start
+_hits: int = 0
+_misses: int = 0
+
+
+def _get_conn() -> Optional[sqlite3.Connection]:
+    """Open (or reopen after a path change) the cache file. Returns None if VISION_CACHE_PATH is empty."""
+    global _conn, _conn_path
+    path = get_settings().vision_cache_path
+    if not path:
+        return None
+    if _conn is not None and _conn_path == path:
+        return _conn
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")  # ingest script and API process may share the file
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _conn, _conn_path = conn, path
+    return _conn
+
+
+def get(model: str, image: PreparedImage) -> Optional[str]:
+    """Cached text for image: by file hash, else (perceptual mode) a dHash candidate with identical pixels."""
+    with _lock:
+        entry = _recent.get((model, image.key))
+        if entry is not None:
+            _recent.move_to_end((model, image.key))
+            return entry.text
+        conn = _get_conn()
+        if conn is not None:
+            row = conn.execute(
+                "SELECT text, phash, pixel_hash FROM vision_results_v2 WHERE model = ? AND image_hash = ?",
+                (model, image.key),
+            ).fetchone()
+            if row is not None:
+                _remember(model, image.key, _Entry(*row))
+                return row[0]
+        if image.phash is None:
+            return None
+
+        for entry in _recent.values():
+            if entry.phash == image.phash and entry.pixel_hash == image.pixel_hash:
+                return entry.text
+        if conn is not None:
+            row = conn.execute(
+                "SELECT text FROM vision_results_v2 WHERE model = ? AND phash = ? AND pixel_hash = ?",
+                (model, image.phash, image.pixel_hash),
+            ).fetchone()
+            if row is not None:
+                return row[0]
+        return None
+
+
+def put(model: str, image: PreparedImage, text: str) -> None:
+    with _lock:
+        _remember(model, image.key, _Entry(text, image.phash, image.pixel_hash))
+        conn = _get_conn()
+        if conn is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO vision_results_v2 (model, image_hash, phash, pixel_hash, text, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (model, image.key, image.phash, image.pixel_hash, text, time.time()),
+            )
+
+
+def _remember(model: str, key: str, entry: _Entry) -> None:
+    """Add to the in-process LRU (caller holds _lock)."""
+    _recent[(model, key)] = entry
+    _recent.move_to_end((model, key))
+    while len(_recent) > _RECENT_SIZE:
+        _recent.popitem(last=False)
+
+
+def extract(image_bytes: bytes, model: str, call: Callable[[PreparedImage], Optional[str]]) -> str:
+    """
+    Vision text for image_bytes: from the cache, from a concurrent request for the same image,
+    or from call(prepared) — which returns None on failure (not cached, so the next upload retries).
+    """
+    global _hits, _misses
+    image = prepare(image_bytes)
+    cache_key = (model, image.key)
+    text = get(model, image)
+    owner = False
+    if text is None:
+        with _lock:
+            event = _inflight.get(cache_key)
+            if event is None:
+                event = _inflight[cache_key] = threading.Event()
+                owner = True
+        if not owner:
+            event.wait()
+        # Owner: another request may have stored it just before we claimed the key.
+        # Waiter: None here means the first request failed, so call the API ourselves.
+        text = get(model, image)
+
+    with _lock:
+        if text is not None:
+            _hits += 1
+        else:
+            _misses += 1
+    try:
+        if text is None:
+            text = call(image)
+            if text is not None:
+                put(model, image, text)
+        return text or ""
+    finally:
+        if owner:
+            with _lock:
+                del _inflight[cache_key]
+            event.set()
+
+
+def stats() -> dict:
+    """Hit / miss counters since process start."""
+    total = _hits + _misses
+    return {"hits": _hits, "misses": _misses, "hit_rate": round(_hits / total, 4) if total else 0.0}
+
+
+def close() -> None:
+    """Close the SQLite file and forget in-process results."""
+    global _conn, _conn_path
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        _conn, _conn_path = None, None
+        _recent.clear()
@@ -23,6 +23,12 @@ class Settings(BaseSettings):
     llm_model: str = "gpt-4o"
     llm_max_tokens: int = 1500
     llm_temperature: float = 0.2
+    llm_endpoints: str = ""  # chat endpoint pool, "provider:model,..." (e.g. "groq:llama-3.1-8b-instant,openai:gpt-4o-mini"); "" = LLM_PROVIDER only
+    llm_hedge: bool = False  # resend to the next endpoint when the first outlives its rolling p95
+    llm_hedge_min_ms: int = 500  # never hedge sooner than this
+    llm_health_window: int = 50  # recent calls per endpoint behind its latency / error-rate stats
+    llm_unhealthy_error_rate: float = 0.5  # skip an endpoint once its error rate reaches this...
+    llm_cooldown_seconds: float = 30.0  # ...for this long
 
     # Groq
     groq_api_key: str = ""
@@ -30,8 +36,16 @@ class Settings(BaseSettings):
 
     # OpenAI (also used for embeddings regardless of llm_provider)
     openai_api_key: str = ""
+    openai_base_url: str = ""  # OpenAI-compatible endpoint override (proxy, gateway, local stub); "" = api.openai.com
     embedding_model: str = "text-embedding-3-small"
     embedding_dimensions: int = 1536
+    embedding_concurrency: int = 4  # embedding batches in flight
+    embedding_tpm_limit: int = 1_000_000  # tokens-per-minute budget shared by all batches
+    embedding_batch_max_tokens: int = 50_000
+    embedding_batch_max_items: int = 2048
+    embedding_max_retries: int = 6
+    embedding_cache_path: str = "data/cache/embeddings.sqlite"  # "" disables the cache
+    embedding_cache_max_mb: int = 1024
 
     # Ollama
     ollama_base_url: str = "http://localhost:11434"
@@ -49,15 +63,57 @@ class Settings(BaseSettings):
     default_collection: str = "default"
     vector_search_k: int = 5
 
+    # FAISS index type — recorded in index.json at build time and picked up by load_index
+    faiss_index_type: str = "flat"  # "flat" (exact) | "hnsw" | "ivfpq"
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    ivf_nlist: int = 0  # 0 = 4·sqrt(training vectors)
+    ivf_nprobe: int = 16
+    pq_m: int = 0  # sub-quantizers; 0 = dimension / 16 (must divide the dimension)
+    pq_nbits: int = 8
+    index_train_size: int = 50_000  # vectors buffered and sampled to train IVF-PQ
+    faiss_mmap: bool = True  # memory-map IVF-PQ lists on load instead of copying them to the heap
+    index_memory_budget_mb: int = 0  # heap budget for resident collections (LRU eviction); 0 = unlimited
+
+    # Hybrid retrieval (FAISS backend): BM25 index built by ingest, fused with dense results by RRF
+    enable_hybrid_search: bool = False
+    hybrid_candidates: int = 20  # results taken from each of BM25 and dense search before fusion
+    rrf_k: int = 60  # reciprocal-rank-fusion constant: score = Σ 1 / (rrf_k + rank)
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+
+    # Post-retrieval reranking: MMR over the stored embeddings, then an optional local cross-encoder
+    enable_mmr: bool = False
+    rerank_candidates: int = 20  # chunks retrieved for MMR / cross-encoder to pick VECTOR_SEARCH_K from
+    mmr_lambda: float = 0.7  # 1 = relevance only, 0 = diversity only
+    cross_encoder_model: str = ""  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2" (sentence-transformers); "" = off
+    rerank_budget_ms: int = 150  # cross-encoder time budget per query; past it the MMR order is kept
+
     # RAG Pipeline
     max_context_tokens: int = 4000
     threshold_ratio: float = 0.8
     max_query_length: int = 1000
     enable_relevance_precheck: bool = False
+    batch_query_max_questions: int = 1000  # per /api/v1/query/batch request
+    batch_query_concurrency: int = 8  # parallel LLM calls while answering a batch
+    enable_timing_header: bool = False  # debug: per-stage Server-Timing header on /query and /query/stream
+
+    # Query caches
+    query_embedding_cache_size: int = 1024  # in-process LRU of question embeddings; 0 disables
+    enable_semantic_cache: bool = False  # reuse answers to near-identical first-turn questions (Redis)
+    semantic_cache_max_distance: float = 0.05  # cosine distance under which a cached answer is reused
+    semantic_cache_max_entries: int = 1000  # per collection; the oldest are evicted beyond it
+    semantic_cache_ttl: int = 86400
 
     # Chat History
     max_history_turns: int = 5
     cache_ttl: int = 3600
+    memory_history_max_sessions: int = 10000  # in-memory fallback only; least recently written evicted first
+    enable_history_summary: bool = False  # fold older turns into a rolling per-session summary (background LLM call)
+    history_summary_threshold_tokens: int = 1500  # fold once the stored turns exceed this many tokens
+    history_summary_keep_turns: int = 2  # most recent turns kept verbatim after a fold
+    history_summary_max_tokens: int = 300  # length asked of the summarizer
 
     # Redis
     redis_host: str = "localhost"
@@ -68,6 +124,10 @@ class Settings(BaseSettings):
     # Ingestion
     chunk_size: int = 575
     chunk_overlap: int = 400
+    ingest_compaction_ratio: float = 0.3  # full rebuild once tombstoned vectors exceed this share
+    ingest_workers: int = 0  # load/chunk (and PDF page extraction) processes; 0 = os.cpu_count()
+    ingest_batch_size: int = 1024  # chunks per embed + index-write batch (split again by token count)
+    upload_workers: int = 2  # /api/v1/upload jobs ingested concurrently in the background
 
     # Content Safety
     enable_content_safety: bool = True
@@ -75,10 +135,21 @@ class Settings(BaseSettings):
     # Supabase pgvector
     supabase_db_url: str = ""
     vector_backend: str = "supabase"  # "supabase" | "faiss"
+    supabase_pool_min: int = 2  # connections opened at startup
+    supabase_pool_max: int = 10
+    supabase_pool_timeout: float = 5.0  # seconds to wait for a free connection
+    supabase_prepared_statements: bool = True  # disable behind a transaction-mode pooler (port 6543)
+    pgvector_hnsw_ef_search: int = 40  # SET per query; 0 = server default
+    pgvector_ivfflat_probes: int = 10  # SET per query; 0 = server default
 
     # Groq vision
     groq_vision_model: str = "llama-3.2-11b-vision-preview"
     vision_text_threshold: int = 50  # chars per PDF page below which vision is used
+    vision_dpi: int = 150  # rasterization DPI for sparse PDF pages sent to vision
+    vision_concurrency: int = 4  # vision requests in flight, across all uploads in one process
+    vision_max_side: int = 1120  # downscale images so the longest side is at most this (px) before sending; 0 = never
+    vision_dedup: str = "exact"  # "exact" (identical files share a result) | "perceptual" (dHash-nominated, confirmed by identical pixels)
+    vision_cache_path: str = "data/cache/vision.sqlite"  # vision results by image hash; "" = in-process only
 
     # CORS (stored as JSON string, parsed below)
     cors_origins: str = '["http://localhost:3000"]'
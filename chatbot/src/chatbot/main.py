@@ -11,10 +11,11 @@ sys.path.insert(0, str(Path(__file__).parents[3]))  # F:\Sample root
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from chatbot.adapters import cache_adapter, vector_adapter
+from chatbot.adapters import cache_adapter, supabase_adapter, vector_adapter
 from rate_limit import RateLimitMiddleware
 from chatbot.config import get_settings
 from chatbot.routers.query_router import router
+from chatbot.services import extractors, reranker, upload_jobs
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,6 +33,13 @@ async def lifespan(app: FastAPI):
     # Connect to Redis (falls back to in-memory if unavailable)
     cache_adapter.init_redis()
 
+    # Open pooled Supabase connections now so the first queries skip the TLS handshake
+    if settings.vector_backend == "supabase":
+        try:
+            supabase_adapter.init_pool()
+        except Exception as exc:
+            logger.warning("Supabase pool warm-up failed (will retry on first query): %s", exc)
+
     # Pre-load the default FAISS index into memory
     loaded = vector_adapter.load_index(settings.data_indexed_dir, settings.default_collection)
     if not loaded:
@@ -39,11 +47,17 @@ async def lifespan(app: FastAPI):
             "FAISS index not found. Start the app then run: python scripts/ingest.py"
         )
 
+    # Load the cross-encoder (if configured) before the first query has to wait for it
+    reranker.warm_up()
+
     logger.info("Personal RAG Chatbot ready on port %d", settings.app_port)
     yield
 
     # ── Shutdown ─────────────────────────────────────────────────────────────
     logger.info("Personal RAG Chatbot shutting down...")
+    upload_jobs.shutdown()
+    extractors.shutdown()
+    supabase_adapter.close_pool()
 
 
 def create_app() -> FastAPI:
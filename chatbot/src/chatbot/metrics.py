@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+"""
+In-process latency histograms, exported in Prometheus text format at /api/v1/metrics.
+
+Deliberately tiny (no prometheus_client dependency): cumulative buckets, a sum and a count per
+label value, guarded by one lock. Multi-worker deployments get one series set per process.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+# Seconds — spans sub-millisecond pool checkouts up to slow cold-cache queries
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label: Optional[str] = None,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label value → [bucket counts..., +Inf count], sum
+        self._counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def observe(self, seconds: float, label_value: str = "") -> None:
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts = self._counts.setdefault(label_value, [0] * (len(self.buckets) + 1))
+            counts[i] += 1
+            self._sums[label_value] = self._sums.get(label_value, 0.0) + seconds
+
+    @contextmanager
+    def time(self, label_value: str = "") -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label_value)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """label value → {"buckets": cumulative counts aligned with self.buckets + [inf], "sum", "count"}."""
+        with self._lock:
+            out = {}
+            for value, counts in self._counts.items():
+                cumulative, running = [], 0
+                for c in counts:
+                    running += c
+                    cumulative.append(running)
+                out[value] = {"buckets": cumulative, "sum": self._sums[value], "count": running}
+            return out
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for value, data in sorted(self.snapshot().items()):
+            base = f'{self.label}="{value}",' if self.label else ""
+            for le, count in zip([*map(repr, self.buckets), "+Inf"], data["buckets"]):
+                lines.append(f'{self.name}_bucket{{{base}le="{le}"}} {count}')
+            labels = f"{{{base.rstrip(',')}}}" if base else ""
+            lines.append(f"{self.name}_sum{labels} {data['sum']:.6f}")
+            lines.append(f"{self.name}_count{labels} {data['count']}")
+        return lines
+
+
+# Module-level registry: metric name → Histogram
+_registry: Dict[str, Histogram] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(
+    name: str,
+    description: str,
+    label: Optional[str] = None,
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    """Get or create a registered histogram (safe to call at import time from any module)."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, description, label, buckets)
+        return _registry[name]
+
+
+def render_prometheus() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(line for m in metrics for line in m.render()) + "\n"
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import re
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field, field_validator
 
@@ -59,11 +59,60 @@ class QueryResponse(BaseModel):
     )
 
 
-class UploadResponse(BaseModel):
-    collection: str = Field(description="Collection the document was indexed into")
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(
+        description="Questions to answer independently (no chat history is used or saved).",
+        min_length=1,
+    )
+    collection_name: str = Field(
+        default="default",
+        description="Document collection to search. Default: 'default'.",
+    )
+    generate_answers: bool = Field(
+        default=True,
+        description="False = retrieval only (sources without LLM answers), e.g. for offline evaluation.",
+    )
+
+
+class BatchQueryResult(BaseModel):
+    question: str
+    answer: str = Field(default="", description="LLM answer; empty when generate_answers is false or on error")
+    sources: List[SourceDocument] = Field(default_factory=list)
+    has_context: bool = False
+    error: Optional[str] = Field(default=None, description="Why this question was not answered, if it failed")
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult] = Field(description="One result per question, in request order")
+    elapsed_seconds: float
+
+
+class UploadJobResponse(BaseModel):
+    job_id: str
+    status: str = Field(description="queued | running | succeeded | failed")
+    stage: str = Field(description="Current step while running: extracting, embedding, storing (repeats per batch)")
+    collection: str = Field(description="Collection the document is indexed into")
     source: str = Field(description="Original filename")
-    chunks_indexed: int = Field(description="Number of text chunks stored in the vector DB")
-    elapsed_seconds: float = Field(description="Total processing time in seconds")
+    chunks_indexed: Optional[int] = Field(default=None, description="Text chunks stored in the vector DB (once succeeded)")
+    elapsed_seconds: Optional[float] = Field(default=None, description="Ingestion time in seconds (once succeeded)")
+    error: Optional[str] = Field(default=None, description="Why the job failed")
+
+
+class CollectionResidency(BaseModel):
+    type: str = Field(description="FAISS index type: flat, hnsw or ivfpq")
+    vectors: int
+    mmap: bool = Field(description="True if the index lists are memory-mapped rather than copied to the heap")
+    load_seconds: float
+    resident_bytes: int = Field(description="Heap bytes held by the index (counted against INDEX_MEMORY_BUDGET_MB)")
+    mapped_bytes: int = Field(description="File-backed bytes (mmapped index lists and chunk store)")
+
+
+class LLMEndpointHealth(BaseModel):
+    healthy: bool = Field(description="False while the endpoint is in its error cooldown")
+    calls: int = Field(description="Calls in the rolling window")
+    error_rate: float
+    p50_ms: Optional[float] = Field(default=None, description="Rolling median latency (once enough calls succeeded)")
+    p95_ms: Optional[float] = Field(default=None, description="Rolling p95 latency — the hedging deadline")
 
 
 class HealthResponse(BaseModel):
@@ -71,3 +120,11 @@ class HealthResponse(BaseModel):
     version: str
     index_loaded: bool = Field(description="True if the FAISS index is loaded in memory")
     redis_connected: bool = Field(description="True if Redis is reachable; False if using in-memory fallback")
+    collections: Dict[str, CollectionResidency] = Field(
+        default_factory=dict,
+        description="Resident FAISS collections, least- to most-recently used",
+    )
+    llm_endpoints: Dict[str, LLMEndpointHealth] = Field(
+        default_factory=dict,
+        description="Chat endpoint pool (provider:model), once the first completion has run",
+    )
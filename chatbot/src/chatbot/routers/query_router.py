@@ -1,22 +1,34 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
-import tempfile
+from typing import AsyncIterator
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from chatbot.adapters import cache_adapter, vector_adapter
+from chatbot import metrics
+from chatbot.adapters import cache_adapter, llm_pool, vector_adapter
 from chatbot.config import get_settings
 from chatbot.middleware.auth import verify_api_key
 from chatbot.models.schemas import (
+    BatchQueryRequest,
+    BatchQueryResponse,
     HealthResponse,
     QueryRequest,
     QueryResponse,
-    UploadResponse,
+    UploadJobResponse,
 )
-from chatbot.services.chatbot_service import ContentSafetyError, process_query
-from chatbot.services.ingestion_service import UPLOAD_SUPPORTED_EXTENSIONS, ingest_file
+from chatbot.services.chatbot_service import (
+    ContentSafetyError,
+    aprocess_query,
+    astream_query,
+    process_batch_query,
+)
+from chatbot.services import upload_jobs
+from chatbot.services.ingestion_service import UPLOAD_SUPPORTED_EXTENSIONS
+from chatbot.services.query_service import StageTimer
 
 logger = logging.getLogger(__name__)
 
@@ -26,35 +38,120 @@ router = APIRouter(prefix="/api/v1", tags=["chatbot"])
 @router.post("/query", response_model=QueryResponse)
 async def query(
     request: QueryRequest,
+    response: Response,
     _: str = Depends(verify_api_key),
 ) -> QueryResponse:
     """
     Main chat endpoint. Accepts a question + session_id, returns an answer
     grounded in your indexed documents.
     """
+    timer = StageTimer() if get_settings().enable_timing_header else None
+    try:
+        result = await aprocess_query(request, timer=timer)
+    except ContentSafetyError as exc:
+        raise HTTPException(status_code=451, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if timer is not None:
+        response.headers["Server-Timing"] = timer.header()
+    return result
+
+
+@router.post("/query/stream")
+async def query_stream(
+    request: QueryRequest,
+    _: str = Depends(verify_api_key),
+) -> StreamingResponse:
+    """
+    /query as server-sent events: a `sources` event right after retrieval, then `token` events
+    as the answer is generated, then `done` with the full answer. History is saved at the end.
+    """
+    timer = StageTimer() if get_settings().enable_timing_header else None
+    events = astream_query(request, timer=timer)
     try:
-        return process_query(request)
+        # Retrieval + moderation happen before the first event, so a blocked query still gets a 451
+        first = await events.__anext__()
     except ContentSafetyError as exc:
         raise HTTPException(status_code=451, detail=str(exc))
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
 
+    async def body() -> AsyncIterator[str]:
+        yield _sse(*first)
+        async for event, data in events:
+            yield _sse(event, data)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if timer is not None:
+        headers["Server-Timing"] = timer.header()  # stages up to the LLM call
+    return StreamingResponse(body(), media_type="text/event-stream", headers=headers)
+
 
-@router.post("/upload", response_model=UploadResponse)
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/query/batch", response_model=BatchQueryResponse)
+def query_batch(
+    request: BatchQueryRequest,
+    _: str = Depends(verify_api_key),
+) -> BatchQueryResponse:
+    """
+    Answer many independent questions (offline evaluation, bulk FAQ answering).
+    Embeddings and the vector search are batched; no chat history is involved.
+    Declared sync so FastAPI runs it in its threadpool — a large batch never blocks the event loop.
+    """
+    try:
+        return process_batch_query(request)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+# The body is parsed by upload_jobs.spool_multipart, not FastAPI — documented here for /docs
+_UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "collection": {"type": "string", "default": "default"},
+                    },
+                },
+            },
+        },
+    },
+}
+
+
+@router.post("/upload", response_model=UploadJobResponse, status_code=202, openapi_extra=_UPLOAD_FORM_SCHEMA)
 async def upload_document(
-    file: UploadFile = File(...),
-    collection: str = Form(default="default"),
+    request: Request,
     _: str = Depends(verify_api_key),
-) -> UploadResponse:
+) -> UploadJobResponse:
     """
     Upload a document (PDF, DOCX, XLSX, or image) to be indexed into the vector DB.
-    Returns the collection name, chunk count, and elapsed time.
+    The file is streamed to disk and ingested in the background; returns 202 with a job id
+    to poll at GET /api/v1/upload/{job_id}.
     """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="No filename provided.")
+    # Parsed as it arrives: the file goes straight from the socket to its spool file, on a
+    # worker thread — never the whole file in memory, never a second copy, never on the event loop
+    try:
+        form = await upload_jobs.spool_multipart(
+            request.headers.get("content-type", ""),
+            request.stream(),
+            extensions=UPLOAD_SUPPORTED_EXTENSIONS,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in UPLOAD_SUPPORTED_EXTENSIONS:
+    if not form.filename:
+        raise HTTPException(status_code=400, detail="No filename provided.")
+    if form.path is None:
+        ext = os.path.splitext(form.filename)[1].lower()
         raise HTTPException(
             status_code=415,
             detail=(
@@ -62,37 +159,40 @@ async def upload_document(
                 f"Supported: {sorted(UPLOAD_SUPPORTED_EXTENSIONS)}"
             ),
         )
+    collection = form.fields.get("collection") or "default"
+    return _job_response(upload_jobs.submit(form.path, collection))
 
-    # Write to a temp file so extractors can open it by path
-    suffix = ext
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        contents = await file.read()
-        tmp.write(contents)
-        tmp_path = tmp.name
 
-    try:
-        result = ingest_file(file_path=tmp_path, collection=collection)
-        # Restore original filename in result
-        result.source = file.filename
-        return UploadResponse(
-            collection=result.collection,
-            source=result.source,
-            chunks_indexed=result.chunks_indexed,
-            elapsed_seconds=result.elapsed_seconds,
-        )
-    except ValueError as exc:
-        raise HTTPException(status_code=422, detail=str(exc))
-    finally:
-        try:
-            os.unlink(tmp_path)
-        except OSError:
-            pass
+@router.get("/upload/{job_id}", response_model=UploadJobResponse)
+async def upload_status(
+    job_id: str,
+    _: str = Depends(verify_api_key),
+) -> UploadJobResponse:
+    """Status of a background upload job: stage while running, chunk count or error once finished."""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upload job '{job_id}'.")
+    return _job_response(job)
+
+
+def _job_response(job: upload_jobs.UploadJob) -> UploadJobResponse:
+    return UploadJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        stage=job.stage,
+        collection=job.collection,
+        source=job.source,
+        chunks_indexed=job.result.chunks_indexed if job.result else None,
+        elapsed_seconds=job.result.elapsed_seconds if job.result else None,
+        error=job.error,
+    )
 
 
 @router.get("/health", response_model=HealthResponse)
 async def health() -> HealthResponse:
     """
-    Liveness check. Returns index and Redis connection status.
+    Liveness check. Returns index and Redis connection status, plus load time
+    and memory footprint of each resident FAISS collection.
     No authentication required.
     """
     settings = get_settings()
@@ -101,4 +201,15 @@ async def health() -> HealthResponse:
         version=settings.app_version,
         index_loaded=vector_adapter.is_index_loaded(settings.default_collection),
         redis_connected=cache_adapter.is_redis_connected(),
+        collections=vector_adapter.residency_stats(),
+        llm_endpoints=llm_pool.stats(),
     )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> str:
+    """
+    Latency histograms (Supabase pool wait, query latency) in Prometheus text format.
+    No authentication required, like /health.
+    """
+    return metrics.render_prometheus()
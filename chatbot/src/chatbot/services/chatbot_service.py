@@ -1,18 +1,41 @@
 from __future__ import annotations
 
 import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from chatbot.adapters import llm_adapter
 from chatbot.config import get_settings
-from chatbot.models.schemas import QueryRequest, QueryResponse, SourceDocument
-from chatbot.services.query_service import RAGResult, sanitize_query, run_rag_pipeline
+from chatbot.models.schemas import (
+    BatchQueryRequest,
+    BatchQueryResponse,
+    BatchQueryResult,
+    QueryRequest,
+    QueryResponse,
+    SourceDocument,
+)
+from chatbot.services.query_service import (
+    RAGResult,
+    StageTimer,
+    arun_rag_pipeline,
+    astream_rag_pipeline,
+    run_rag_pipeline,
+    run_rag_pipeline_batch,
+    sanitize_query,
+)
 
 logger = logging.getLogger(__name__)
 
+# Sync moderation calls run here, speculatively, while the calling thread embeds and searches
+_moderation_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="moderation")
+
 
 def process_query(request: QueryRequest) -> QueryResponse:
     """
-    Orchestrator: validate → sanitize → content safety → RAG pipeline → respond.
+    Orchestrator: validate → sanitize → (content safety ∥ RAG retrieval) → LLM → respond.
+    Moderation gates the LLM call and the response rather than delaying retrieval.
     """
     settings = get_settings()
 
@@ -27,12 +50,11 @@ def process_query(request: QueryRequest) -> QueryResponse:
             has_context=False,
         )
 
-    # Step 11 (content safety): OpenAI Moderation API check
+    # Step 11 (content safety): OpenAI Moderation API check, started before retrieval
+    gate = None
     if settings.enable_content_safety:
-        is_safe = llm_adapter.moderate(clean_question)
-        if not is_safe:
-            # Return 451 — caller (router) must raise HTTPException
-            raise ContentSafetyError("This query cannot be processed due to content policy.")
+        moderation = _moderation_pool.submit(llm_adapter.moderate, clean_question)
+        gate = partial(_check_moderation, moderation)
 
     # Steps 3–11: Full RAG pipeline
     try:
@@ -40,16 +62,111 @@ def process_query(request: QueryRequest) -> QueryResponse:
             question=clean_question,
             session_id=request.session_id,
             collection_name=request.collection_name,
+            gate=gate,
         )
+    except ContentSafetyError:
+        raise
     except Exception as exc:
         logger.exception("RAG pipeline error for session %s: %s", request.session_id, exc)
+        return _error_response(request)
+
+    # Early returns (e.g. search unavailable) skip the gate; a flagged query still gets a 451
+    if gate is not None:
+        gate()
+    return _to_response(request, result)
+
+
+def _check_moderation(moderation: Future) -> None:
+    if not moderation.result():
+        # Return 451 — caller (router) must raise HTTPException
+        raise ContentSafetyError("This query cannot be processed due to content policy.")
+
+
+async def aprocess_query(request: QueryRequest, timer: Optional[StageTimer] = None) -> QueryResponse:
+    """
+    Async orchestrator: sanitize → (moderation ∥ history ∥ embed → search) → LLM → respond.
+    Moderation gates the LLM call and the response rather than delaying retrieval.
+    timer, if given, receives per-stage timings.
+    """
+    settings = get_settings()
+
+    try:
+        clean_question = sanitize_query(request.question)
+    except ValueError as exc:
         return QueryResponse(
-            answer="I encountered an error while processing your question. Please try again.",
+            answer=str(exc),
             session_id=request.session_id,
             sources=[],
             has_context=False,
         )
 
+    gate = _moderation_gate(clean_question) if settings.enable_content_safety else None
+    try:
+        result = await arun_rag_pipeline(
+            question=clean_question,
+            session_id=request.session_id,
+            collection_name=request.collection_name,
+            gate=gate,
+            timer=timer,
+        )
+    except ContentSafetyError:
+        raise
+    except Exception as exc:
+        logger.exception("RAG pipeline error for session %s: %s", request.session_id, exc)
+        return _error_response(request)
+
+    return _to_response(request, result)
+
+
+async def astream_query(
+    request: QueryRequest, timer: Optional[StageTimer] = None
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming aprocess_query: yields the ("sources" | "token" | "done" | "error", data) events of
+    astream_rag_pipeline. ContentSafetyError is raised before the first event, never mid-stream.
+    """
+    settings = get_settings()
+
+    try:
+        clean_question = sanitize_query(request.question)
+    except ValueError as exc:
+        yield "sources", {"sources": [], "has_context": False}
+        yield "token", {"delta": str(exc)}
+        yield "done", {"answer": str(exc), "has_context": False}
+        return
+
+    gate = _moderation_gate(clean_question) if settings.enable_content_safety else None
+    try:
+        async for event, data in astream_rag_pipeline(
+            question=clean_question,
+            session_id=request.session_id,
+            collection_name=request.collection_name,
+            gate=gate,
+            timer=timer,
+        ):
+            yield event, data
+    except ContentSafetyError:
+        raise
+    except Exception as exc:
+        logger.exception("RAG streaming error for session %s: %s", request.session_id, exc)
+        yield "error", {"detail": _error_response(request).answer}
+
+
+async def _moderation_gate(question: str) -> None:
+    if not await llm_adapter.amoderate(question):
+        raise ContentSafetyError("This query cannot be processed due to content policy.")
+
+
+def _error_response(request: QueryRequest) -> QueryResponse:
+    return QueryResponse(
+        answer="I encountered an error while processing your question. Please try again.",
+        session_id=request.session_id,
+        sources=[],
+        has_context=False,
+    )
+
+
+def _to_response(request: QueryRequest, result: RAGResult) -> QueryResponse:
     sources = [
         SourceDocument(filename=s["filename"], page_num=s["page_num"])
         for s in result.sources
@@ -63,6 +180,50 @@ def process_query(request: QueryRequest) -> QueryResponse:
     )
 
 
+def process_batch_query(request: BatchQueryRequest) -> BatchQueryResponse:
+    """
+    Batch orchestrator: sanitize → batched moderation → batched RAG pipeline.
+    Per-question problems are reported in that result's error field instead of failing the batch.
+    """
+    settings = get_settings()
+    if len(request.questions) > settings.batch_query_max_questions:
+        raise ValueError(f"At most {settings.batch_query_max_questions} questions per batch.")
+    start = time.perf_counter()
+
+    results = [BatchQueryResult(question=q) for q in request.questions]
+    clean: Dict[int, str] = {}
+    for i, question in enumerate(request.questions):
+        try:
+            clean[i] = sanitize_query(question)
+        except ValueError as exc:
+            results[i].error = str(exc)
+
+    if settings.enable_content_safety and clean:
+        verdicts = llm_adapter.moderate_many(list(clean.values()))
+        for i, is_safe in zip(list(clean), verdicts):
+            if not is_safe:
+                results[i].error = "This query cannot be processed due to content policy."
+                del clean[i]
+
+    order: List[int] = list(clean)
+    answered = run_rag_pipeline_batch(
+        [clean[i] for i in order],
+        collection_name=request.collection_name,
+        generate=request.generate_answers,
+    )
+    for i, result in zip(order, answered):
+        if result is None:
+            results[i].error = "I encountered an error while processing this question."
+            continue
+        results[i].answer = result.answer
+        results[i].has_context = result.has_context
+        results[i].sources = [
+            SourceDocument(filename=s["filename"], page_num=s["page_num"]) for s in result.sources
+        ]
+
+    return BatchQueryResponse(results=results, elapsed_seconds=round(time.perf_counter() - start, 3))
+
+
 class ContentSafetyError(Exception):
     """Raised when content moderation flags the user's query."""
     pass
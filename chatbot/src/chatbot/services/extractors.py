@@ -3,22 +3,27 @@ from __future__ import annotations
 """
 Multi-format document extractor.
 
-Each extractor returns a list of dicts:
-    [{"text": str, "source": str, "page_num": int, "chunk_index": int}]
+Each extractor returns (XLSX: yields) dicts:
+    {"text": str, "source": str, "page_num": int, "chunk_index": int}
+plus "token_count" when the extractor already sized the chunk to fit CHUNK_SIZE.
 
 Supported formats:
   - PDF  : pypdf (text layer); vision fallback for sparse pages
   - Image: Groq vision (JPEG, PNG, WEBP, GIF, TIFF)
   - DOCX : python-docx paragraphs + tables
-  - XLSX : openpyxl sheets → structured text rows
+  - XLSX : openpyxl read-only stream → header + row windows
 """
 
 import base64
 import logging
+import math
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -28,60 +33,146 @@ SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".xlsx"} | IMAGE_EXTENSIONS
 
 # ── PDF ────────────────────────────────────────────────────────────────────────
 
+# Below this many pages a process pool costs more than it saves
+_PARALLEL_MIN_PAGES = 16
+
+# Module-level pools shared by every upload in this process, so that concurrent ingests
+# together never exceed VISION_CONCURRENCY vision requests or INGEST_WORKERS page-text
+# processes. The caps are per process: each API worker has its own pools.
+_vision_pool: Optional[ThreadPoolExecutor] = None
+_page_pool: Optional[ProcessPoolExecutor] = None
+_pools_lock = threading.Lock()
+
+
+def _get_vision_pool() -> ThreadPoolExecutor:
+    global _vision_pool
+    with _pools_lock:
+        if _vision_pool is None:
+            from chatbot.config import get_settings
+            _vision_pool = ThreadPoolExecutor(
+                max_workers=get_settings().vision_concurrency, thread_name_prefix="vision"
+            )
+        return _vision_pool
+
+
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    global _page_pool
+    with _pools_lock:
+        if _page_pool is None:
+            # Created lazily inside the API process, which by then runs threads (vision, LLM hedges,
+            # DB / Redis clients): forking it could inherit a held lock, so workers are spawned
+            _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _page_pool
+
+
+def shutdown() -> None:
+    """Stop the shared pools (called from the app lifespan); pending work is cancelled."""
+    global _vision_pool, _page_pool
+    with _pools_lock:
+        pools = [p for p in (_vision_pool, _page_pool) if p is not None]
+        _vision_pool = _page_pool = None
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_page_texts(path: str, start: int, end: int) -> List[str]:
+    """
+    Text layer of pages [start, end).
+    Module-level so it can run inside a ProcessPoolExecutor worker.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _extract_pdf_text(path: str, workers: int) -> List[str]:
+    """
+    Text layer of every page, split into contiguous page ranges across the shared page pool.
+    Inside a pool worker process (e.g. ingest()'s) pages are read in-process: no nested pools.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    workers = min(workers, page_count)
+    if workers <= 1 or page_count < _PARALLEL_MIN_PAGES or multiprocessing.parent_process() is not None:
+        return [page.extract_text() or "" for page in reader.pages]
+
+    # A few ranges per worker, so one slow (image-heavy) range doesn't leave the others idle
+    step = math.ceil(page_count / (workers * 4))
+    pool = _get_page_pool(workers)
+    futures = [
+        pool.submit(_extract_page_texts, path, start, min(start + step, page_count))
+        for start in range(0, page_count, step)
+    ]
+    return [text for future in futures for text in future.result()]
+
+
+def _vision_page(path: str, page_num: int, dpi: int) -> str:
+    """Rasterize just this page (0-indexed) and send it to vision."""
+    from pdf2image import convert_from_path
+    from chatbot.adapters import llm_adapter
+
+    images = convert_from_path(path, dpi=dpi, first_page=page_num + 1, last_page=page_num + 1)
+    if not images:
+        return ""
+    buf = BytesIO()
+    images[0].save(buf, format="PNG")
+    return llm_adapter.vision_extract(buf.getvalue())
+
+
 def extract_pdf(path: str) -> List[dict]:
     """
     Extract text from a PDF file.
-    Uses pypdf for each page. Pages with very little text (< vision_text_threshold chars)
-    are re-processed via Groq vision to capture tables / scanned content.
+    Uses pypdf for each page (across INGEST_WORKERS shared processes for long PDFs). Pages with
+    very little text (< vision_text_threshold chars) are rasterized one by one at VISION_DPI and
+    re-processed via Groq vision, up to VISION_CONCURRENCY at a time across this process.
     """
-    from pypdf import PdfReader
     from chatbot.config import get_settings
-    from chatbot.adapters import llm_adapter
 
     settings = get_settings()
     source = os.path.basename(path)
     chunks: List[dict] = []
-
-    reader = PdfReader(path)
     sparse_pages: List[int] = []  # 0-indexed page numbers that need vision
 
-    for page_num, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
+    workers = settings.ingest_workers or os.cpu_count() or 1
+    for page_num, text in enumerate(_extract_pdf_text(path, workers)):
         if len(text.strip()) >= settings.vision_text_threshold:
-            if text.strip():
+            chunks.append({
+                "text": text.strip(),
+                "source": source,
+                "page_num": page_num,
+                "chunk_index": 0,
+            })
+        else:
+            sparse_pages.append(page_num)
+
+    # Vision fallback for sparse pages
+    vision_pages = 0
+    if sparse_pages:
+        pool = _get_vision_pool()
+        futures = {
+            page_num: pool.submit(_vision_page, path, page_num, settings.vision_dpi)
+            for page_num in sparse_pages
+        }
+        for page_num, future in futures.items():
+            try:
+                vision_text = future.result()
+            except Exception as exc:
+                logger.warning("Vision fallback for PDF '%s' page %d failed: %s", source, page_num, exc)
+                continue
+            if vision_text.strip():
+                vision_pages += 1
                 chunks.append({
-                    "text": text.strip(),
+                    "text": vision_text.strip(),
                     "source": source,
                     "page_num": page_num,
                     "chunk_index": 0,
                 })
-        else:
-            sparse_pages.append(page_num)
+        chunks.sort(key=lambda c: c["page_num"])
 
-    # Vision fallback for sparse pages
-    if sparse_pages:
-        try:
-            from pdf2image import convert_from_path
-            images = convert_from_path(path)
-            for page_num in sparse_pages:
-                if page_num >= len(images):
-                    continue
-                img = images[page_num]
-                buf = BytesIO()
-                img.save(buf, format="PNG")
-                image_bytes = buf.getvalue()
-                vision_text = llm_adapter.vision_extract(image_bytes)
-                if vision_text.strip():
-                    chunks.append({
-                        "text": vision_text.strip(),
-                        "source": source,
-                        "page_num": page_num,
-                        "chunk_index": 0,
-                    })
-        except Exception as exc:
-            logger.warning("Vision fallback for PDF pages %s failed: %s", sparse_pages, exc)
-
-    logger.info("PDF '%s': extracted %d page chunks (%d via vision)", source, len(chunks), len(sparse_pages))
+    logger.info("PDF '%s': extracted %d page chunks (%d via vision)", source, len(chunks), vision_pages)
     return chunks
 
 
@@ -165,54 +256,91 @@ def extract_docx(path: str) -> List[dict]:
 
 # ── XLSX ───────────────────────────────────────────────────────────────────────
 
-def extract_excel(path: str) -> List[dict]:
+def _cell(value) -> str:
+    return str(value).replace("\n", " ").strip() if value is not None else ""
+
+
+def extract_excel(path: str) -> Iterator[dict]:
     """
-    Extract sheets from an XLSX file via openpyxl.
-    Each sheet becomes a chunk: header + rows formatted as key:value pairs.
+    Stream sheets from an XLSX file via openpyxl (read_only), one row window at a time.
+    The first non-empty row of a sheet is its header; rows are pipe-delimited and packed into
+    windows of at most CHUNK_SIZE tokens, each starting with the sheet name and the header,
+    so every chunk is self-describing. Memory stays constant however long the sheet is.
+    token_count is the sum of the per-line counts (each line is tokenized once).
     """
     import openpyxl
+    from chatbot.adapters import llm_adapter
+    from chatbot.config import get_settings
 
+    budget = get_settings().chunk_size
     source = os.path.basename(path)
-    chunks: List[dict] = []
-
-    wb = openpyxl.load_workbook(path, data_only=True)
-    for sheet_idx, sheet_name in enumerate(wb.sheetnames):
-        ws = wb[sheet_name]
-        rows = list(ws.iter_rows(values_only=True))
-        if not rows:
-            continue
-
-        # First non-empty row is treated as header
-        header = [str(cell) if cell is not None else "" for cell in rows[0]]
-        lines: List[str] = [f"[Sheet: {sheet_name}]"]
-
-        for row in rows[1:]:
-            cells = [str(cell) if cell is not None else "" for cell in row]
-            if not any(c.strip() for c in cells):
-                continue
-            # key: value pairs using header
-            pairs = [f"{header[i]}: {cells[i]}" for i in range(min(len(header), len(cells))) if cells[i].strip()]
-            if pairs:
-                lines.append(", ".join(pairs))
-
-        if len(lines) > 1:  # more than just the sheet header
-            chunks.append({
-                "text": "\n".join(lines),
-                "source": source,
-                "page_num": sheet_idx,
-                "chunk_index": 0,
-            })
-
-    logger.info("XLSX '%s': extracted %d sheet chunks", source, len(chunks))
-    return chunks
+    windows = 0
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet_idx, ws in enumerate(wb.worksheets):
+            header: Optional[str] = None
+            header_tokens = 0
+            rows: List[Tuple[int, str, int]] = []  # (row number, line, tokens) of the open window
+            window_tokens = 0
+            chunk_index = 0
+
+            for row_num, row in enumerate(ws.iter_rows(values_only=True), start=1):
+                cells = [_cell(v) for v in row]
+                while cells and not cells[-1]:
+                    cells.pop()  # trailing empty columns; a value's own " " / "|" stays
+                if not cells:
+                    continue
+                line = " | ".join(cells)
+                if header is None:
+                    header = line
+                    # Title line + header; the row-range digits are allowed for generously
+                    header_tokens = llm_adapter.count_tokens(f"[Sheet: {ws.title}] rows \n{header}\n") + 6
+                    continue
+                line_tokens = llm_adapter.count_tokens(line) + 1  # + newline
+                if rows and header_tokens + window_tokens + line_tokens > budget:
+                    yield _sheet_window(ws.title, header, header_tokens, rows, source, sheet_idx, chunk_index)
+                    windows += 1
+                    chunk_index += 1
+                    rows, window_tokens = [], 0
+                rows.append((row_num, line, line_tokens))
+                window_tokens += line_tokens
+
+            if rows:
+                yield _sheet_window(ws.title, header, header_tokens, rows, source, sheet_idx, chunk_index)
+                windows += 1
+    finally:
+        wb.close()
+
+    logger.info("XLSX '%s': extracted %d row windows", source, windows)
+
+
+def _sheet_window(
+    title: str,
+    header: str,
+    header_tokens: int,
+    rows: List[Tuple[int, str, int]],
+    source: str,
+    sheet_idx: int,
+    chunk_index: int,
+) -> dict:
+    lines = "\n".join(line for _, line, _ in rows)
+    return {
+        "text": f"[Sheet: {title}] rows {rows[0][0]}–{rows[-1][0]}\n{header}\n{lines}",
+        "source": source,
+        "page_num": sheet_idx,
+        "chunk_index": chunk_index,
+        "token_count": header_tokens + sum(tokens for _, _, tokens in rows),
+    }
 
 
 # ── Router ─────────────────────────────────────────────────────────────────────
 
-def route(path: str, file_bytes: bytes | None = None) -> List[dict]:
+def route(path: str, file_bytes: bytes | None = None) -> Iterable[dict]:
     """
     Dispatch to the appropriate extractor based on file extension.
     file_bytes is only needed when path is a temp path and source name matters.
+    XLSX is returned as a lazy iterator, so consume the result once.
     """
     ext = Path(path).suffix.lower()
 
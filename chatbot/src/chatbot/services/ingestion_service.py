@@ -1,15 +1,19 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import os
 import time
-from dataclasses import dataclass
-from typing import List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
+import tiktoken
 from langchain_community.document_loaders import BSHTMLLoader, PyPDFLoader, TextLoader
-from langchain.text_splitter import TokenTextSplitter
 
-from chatbot.adapters import llm_adapter, vector_adapter
+from chatbot.adapters import cache_adapter, llm_adapter, sparse_index, vector_adapter
 from chatbot.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -17,6 +21,9 @@ logger = logging.getLogger(__name__)
 SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".md", ".html", ".htm"}
 UPLOAD_SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".xlsx", ".jpg", ".jpeg", ".png", ".webp", ".gif", ".tiff", ".tif"}
 
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
 
 @dataclass
 class IngestionResult:
@@ -26,6 +33,10 @@ class IngestionResult:
     elapsed_seconds: float
     collection: str
     index_path: str
+    documents_unchanged: int = 0
+    documents_removed: int = 0
+    # discover / load / split / embed / index / save; load + split are summed over worker processes
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
 
 
 # ── Step 1: Discover Input Documents ──────────────────────────────────────────
@@ -46,77 +57,239 @@ def discover_documents(input_dir: str) -> List[str]:
 
 # ── Step 2: Load and Chunk Documents ──────────────────────────────────────────
 
-def load_and_chunk_documents(file_paths: List[str], chunk_size: int, chunk_overlap: int):
+class TokenSplitter:
     """
-    Load each document, split into overlapping token-based chunks.
-    Returns list of dicts: {text, source, page_num, chunk_index}
+    Overlapping windows of chunk_size cl100k_base tokens, stepping chunk_size - chunk_overlap
+    (LangChain's TokenTextSplitter windowing). split() returns each window's token count with
+    its text, so chunks never have to be tokenized a second time just to be measured.
     """
-    splitter = TokenTextSplitter(
-        encoding_name="cl100k_base",
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-    )
 
-    all_chunks: List[dict] = []
+    def __init__(self, chunk_size: int, chunk_overlap: int) -> None:
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.step = chunk_size - chunk_overlap
+        self._encoding = tiktoken.get_encoding("cl100k_base")
 
-    for file_path in file_paths:
-        filename = os.path.basename(file_path)
-        ext = os.path.splitext(file_path)[1].lower()
+    def split(self, text: str) -> List[Tuple[str, int]]:
+        """[(chunk text, token count)] in document order."""
+        ids = self._encoding.encode(text, disallowed_special=())
+        windows: List[Tuple[str, int]] = []
+        for start in range(0, len(ids), self.step):
+            window = ids[start : start + self.chunk_size]
+            windows.append((self._encoding.decode(window), len(window)))
+            if start + self.chunk_size >= len(ids):
+                break
+        return windows
 
-        try:
-            if ext == ".pdf":
-                loader = PyPDFLoader(file_path)
-            elif ext in (".html", ".htm"):
-                loader = BSHTMLLoader(file_path)
-            else:
-                loader = TextLoader(file_path, encoding="utf-8")
 
-            docs = loader.load()
-        except Exception as exc:
-            logger.error("Failed to load %s: %s — skipping", file_path, exc)
-            continue
+# Per-process splitter cache — worker processes build it once, not once per file
+_splitters: Dict[Tuple[int, int], TokenSplitter] = {}
+
+
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> TokenSplitter:
+    key = (chunk_size, chunk_overlap)
+    if key not in _splitters:
+        _splitters[key] = TokenSplitter(chunk_size, chunk_overlap)
+    return _splitters[key]
+
+
+def _rounded(timings: Dict[str, float]) -> Dict[str, float]:
+    return {stage: round(seconds, 3) for stage, seconds in timings.items()}
+
+
+def _add_time(timings: Optional[Dict[str, float]], stage: str, start: float) -> None:
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
 
-        for doc in docs:
-            page_num = doc.metadata.get("page", 0)
-            chunks = splitter.split_text(doc.page_content)
 
-            for idx, chunk_text in enumerate(chunks):
-                if not chunk_text.strip():
-                    continue
-                all_chunks.append({
-                    "text": chunk_text,
-                    "source": filename,
-                    "page_num": int(page_num),
-                    "chunk_index": idx,
-                })
+def load_and_chunk_file(
+    file_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    timings: Optional[Dict[str, float]] = None,
+) -> List[dict]:
+    """
+    Load one document and split it into overlapping token-based chunks.
+    Returns list of dicts: {text, source, page_num, chunk_index, token_count}; [] if the file can't be loaded.
+    token_count comes from the splitter and is stored with the chunk, so neither embedding-batch
+    planning nor query-time context packing re-tokenizes.
+    Seconds spent loading and splitting are added to timings["load"] / timings["split"] if given.
+    Module-level so it can run inside a ProcessPoolExecutor worker.
+    """
+    filename = os.path.basename(file_path)
+    ext = os.path.splitext(file_path)[1].lower()
+
+    start = time.perf_counter()
+    try:
+        if ext == ".pdf":
+            loader = PyPDFLoader(file_path)
+        elif ext in (".html", ".htm"):
+            loader = BSHTMLLoader(file_path)
+        else:
+            loader = TextLoader(file_path, encoding="utf-8")
+
+        docs = loader.load()
+    except Exception as exc:
+        logger.error("Failed to load %s: %s — skipping", file_path, exc)
+        return []
+    finally:
+        _add_time(timings, "load", start)
+
+    start = time.perf_counter()
+    splitter = _get_splitter(chunk_size, chunk_overlap)
+    file_chunks: List[dict] = []
+    for doc in docs:
+        page_num = doc.metadata.get("page", 0)
+        for idx, (chunk_text, tokens) in enumerate(splitter.split(doc.page_content)):
+            if not chunk_text.strip():
+                continue
+            file_chunks.append({
+                "text": chunk_text,
+                "source": filename,
+                "page_num": int(page_num),
+                "chunk_index": idx,
+                "token_count": tokens,
+            })
+    _add_time(timings, "split", start)
+
+    logger.info("Loaded and chunked: %s (%d chunks)", filename, len(file_chunks))
+    return file_chunks
+
+
+def _load_and_chunk_timed(file_path: str, chunk_size: int, chunk_overlap: int) -> Tuple[List[dict], Dict[str, float]]:
+    """Worker entry point: timings can't be shared across processes, so they are returned."""
+    timings: Dict[str, float] = {}
+    return load_and_chunk_file(file_path, chunk_size, chunk_overlap, timings), timings
+
+
+def iter_chunked_documents(
+    file_paths: List[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: int = 1,
+    timings: Optional[Dict[str, float]] = None,
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Yield (file_path, chunks) for each file, in input order.
+    With workers > 1, files are parsed and tokenized in a process pool with at most
+    2 × workers files in flight, so memory is bounded by the window, not the corpus.
+    Load / split seconds (summed over workers) are accumulated into timings if given.
+    """
+    workers = min(workers, len(file_paths))
+    if workers <= 1:
+        for file_path in file_paths:
+            yield file_path, load_and_chunk_file(file_path, chunk_size, chunk_overlap, timings)
+        return
+
+    def result(future: Future) -> List[dict]:
+        chunks, worker_timings = future.result()
+        if timings is not None:
+            for stage, seconds in worker_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return chunks
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight: Deque[Tuple[str, Future]] = deque()
+        for file_path in file_paths:
+            in_flight.append((file_path, pool.submit(_load_and_chunk_timed, file_path, chunk_size, chunk_overlap)))
+            if len(in_flight) >= workers * 2:
+                done_path, future = in_flight.popleft()
+                yield done_path, result(future)
+        while in_flight:
+            done_path, future = in_flight.popleft()
+            yield done_path, result(future)
 
-        logger.info("Loaded and chunked: %s (%d chunks)", filename, len(all_chunks))
+
+def load_and_chunk_documents(file_paths: List[str], chunk_size: int, chunk_overlap: int):
+    """
+    Load each document, split into overlapping token-based chunks.
+    Returns list of dicts: {text, source, page_num, chunk_index, token_count}
+    """
+    all_chunks: List[dict] = []
+    for _, file_chunks in iter_chunked_documents(file_paths, chunk_size, chunk_overlap):
+        all_chunks.extend(file_chunks)
 
     logger.info("Total chunks after processing all documents: %d", len(all_chunks))
     return all_chunks
 
 
+# ── Ingestion Manifest (incremental re-ingestion) ────────────────────────────
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(index_path: str) -> dict:
+    """
+    Read manifest.json from an index directory.
+    Returns {} if it is missing or unreadable (which forces a full rebuild).
+    """
+    manifest_file = os.path.join(index_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as exc:
+        logger.warning("Ignoring unreadable manifest %s: %s", manifest_file, exc)
+        return {}
+
+
+def save_manifest(index_path: str, manifest: dict) -> None:
+    """Atomically write manifest.json next to index.faiss and the chunk store."""
+    manifest_file = os.path.join(index_path, MANIFEST_FILENAME)
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def _manifest_reusable(manifest: dict, writer: vector_adapter.IndexWriter) -> bool:
+    """A manifest is only trusted if it was built with the same settings against this exact index."""
+    settings = get_settings()
+    return (
+        manifest.get("version") == MANIFEST_VERSION
+        and manifest.get("embedding_model") == settings.embedding_model
+        and manifest.get("chunk_size") == settings.chunk_size
+        and manifest.get("chunk_overlap") == settings.chunk_overlap
+        and manifest.get("index_type", "flat") == settings.faiss_index_type
+        and manifest.get("ntotal") == writer.next_id
+    )
+
+
 # ── Steps 3–5: Embed → Index → Save → Report ──────────────────────────────────
 
 def ingest(
     input_dir: str | None = None,
     indexed_dir: str | None = None,
     collection: str | None = None,
+    full: bool = False,
 ) -> IngestionResult:
     """
-    Full ingestion pipeline:
-    1. Discover documents
-    2. Load and chunk
-    3. Embed all chunks
-    4. Build and save FAISS index
+    Ingestion pipeline:
+    1. Discover documents and diff them against the collection's manifest
+    2. Load and chunk new / changed files only (process pool, streamed)
+    3. Embed their chunks in batches of INGEST_BATCH_SIZE as they arrive
+    4. Append to the FAISS index, tombstone vectors of changed / deleted files, save
+       (plus the BM25 index when ENABLE_HYBRID_SEARCH is on)
     5. Report results
+
+    Unchanged files (same size + mtime, or same SHA-256) are never re-embedded.
+    full=True (or a missing / incompatible manifest) rebuilds the index from scratch.
     """
     settings = get_settings()
     input_dir = input_dir or settings.data_input_dir
     indexed_dir = indexed_dir or settings.data_indexed_dir
     collection = collection or settings.default_collection
+    index_path = os.path.join(indexed_dir, collection)
 
     start_time = time.time()
+    stages: Dict[str, float] = {}
+    stage_start = time.perf_counter()
 
     # Step 1
     file_paths = discover_documents(input_dir)
@@ -126,50 +299,180 @@ def ingest(
             f"Add .pdf, .txt, .md, or .html files and retry."
         )
 
-    # Step 2
-    chunks = load_and_chunk_documents(
-        file_paths,
+    writer = vector_adapter.IndexWriter(indexed_dir, collection, append=not full)
+    manifest = {} if full else load_manifest(index_path)
+    if manifest and not _manifest_reusable(manifest, writer):
+        logger.info("Manifest for '%s' does not match the current index/settings — full rebuild", collection)
+        manifest = {}
+    previous: Dict[str, dict] = manifest.get("files", {})
+
+    unchanged: Dict[str, dict] = {}
+    pending: List[Tuple[str, str, dict]] = []  # (relative path, absolute path, fingerprint)
+    for path in file_paths:
+        rel = os.path.relpath(path, input_dir)
+        stat = os.stat(path)
+        entry = previous.get(rel)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            unchanged[rel] = entry
+            continue
+        fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _file_sha256(path)}
+        if entry and entry["sha256"] == fingerprint["sha256"]:
+            unchanged[rel] = {**entry, **fingerprint}  # touched but identical content
+            continue
+        pending.append((rel, path, fingerprint))
+
+    # Vectors of files that changed or disappeared since the last run
+    stale_ids = [
+        vid
+        for rel, entry in previous.items()
+        if rel not in unchanged
+        for vid in range(*entry["vector_ids"])
+    ]
+    pending_rels = {rel for rel, _, _ in pending}
+    removed = sum(1 for rel in previous if rel not in unchanged and rel not in pending_rels)
+
+    rebuild = not previous
+    if not rebuild and writer.next_id:
+        tombstoned = writer.tombstone_count + len(stale_ids)
+        if tombstoned / writer.next_id > settings.ingest_compaction_ratio:
+            logger.info(
+                "Tombstoned vectors would reach %.0f%% of '%s' — compacting with a full rebuild",
+                100 * tombstoned / writer.next_id, collection,
+            )
+            rebuild = True
+
+    if rebuild and previous:
+        # Re-ingest everything; unchanged files keep their fingerprints
+        pending.extend(
+            (rel, os.path.join(input_dir, rel), {k: entry[k] for k in ("size", "mtime_ns", "sha256")})
+            for rel, entry in unchanged.items()
+        )
+        unchanged = {}
+    if rebuild:
+        writer = vector_adapter.IndexWriter(indexed_dir, collection)
+        stale_ids = []
+
+    _add_time(stages, "discover", stage_start)
+
+    if not pending and not stale_ids:
+        logger.info("Collection '%s' is up to date — %d documents unchanged", collection, len(unchanged))
+        if settings.enable_hybrid_search:
+            sparse_index.update(index_path)  # no-op unless hybrid search was off on an earlier run
+        vector_adapter.load_index(indexed_dir, collection)
+        return IngestionResult(
+            documents_processed=0,
+            total_chunks=0,
+            vectors_indexed=0,
+            elapsed_seconds=round(time.time() - start_time, 1),
+            collection=collection,
+            index_path=index_path,
+            documents_unchanged=len(unchanged),
+            stage_seconds=_rounded(stages),
+        )
+
+    # Steps 2–4: Parse/chunk in worker processes; embed and index in bounded batches as chunks arrive
+    files: Dict[str, dict] = dict(unchanged)
+    batch: List[dict] = []
+    total_chunks = 0
+    vectors_indexed = 0
+
+    def flush() -> None:
+        nonlocal vectors_indexed
+        start = time.perf_counter()
+        embeddings = llm_adapter.embed_texts(
+            [c["text"] for c in batch],
+            token_counts={c["text"]: c["token_count"] for c in batch if c.get("token_count")},
+        )
+        _add_time(stages, "embed", start)
+        start = time.perf_counter()
+        writer.add(embeddings, [
+            {
+                "text": chunk["text"],
+                "source": chunk["source"],
+                "page_num": chunk["page_num"],
+                "chunk_index": chunk["chunk_index"],
+                "token_count": chunk.get("token_count", 0),
+            }
+            for chunk in batch
+        ])
+        _add_time(stages, "index", start)
+        vectors_indexed += len(embeddings)
+        batch.clear()
+
+    fingerprints = {path: (rel, fingerprint) for rel, path, fingerprint in pending}
+    next_id = writer.next_id
+    workers = settings.ingest_workers or os.cpu_count() or 1
+    for path, file_chunks in iter_chunked_documents(
+        list(fingerprints),
         chunk_size=settings.chunk_size,
         chunk_overlap=settings.chunk_overlap,
-    )
-    if not chunks:
+        workers=workers,
+        timings=stages,
+    ):
+        if not file_chunks:
+            continue  # Not recorded — retried on the next run
+        rel, fingerprint = fingerprints[path]
+        # Ids are assigned in arrival order, so each file owns a contiguous range
+        files[rel] = {**fingerprint, "vector_ids": [next_id, next_id + len(file_chunks)]}
+        next_id += len(file_chunks)
+        total_chunks += len(file_chunks)
+        batch.extend(file_chunks)
+        if len(batch) >= settings.ingest_batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if rebuild and not total_chunks:
         raise ValueError("No text could be extracted from the provided documents.")
 
-    # Step 3: Embed all chunks
-    texts = [c["text"] for c in chunks]
-    embeddings = llm_adapter.embed_texts(texts)
-
-    # Step 4: Build metadata dict and save FAISS index
-    metadata = {
-        i: {
-            "text": chunks[i]["text"],
-            "source": chunks[i]["source"],
-            "page_num": chunks[i]["page_num"],
-            "chunk_index": chunks[i]["chunk_index"],
-        }
-        for i in range(len(chunks))
-    }
-
-    index_path = os.path.join(indexed_dir, collection)
-    vector_adapter.save_index(embeddings, metadata, indexed_dir, collection)
+    stage_start = time.perf_counter()
+    writer.remove(stale_ids)
+    writer.commit()
+    if settings.enable_hybrid_search:
+        # A full rebuild re-indexes everything; otherwise only the rows added or tombstoned by this run
+        if rebuild:
+            sparse_index.build(index_path)
+        else:
+            sparse_index.update(index_path)
+    cache_adapter.invalidate_semantic_cache(collection)
+
+    save_manifest(index_path, {
+        "version": MANIFEST_VERSION,
+        "embedding_model": settings.embedding_model,
+        "chunk_size": settings.chunk_size,
+        "chunk_overlap": settings.chunk_overlap,
+        # The type actually built: a flat fallback (too few vectors for IVF-PQ) no longer matches
+        # FAISS_INDEX_TYPE, so a later run rebuilds and retrains once there are enough vectors
+        "index_type": writer.index_type,
+        "ntotal": writer.next_id,
+        "files": files,
+    })
+    _add_time(stages, "save", stage_start)
 
     elapsed = time.time() - start_time
 
     # Step 5: Report
     result = IngestionResult(
-        documents_processed=len(file_paths),
-        total_chunks=len(chunks),
-        vectors_indexed=len(embeddings),
+        documents_processed=len(pending),
+        total_chunks=total_chunks,
+        vectors_indexed=vectors_indexed,
         elapsed_seconds=round(elapsed, 1),
         collection=collection,
         index_path=index_path,
+        documents_unchanged=len(unchanged),
+        documents_removed=removed,
+        stage_seconds=_rounded(stages),
     )
 
     logger.info(
-        "Ingestion complete — docs=%d, chunks=%d, vectors=%d, time=%.1fs, path=%s",
+        "Ingestion complete — docs=%d (unchanged=%d, removed=%d), chunks=%d, vectors=%d, "
+        "tombstoned=%d, time=%.1fs, path=%s",
         result.documents_processed,
+        result.documents_unchanged,
+        result.documents_removed,
         result.total_chunks,
         result.vectors_indexed,
+        writer.tombstone_count,
         result.elapsed_seconds,
         result.index_path,
     )
@@ -184,18 +487,23 @@ class UploadResult:
     source: str
     chunks_indexed: int
     elapsed_seconds: float
+    stage_seconds: Dict[str, float] = field(default_factory=dict)  # extract / split / embed / store
 
 
 def ingest_file(
     file_path: str,
     collection: str,
+    progress: Optional[Callable[[str], None]] = None,
 ) -> UploadResult:
     """
     Ingest a single uploaded file into Supabase pgvector.
     1. Extract text via extractors.route()
-    2. Chunk via TokenTextSplitter
+    2. Chunk via TokenSplitter (pre-sized XLSX row windows are kept as they are)
     3. Embed via llm_adapter.embed_texts()
     4. Insert into Supabase via supabase_adapter.insert_chunks()
+    Steps 3–4 run every INGEST_BATCH_SIZE chunks while extraction continues. If any step fails,
+    the rows already inserted for this file are deleted again, so an upload is all-or-nothing.
+    progress, if given, is called with "extracting" / "embedding" / "storing" as the job moves.
     """
     from chatbot.adapters import supabase_adapter
     from chatbot.services import extractors
@@ -203,48 +511,92 @@ def ingest_file(
     settings = get_settings()
     start_time = time.time()
     source = os.path.basename(file_path)
-
-    # Step 1: Extract raw chunks from the file
-    raw_chunks = extractors.route(file_path)
-    if not raw_chunks:
-        raise ValueError(f"No text could be extracted from '{source}'.")
-
-    # Step 2: Split each chunk's text with TokenTextSplitter
-    splitter = TokenTextSplitter(
-        encoding_name="cl100k_base",
-        chunk_size=settings.chunk_size,
-        chunk_overlap=settings.chunk_overlap,
-    )
-    final_chunks: List[dict] = []
-    for raw in raw_chunks:
-        sub_texts = splitter.split_text(raw["text"])
-        for idx, sub_text in enumerate(sub_texts):
-            if sub_text.strip():
-                final_chunks.append({
-                    "text": sub_text,
-                    "source": raw["source"],
-                    "page_num": raw.get("page_num", 0),
-                    "chunk_index": idx,
-                })
-
-    if not final_chunks:
-        raise ValueError(f"No text chunks produced from '{source}'.")
-
-    # Step 3: Embed all chunks
-    texts = [c["text"] for c in final_chunks]
-    embeddings = llm_adapter.embed_texts(texts)
-
-    # Step 4: Insert into Supabase
-    supabase_adapter.insert_chunks(collection, final_chunks, embeddings)
+    report = progress or (lambda stage: None)
+
+    batch: List[dict] = []
+    stored_ids: List[int] = []
+    stages: Dict[str, float] = {}
+
+    def flush() -> None:
+        # Step 3: Embed the batch
+        report("embedding")
+        start = time.perf_counter()
+        embeddings = llm_adapter.embed_texts(
+            [c["text"] for c in batch],
+            token_counts={c["text"]: c["token_count"] for c in batch if c.get("token_count")},
+        )
+        _add_time(stages, "embed", start)
+        # Step 4: Insert into Supabase
+        report("storing")
+        start = time.perf_counter()
+        stored_ids.extend(supabase_adapter.insert_chunks(collection, batch, embeddings))
+        _add_time(stages, "store", start)
+        batch.clear()
+        report("extracting")
+
+    try:
+        # Step 1: Extract raw chunks from the file (XLSX streams row windows), embedding and
+        # storing every INGEST_BATCH_SIZE chunks so memory is bounded by the batch, not the file
+        report("extracting")
+        extracted = 0
+        raw_chunks = iter(extractors.route(file_path))
+        while True:
+            start = time.perf_counter()
+            raw = next(raw_chunks, None)
+            _add_time(stages, "extract", start)
+            if raw is None:
+                break
+            extracted += 1
+            # Step 2: Split each chunk's text with TokenSplitter, unless the extractor already sized it
+            start = time.perf_counter()
+            if 0 < raw.get("token_count", 0) <= settings.chunk_size:
+                if raw["text"].strip():
+                    batch.append(raw)
+            else:
+                splitter = _get_splitter(settings.chunk_size, settings.chunk_overlap)
+                for idx, (sub_text, tokens) in enumerate(splitter.split(raw["text"])):
+                    if sub_text.strip():
+                        batch.append({
+                            "text": sub_text,
+                            "source": raw["source"],
+                            "page_num": raw.get("page_num", 0),
+                            "chunk_index": idx,
+                            "token_count": tokens,
+                        })
+            _add_time(stages, "split", start)
+            if len(batch) >= settings.ingest_batch_size:
+                flush()
+
+        if not extracted:
+            raise ValueError(f"No text could be extracted from '{source}'.")
+        if batch:
+            flush()
+        if not stored_ids:
+            raise ValueError(f"No text chunks produced from '{source}'.")
+    except BaseException:
+        if stored_ids:
+            logger.warning("Upload of '%s' failed — deleting the %d chunks already stored", source, len(stored_ids))
+            try:
+                supabase_adapter.delete_chunks(stored_ids)
+            except Exception as exc:
+                logger.error("Could not delete the partial upload of '%s' (row ids %d–%d): %s",
+                             source, min(stored_ids), max(stored_ids), exc)
+        raise
+    finally:
+        # Even a failed upload may have been visible for a while
+        if stored_ids:
+            cache_adapter.invalidate_semantic_cache(collection)
+    stored = len(stored_ids)
 
     elapsed = round(time.time() - start_time, 1)
     logger.info(
         "Upload ingestion complete — collection='%s', source='%s', chunks=%d, time=%.1fs",
-        collection, source, len(final_chunks), elapsed,
+        collection, source, stored, elapsed,
     )
     return UploadResult(
         collection=collection,
         source=source,
-        chunks_indexed=len(final_chunks),
+        chunks_indexed=stored,
         elapsed_seconds=elapsed,
+        stage_seconds=_rounded(stages),
     )
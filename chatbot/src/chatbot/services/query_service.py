@@ -1,15 +1,19 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
-from dataclasses import dataclass
-from typing import List, Optional, Tuple
-
-import tiktoken
-
-from chatbot.adapters import cache_adapter, llm_adapter, vector_adapter
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+from chatbot import metrics
+from chatbot.adapters import cache_adapter, llm_adapter, sparse_index, vector_adapter
 from chatbot.adapters.supabase_adapter import RetrievedChunk as SupabaseChunk
 from chatbot.config import get_settings
+from chatbot.services import reranker
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +25,48 @@ class RAGResult:
     has_context: bool
 
 
+# ── Stage timings ─────────────────────────────────────────────────────────────
+
+T = TypeVar("T")
+
+_stage_latency = metrics.histogram(
+    "chatbot_rag_stage_seconds", "Duration of each RAG pipeline stage", label="stage"
+)
+
+
+class StageTimer:
+    """
+    Per-stage wall-clock milliseconds for one request, also observed in chatbot_rag_stage_seconds.
+    Stages that run concurrently overlap, so they can add up to more than the total.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 2)
+        _stage_latency.observe(seconds, name)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    async def run(self, name: str, awaitable: Awaitable[T]) -> T:
+        with self.stage(name):
+            return await awaitable
+
+    def header(self) -> str:
+        """Server-Timing header value, e.g. "embed;dur=41.2, search;dur=3.9, total;dur=812.5"."""
+        parts = [f"{name};dur={ms}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self._start) * 1000:.2f}")
+        return ", ".join(parts)
+
+
 # ── Step 2: Query Sanitization ─────────────────────────────────────────────────
 
 def sanitize_query(raw_question: str) -> str:
@@ -42,6 +88,64 @@ def sanitize_query(raw_question: str) -> str:
     return cleaned
 
 
+# ── Step 5: Dynamic Threshold ──────────────────────────────────────────────────
+
+def apply_threshold(chunks: List[vector_adapter.RetrievedChunk]) -> List[vector_adapter.RetrievedChunk]:
+    """Keep chunks scoring at least THRESHOLD_RATIO × the best score."""
+    if not chunks:
+        return []
+    max_score = max(c.score for c in chunks)
+    threshold = get_settings().threshold_ratio * max_score
+    return [c for c in chunks if c.score >= threshold]
+
+
+# ── Step 4b: Hybrid Retrieval (BM25 + dense, reciprocal-rank fusion) ──────────
+
+# BM25 lookups run here while the calling thread embeds the question and searches FAISS
+_sparse_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[vector_adapter.RetrievedChunk]],
+    k: int,
+    rrf_k: int = 60,
+) -> List[vector_adapter.RetrievedChunk]:
+    """Merge ranked lists by Σ 1 / (rrf_k + rank); returned chunks carry the fused score."""
+    fused: Dict[int, float] = {}
+    chunks: Dict[int, vector_adapter.RetrievedChunk] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            fused[chunk.vector_id] = fused.get(chunk.vector_id, 0.0) + 1.0 / (rrf_k + rank)
+            chunks.setdefault(chunk.vector_id, chunk)
+    best = sorted(fused, key=lambda vid: fused[vid], reverse=True)[:k]
+    return [replace(chunks[vid], score=fused[vid]) for vid in best]
+
+
+def _submit_sparse(question: str, collection_name: str) -> Future:
+    settings = get_settings()
+    return _sparse_pool.submit(
+        sparse_index.search, settings.data_indexed_dir, collection_name, question, settings.hybrid_candidates
+    )
+
+
+def fuse_hybrid(
+    dense_chunks: List[vector_adapter.RetrievedChunk],
+    sparse_hits: List[Tuple[int, float]],
+    collection_name: str,
+) -> List[vector_adapter.RetrievedChunk]:
+    """
+    Threshold the dense candidates, then fuse them with the BM25 candidates. Keyword matches
+    (part numbers, names) survive even when their dense score falls under the threshold.
+    """
+    settings = get_settings()
+    sparse_chunks = vector_adapter.get_chunks(
+        sparse_hits, collection=collection_name, with_embeddings=settings.enable_mmr
+    )
+    return reciprocal_rank_fusion(
+        [apply_threshold(dense_chunks), sparse_chunks], k=reranker.candidate_k(), rrf_k=settings.rrf_k
+    )
+
+
 # ── Step 6: Context Token Budget ──────────────────────────────────────────────
 
 def build_context_block(
@@ -52,18 +156,14 @@ def build_context_block(
     Pack chunks into a context string within the token budget.
     Returns (context_string, accepted_chunks).
     Chunks are added in score order (best first). Chunks that don't fit are skipped.
+    Uses the token counts stored at ingest; only chunks without one are tokenized.
     """
-    try:
-        encoder = tiktoken.encoding_for_model("gpt-4o")
-    except Exception:
-        encoder = tiktoken.get_encoding("cl100k_base")
-
     context_parts: List[str] = []
     accepted: List[vector_adapter.RetrievedChunk] = []
     token_count = 0
 
     for chunk in chunks:
-        chunk_tokens = len(encoder.encode(chunk.text))
+        chunk_tokens = chunk.token_count or llm_adapter.count_tokens(chunk.text)
         if token_count + chunk_tokens <= max_tokens:
             context_parts.append(
                 f"{chunk.text}\nSource: {chunk.source}, page {chunk.page_num + 1}"
@@ -82,16 +182,9 @@ def relevance_precheck(question: str, context: str) -> bool:
     Lightweight LLM call to verify context is actually relevant to the question.
     Returns True if relevant, False otherwise.
     """
-    prompt = (
-        "Given the following context and question, answer YES if the context contains "
-        "information that could answer the question, or NO if it does not.\n\n"
-        f"Context:\n{context[:2000]}\n\n"
-        f"Question: {question}\n\n"
-        "Answer (YES/NO only):"
-    )
     try:
         response = llm_adapter.chat_completion([
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": _precheck_prompt(question, context)}
         ])
         return response.strip().upper().startswith("YES")
     except Exception as exc:
@@ -99,6 +192,28 @@ def relevance_precheck(question: str, context: str) -> bool:
         return True  # Fail open
 
 
+async def arelevance_precheck(question: str, context: str) -> bool:
+    """Async relevance_precheck."""
+    try:
+        response = await llm_adapter.achat_completion([
+            {"role": "user", "content": _precheck_prompt(question, context)}
+        ])
+        return response.strip().upper().startswith("YES")
+    except Exception as exc:
+        logger.warning("Relevance pre-check failed: %s — proceeding with main LLM call", exc)
+        return True  # Fail open
+
+
+def _precheck_prompt(question: str, context: str) -> str:
+    return (
+        "Given the following context and question, answer YES if the context contains "
+        "information that could answer the question, or NO if it does not.\n\n"
+        f"Context:\n{context[:2000]}\n\n"
+        f"Question: {question}\n\n"
+        "Answer (YES/NO only):"
+    )
+
+
 # ── Step 9: Build Prompt and Call LLM ─────────────────────────────────────────
 
 SYSTEM_PROMPT = (
@@ -125,55 +240,117 @@ def build_messages(question: str, context: str, history: List[dict]) -> List[dic
     return messages
 
 
+_SEARCH_UNAVAILABLE = RAGResult(
+    answer="Vector search is temporarily unavailable. Please try again later.",
+    sources=[],
+    has_context=False,
+)
+_INDEX_MISSING = RAGResult(
+    answer=(
+        "The document index has not been built yet. "
+        "Please run the ingestion script first: python scripts/ingest.py"
+    ),
+    sources=[],
+    has_context=False,
+)
+
+
 # ── Main RAG Pipeline (Steps 3–11) ────────────────────────────────────────────
 
 def run_rag_pipeline(
     question: str,
     session_id: str,
     collection_name: str = "default",
+    gate: Optional[Callable[[], None]] = None,
 ) -> RAGResult:
     """
     Execute the full 11-step RAG pipeline.
     Assumes Step 1 (auth) and Step 2 (sanitization) are handled by the caller.
+    gate (e.g. the result of a moderation call started by the caller) is called once retrieval
+    is done, before any answer is returned or saved — it may raise to abort the request.
     """
     settings = get_settings()
+    hybrid = settings.enable_hybrid_search and settings.vector_backend != "supabase"
 
-    # Step 3 & 4: Embed query + similarity search (Supabase or FAISS)
+    # Step 4b (started early): BM25 needs no embedding, so it overlaps Steps 3–4
+    sparse_future = _submit_sparse(question, collection_name) if hybrid else None
+
+    # Step 3: Embed query (repeat questions hit the in-process LRU)
     query_vector = llm_adapter.embed_query(question)
 
+    # Step 7 (hoisted): chat history — also decides whether the semantic cache applies
+    history = cache_adapter.get_history(session_id)
+
+    # Semantic answer cache: first turns only, since follow-up answers depend on history
+    use_semantic_cache = settings.enable_semantic_cache and not history
+    if use_semantic_cache:
+        cached = cache_adapter.semantic_lookup(collection_name, query_vector)
+        if cached:
+            if gate is not None:
+                gate()
+            cache_adapter.save_history(session_id, question, cached["answer"])
+            return RAGResult(answer=cached["answer"], sources=cached["sources"], has_context=True)
+
+    # Step 4: Similarity search (Supabase or FAISS)
+
     if settings.vector_backend == "supabase":
         from chatbot.adapters import supabase_adapter
         try:
             raw_chunks = supabase_adapter.search(
                 collection=collection_name,
                 query_vec=query_vector,
-                k=settings.vector_search_k,
+                k=reranker.candidate_k(),
+                with_embeddings=settings.enable_mmr,
             )
         except Exception as exc:
             logger.error("Supabase search failed: %s", exc)
-            return RAGResult(
-                answer="Vector search is temporarily unavailable. Please try again later.",
-                sources=[],
-                has_context=False,
-            )
+            return _SEARCH_UNAVAILABLE
     else:
         # FAISS fallback
-        if not vector_adapter.is_index_loaded(collection_name):
-            loaded = vector_adapter.load_index(settings.data_indexed_dir, collection_name)
-            if not loaded:
-                return RAGResult(
-                    answer=(
-                        "The document index has not been built yet. "
-                        "Please run the ingestion script first: python scripts/ingest.py"
-                    ),
-                    sources=[],
-                    has_context=False,
-                )
+        # Loads on first query (and marks the collection recently used, which protects it from eviction)
+        if not vector_adapter.load_index(settings.data_indexed_dir, collection_name):
+            return _INDEX_MISSING
         raw_chunks = vector_adapter.search(
             query_vector,
-            k=settings.vector_search_k,
+            k=settings.hybrid_candidates if hybrid else reranker.candidate_k(),
             collection=collection_name,
+            with_embeddings=settings.enable_mmr,
         )
+        if sparse_future is not None:
+            raw_chunks = fuse_hybrid(raw_chunks, sparse_future.result(), collection_name)
+
+    if gate is not None:
+        gate()
+    result = answer_from_chunks(question, raw_chunks, history, threshold=not hybrid, query_vector=query_vector)
+
+    # Step 10: Save updated history (only when the LLM actually answered from context)
+    if result.has_context:
+        cache_adapter.save_history(session_id, question, result.answer)
+        if use_semantic_cache:
+            cache_adapter.semantic_store(collection_name, query_vector, result.answer, result.sources)
+
+    return result
+
+
+@dataclass
+class PreparedContext:
+    context: str
+    sources: List[dict]  # [{"filename": str, "page_num": int}], deduplicated
+
+
+def prepare_context(
+    raw_chunks: List[vector_adapter.RetrievedChunk],
+    threshold: bool = True,
+    question: str = "",
+    query_vector: Optional[List[float]] = None,
+) -> Union[RAGResult, PreparedContext]:
+    """
+    Steps 5, 5b, 6 and 11: threshold, rerank, token budget, deduplicated sources.
+    Returns a final (has_context=False) RAGResult when nothing is left to answer from.
+    threshold=False skips Step 5 for hybrid results, which were thresholded before fusion.
+    Step 5b (MMR / cross-encoder, see reranker) needs the question and its query_vector.
+    """
+    settings = get_settings()
 
     if not raw_chunks:
         return RAGResult(
@@ -183,18 +360,20 @@ def run_rag_pipeline(
         )
 
     # Step 5: Dynamic threshold filtering
-    max_score = max(c.score for c in raw_chunks)
-    threshold = settings.threshold_ratio * max_score
-    filtered_chunks = [c for c in raw_chunks if c.score >= threshold]
+    filtered_chunks = apply_threshold(raw_chunks) if threshold else raw_chunks
 
     if not filtered_chunks:
-        logger.info("All chunks fell below threshold (max=%.4f, threshold=%.4f)", max_score, threshold)
+        logger.info("All chunks fell below threshold (max=%.4f)", max(c.score for c in raw_chunks))
         return RAGResult(
             answer="I don't have relevant information about that in my documents.",
             sources=[],
             has_context=False,
         )
 
+    # Step 5b: Pick VECTOR_SEARCH_K diverse, relevant chunks out of RERANK_CANDIDATES
+    if query_vector is not None and reranker.enabled():
+        filtered_chunks = reranker.rerank(question, query_vector, filtered_chunks)
+
     # Step 6: Context token budget
     context_str, accepted_chunks = build_context_block(
         filtered_chunks, max_tokens=settings.max_context_tokens
@@ -207,33 +386,386 @@ def run_rag_pipeline(
             has_context=False,
         )
 
-    # Step 7: Load chat history
-    history = cache_adapter.get_history(session_id)
+    # Step 11: Structured sources, deduplicated by (file, page)
+    seen: set[str] = set()
+    sources: List[dict] = []
+    for chunk in accepted_chunks:
+        key = f"{chunk.source}:{chunk.page_num}"
+        if key not in seen:
+            seen.add(key)
+            sources.append({"filename": chunk.source, "page_num": chunk.page_num + 1})
+
+    return PreparedContext(context=context_str, sources=sources)
+
+
+_PRECHECK_REJECTED = RAGResult(
+    answer="I don't have information about that in my documents.",
+    sources=[],
+    has_context=False,
+)
+
+
+def answer_from_chunks(
+    question: str,
+    raw_chunks: List[vector_adapter.RetrievedChunk],
+    history: List[dict],
+    generate: bool = True,
+    threshold: bool = True,
+    query_vector: Optional[List[float]] = None,
+) -> RAGResult:
+    """
+    Steps 5–9 + 11: prepare_context, optional pre-check, LLM call.
+    With generate=False the LLM is skipped and answer is empty (retrieval-only evaluation).
+    """
+    prepared = prepare_context(raw_chunks, threshold=threshold, question=question, query_vector=query_vector)
+    if isinstance(prepared, RAGResult):
+        return prepared
+    if not generate:
+        return RAGResult(answer="", sources=prepared.sources, has_context=True)
 
     # Step 8: Optional relevance pre-check
-    if settings.enable_relevance_precheck:
-        if not relevance_precheck(question, context_str):
+    if get_settings().enable_relevance_precheck:
+        if not relevance_precheck(question, prepared.context):
             logger.info("Relevance pre-check returned false — skipping LLM call")
-            return RAGResult(
-                answer="I don't have information about that in my documents.",
-                sources=[],
-                has_context=False,
-            )
+            return _PRECHECK_REJECTED
 
     # Step 9: Main LLM call
-    messages = build_messages(question, context_str, history)
+    messages = build_messages(question, prepared.context, history)
     answer = llm_adapter.chat_completion(messages)
 
-    # Step 10: Save updated history
-    cache_adapter.save_history(session_id, question, answer)
+    return RAGResult(answer=answer, sources=prepared.sources, has_context=True)
 
-    # Step 11: Build structured response with deduplicated sources
-    seen: set[str] = set()
-    sources: List[dict] = []
-    for chunk in accepted_chunks:
-        key = f"{chunk.source}:{chunk.page_num}"
-        if key not in seen:
-            seen.add(key)
-            sources.append({"filename": chunk.source, "page_num": chunk.page_num + 1})
 
-    return RAGResult(answer=answer, sources=sources, has_context=True)
+# ── Async RAG Pipeline (API event loop) ───────────────────────────────────────
+
+async def arun_rag_pipeline(
+    question: str,
+    session_id: str,
+    collection_name: str = "default",
+    gate: Optional[Awaitable[Any]] = None,
+    timer: Optional[StageTimer] = None,
+) -> RAGResult:
+    """
+    Async run_rag_pipeline, run as the stage graph described in _aprepare_turn. FAISS and
+    psycopg2 work runs on worker threads, so a slow LLM call never stalls other requests.
+    gate (e.g. content moderation) runs speculatively alongside retrieval and is awaited just
+    before the main LLM call — it may raise to abort the request. timer collects per-stage times.
+    """
+    timer = timer or StageTimer()
+    gate_task = asyncio.ensure_future(timer.run("moderation", gate)) if gate is not None else None
+    try:
+        return await _arun_rag_pipeline(question, session_id, collection_name, gate_task, timer)
+    finally:
+        if gate_task is not None and not gate_task.done():
+            gate_task.cancel()
+
+
+async def _asearch(
+    query_vector: List[float],
+    collection_name: str,
+    sparse_future: Optional["asyncio.Future[List[Tuple[int, float]]]"],
+) -> Union[RAGResult, List[vector_adapter.RetrievedChunk]]:
+    """Step 4 for the async pipeline; returns a final RAGResult if search is impossible."""
+    settings = get_settings()
+    if settings.vector_backend == "supabase":
+        from chatbot.adapters import supabase_adapter
+        try:
+            return await supabase_adapter.asearch(
+                collection=collection_name,
+                query_vec=query_vector,
+                k=reranker.candidate_k(),
+                with_embeddings=settings.enable_mmr,
+            )
+        except Exception as exc:
+            logger.error("Supabase search failed: %s", exc)
+            return _SEARCH_UNAVAILABLE
+
+    if not await asyncio.to_thread(vector_adapter.load_index, settings.data_indexed_dir, collection_name):
+        return _INDEX_MISSING
+    raw_chunks = await asyncio.to_thread(
+        vector_adapter.search,
+        query_vector,
+        settings.hybrid_candidates if sparse_future is not None else reranker.candidate_k(),
+        collection_name,
+        settings.enable_mmr,
+    )
+    if sparse_future is not None:
+        raw_chunks = fuse_hybrid(raw_chunks, await sparse_future, collection_name)
+    return raw_chunks
+
+
+@dataclass
+class _AsyncTurn:
+    """State of an async request once retrieval and the gate are done, before the LLM answers."""
+    history: List[dict]
+    query_vector: List[float]
+    use_semantic_cache: bool
+    prepared: Optional[PreparedContext] = None
+    messages: List[dict] = field(default_factory=list)  # Step 9 prompt, assembled ahead of the gate
+    final: Optional[RAGResult] = None  # decided without the main LLM call
+    cache_hit: bool = False
+
+
+async def _aprepare_turn(
+    question: str,
+    session_id: str,
+    collection_name: str,
+    gate_task: Optional["asyncio.Future[Any]"],
+    timer: StageTimer,
+) -> _AsyncTurn:
+    """
+    Everything up to the main LLM call, as a stage graph:
+
+        moderation (gate_task, started by the caller) ─────────────────────────┐
+        history ─────────────┐                                                 │
+        embed → search ──────┴→ semantic cache → prepare_context ─┬→ prompt ───┼→ gate → LLM
+        BM25 (hybrid) ───────┘                                    └→ precheck ─┘
+
+    The gate is awaited once, after every other stage — nothing is answered, saved or sent
+    before moderation passes. The optional pre-check is an LLM call, so it may start before
+    moderation has finished.
+    """
+    settings = get_settings()
+    hybrid = settings.enable_hybrid_search and settings.vector_backend != "supabase"
+    sparse_future = asyncio.wrap_future(_submit_sparse(question, collection_name)) if hybrid else None
+
+    async def retrieve() -> Tuple[List[float], Union[RAGResult, List[vector_adapter.RetrievedChunk]]]:
+        query_vector = await timer.run("embed", llm_adapter.aembed_query(question))
+        return query_vector, await timer.run("search", _asearch(query_vector, collection_name, sparse_future))
+
+    # Steps 3–4 (embed → search) and Step 7 (history) concurrently
+    history, (query_vector, retrieved) = await asyncio.gather(
+        timer.run("history", cache_adapter.aget_history(session_id)), retrieve()
+    )
+    turn = _AsyncTurn(
+        history=history,
+        query_vector=query_vector,
+        use_semantic_cache=settings.enable_semantic_cache and not history,
+    )
+
+    precheck_task: Optional["asyncio.Future[bool]"] = None
+    try:
+        precheck_task = await _aassemble_turn(turn, question, collection_name, retrieved, hybrid, timer)
+        if gate_task is not None:
+            with timer.stage("gate_wait"):
+                await gate_task
+        if precheck_task is not None and not await precheck_task:
+            logger.info("Relevance pre-check returned false — skipping LLM call")
+            turn.final, turn.prepared = _PRECHECK_REJECTED, None
+    finally:
+        if precheck_task is not None and not precheck_task.done():
+            precheck_task.cancel()
+    return turn
+
+
+async def _aassemble_turn(
+    turn: _AsyncTurn,
+    question: str,
+    collection_name: str,
+    retrieved: Union[RAGResult, List[vector_adapter.RetrievedChunk]],
+    hybrid: bool,
+    timer: StageTimer,
+) -> Optional["asyncio.Future[bool]"]:
+    """
+    Steps 5–9 short of the LLM call: fills turn.final, or turn.prepared + turn.messages.
+    Returns the started relevance pre-check task, if one applies.
+    """
+    # Semantic answer cache: first turns only. Checked after the search here — the search
+    # overlapped the history load, so a hit only wastes work that was already in flight.
+    if turn.use_semantic_cache:
+        with timer.stage("semantic_cache"):
+            cached = await asyncio.to_thread(cache_adapter.semantic_lookup, collection_name, turn.query_vector)
+        if cached:
+            turn.final = RAGResult(answer=cached["answer"], sources=cached["sources"], has_context=True)
+            turn.cache_hit = True
+            return None
+
+    if isinstance(retrieved, RAGResult):
+        turn.final = retrieved
+        return None
+    with timer.stage("prepare"):
+        if reranker.enabled():
+            # The cross-encoder is CPU-bound — keep it off the event loop
+            prepared = await asyncio.to_thread(prepare_context, retrieved, not hybrid, question, turn.query_vector)
+        else:
+            prepared = prepare_context(retrieved, threshold=not hybrid)
+    if isinstance(prepared, RAGResult):
+        turn.final = prepared
+        return None
+
+    # Step 8 (optional) runs while the prompt is assembled and moderation finishes
+    precheck_task = None
+    if get_settings().enable_relevance_precheck:
+        precheck_task = asyncio.ensure_future(
+            timer.run("precheck", arelevance_precheck(question, prepared.context))
+        )
+    with timer.stage("prompt"):
+        turn.messages = build_messages(question, prepared.context, turn.history)
+    turn.prepared = prepared
+    return precheck_task
+
+
+async def _afinish_turn(turn: _AsyncTurn, question: str, session_id: str, collection_name: str, answer: str) -> None:
+    """Step 10: save history (and the semantic cache entry) for an answered turn."""
+    await cache_adapter.asave_history(session_id, question, answer)
+    if turn.use_semantic_cache and not turn.cache_hit:
+        await asyncio.to_thread(
+            cache_adapter.semantic_store, collection_name, turn.query_vector, answer, turn.prepared.sources
+        )
+
+
+async def _arun_rag_pipeline(
+    question: str,
+    session_id: str,
+    collection_name: str,
+    gate_task: Optional["asyncio.Future[Any]"],
+    timer: StageTimer,
+) -> RAGResult:
+    turn = await _aprepare_turn(question, session_id, collection_name, gate_task, timer)
+    if turn.final is not None:
+        if turn.cache_hit:
+            await timer.run("save", _afinish_turn(turn, question, session_id, collection_name, turn.final.answer))
+        return turn.final
+
+    # Step 9: Main LLM call
+    answer = await timer.run("llm", llm_adapter.achat_completion(turn.messages))
+    await timer.run("save", _afinish_turn(turn, question, session_id, collection_name, answer))
+    return RAGResult(answer=answer, sources=turn.prepared.sources, has_context=True)
+
+
+async def astream_rag_pipeline(
+    question: str,
+    session_id: str,
+    collection_name: str = "default",
+    gate: Optional[Awaitable[Any]] = None,
+    timer: Optional[StageTimer] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming arun_rag_pipeline. Yields (event, data) pairs:
+      ("sources", {"sources", "has_context"}) right after retrieval,
+      ("token", {"delta"}) for each piece of the answer as the LLM generates it,
+      ("done", {"answer", "has_context"}) at the end.
+    History is saved only once the stream completes; gate is awaited before the first event,
+    so timer holds every stage up to the LLM call by then.
+    """
+    timer = timer or StageTimer()
+    gate_task = asyncio.ensure_future(timer.run("moderation", gate)) if gate is not None else None
+    try:
+        turn = await _aprepare_turn(question, session_id, collection_name, gate_task, timer)
+    finally:
+        if gate_task is not None and not gate_task.done():
+            gate_task.cancel()
+
+    if turn.final is not None:
+        result = turn.final
+        yield "sources", {"sources": result.sources, "has_context": result.has_context}
+        yield "token", {"delta": result.answer}
+        if turn.cache_hit:
+            await _afinish_turn(turn, question, session_id, collection_name, result.answer)
+        yield "done", {"answer": result.answer, "has_context": result.has_context}
+        return
+
+    yield "sources", {"sources": turn.prepared.sources, "has_context": True}
+
+    # Step 9: Main LLM call, streamed
+    parts: List[str] = []
+    with timer.stage("llm"):
+        async for delta in llm_adapter.astream_chat_completion(turn.messages):
+            parts.append(delta)
+            yield "token", {"delta": delta}
+
+    answer = "".join(parts)
+    await timer.run("save", _afinish_turn(turn, question, session_id, collection_name, answer))
+    yield "done", {"answer": answer, "has_context": True}
+
+
+# ── Batch pipeline (offline evaluation / bulk FAQ answering) ──────────────────
+
+def run_rag_pipeline_batch(
+    questions: List[str],
+    collection_name: str = "default",
+    generate: bool = True,
+) -> List[Optional[RAGResult]]:
+    """
+    Stateless RAG over many questions: one batched embedding pass, one FAISS search over the
+    whole query matrix (Supabase: one RPC per question), then LLM calls spread over
+    BATCH_QUERY_CONCURRENCY threads. No chat history is read or written.
+    A None entry means that question's embedding, search or LLM call failed.
+    """
+    settings = get_settings()
+    if not questions:
+        return []
+    hybrid = settings.enable_hybrid_search and settings.vector_backend != "supabase"
+    sparse_futures = [_submit_sparse(q, collection_name) for q in questions] if hybrid else []
+
+    with ThreadPoolExecutor(max_workers=settings.batch_query_concurrency) as pool:
+        query_vectors = _embed_batch_questions(questions, pool)
+        ok = [i for i, vec in enumerate(query_vectors) if vec is not None]
+        raw_chunks: List[Optional[List[vector_adapter.RetrievedChunk]]] = [None] * len(questions)
+
+        if settings.vector_backend == "supabase":
+            # The match RPC takes one vector per call
+            from chatbot.adapters import supabase_adapter
+
+            def search(i: int) -> Optional[List[vector_adapter.RetrievedChunk]]:
+                try:
+                    return supabase_adapter.search(
+                        collection=collection_name,
+                        query_vec=query_vectors[i],
+                        k=reranker.candidate_k(),
+                        with_embeddings=settings.enable_mmr,
+                    )
+                except Exception as exc:
+                    logger.warning("Batch question %d search failed: %s", i, exc)
+                    return None
+
+            for i, chunks in zip(ok, pool.map(search, ok)):
+                raw_chunks[i] = chunks
+        elif ok:
+            if not vector_adapter.load_index(settings.data_indexed_dir, collection_name):
+                raise ValueError(f"The index for collection '{collection_name}' has not been built yet.")
+            dense_results = vector_adapter.search_batch(
+                [query_vectors[i] for i in ok],
+                k=settings.hybrid_candidates if hybrid else reranker.candidate_k(),
+                collection=collection_name,
+                with_embeddings=settings.enable_mmr,
+            )
+            for i, dense in zip(ok, dense_results):
+                raw_chunks[i] = fuse_hybrid(dense, sparse_futures[i].result(), collection_name) if hybrid else dense
+
+        def answer(i: int) -> Optional[RAGResult]:
+            if raw_chunks[i] is None:
+                return None
+            try:
+                return answer_from_chunks(
+                    questions[i],
+                    raw_chunks[i],
+                    history=[],
+                    generate=generate,
+                    threshold=not hybrid,
+                    query_vector=query_vectors[i],
+                )
+            except Exception as exc:
+                logger.warning("Batch question %d failed: %s", i, exc)
+                return None
+
+        if not generate:
+            return [answer(i) for i in range(len(questions))]
+        return list(pool.map(answer, range(len(questions))))
+
+
+def _embed_batch_questions(questions: List[str], pool: ThreadPoolExecutor) -> List[Optional[List[float]]]:
+    """One batched embedding call; if it fails, embed each question on its own so one bad input costs only its result."""
+    try:
+        return llm_adapter.embed_queries(questions)
+    except Exception as exc:
+        logger.warning("Batch embedding of %d questions failed (%s) — embedding one by one", len(questions), exc)
+
+    def embed_one(i: int) -> Optional[List[float]]:
+        try:
+            return llm_adapter.embed_query(questions[i])
+        except Exception as exc:
+            logger.warning("Batch question %d embedding failed: %s", i, exc)
+            return None
+
+    return list(pool.map(embed_one, range(len(questions))))
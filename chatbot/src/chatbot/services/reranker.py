@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+"""
+Post-retrieval reranking (Step 5b): choose VECTOR_SEARCH_K of the RERANK_CANDIDATES retrieved chunks.
+
+  - MMR (maximal marginal relevance) over the stored embeddings. With CHUNK_OVERLAP=400,
+    neighbouring chunks are near-duplicates; MMR trades relevance to the question against
+    similarity to the chunks already picked, so the context budget holds distinct passages.
+    Pure NumPy on a (candidates × candidates) similarity matrix — no model call.
+  - Optionally, a local CPU cross-encoder (sentence-transformers, imported on first use) that
+    scores the candidates (MMR's widened pool when MMR is on) by question/passage relevance and
+    keeps the best. It scores in small batches and stops once RERANK_BUDGET_MS is spent; the
+    unscored rest keeps its MMR / retrieval order behind the scored chunks.
+"""
+
+import logging
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from chatbot import metrics
+from chatbot.adapters.vector_adapter import RetrievedChunk
+from chatbot.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Pairs scored per cross-encoder call; the budget is checked between calls
+_CROSS_ENCODER_BATCH = 4
+
+_rerank_latency = metrics.histogram("chatbot_rerank_seconds", "Post-retrieval reranking time", label="stage")
+
+# Module-level cross-encoder, loaded once (None until first use; False if it cannot be loaded)
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    settings = get_settings()
+    return settings.enable_mmr or bool(settings.cross_encoder_model)
+
+
+def candidate_k() -> int:
+    """How many chunks retrieval should return: more than VECTOR_SEARCH_K when reranking picks from them."""
+    settings = get_settings()
+    return max(settings.rerank_candidates, settings.vector_search_k) if enabled() else settings.vector_search_k
+
+
+def mmr(query_vector: Sequence[float], embeddings: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    Indices of k rows of embeddings in MMR order:
+    argmax  λ·sim(q, d) − (1 − λ)·max sim(d, picked)
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    k = min(k, len(vectors))
+    if k <= 0:
+        return []
+
+    picked = [int(np.argmax(relevance))]
+    redundancy = similarity[picked[0]].copy()  # max similarity to anything picked so far
+    available = np.ones(len(vectors), dtype=bool)
+    available[picked[0]] = False
+    for _ in range(k - 1):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
+
+
+def _get_cross_encoder():
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            model = get_settings().cross_encoder_model
+            try:
+                from sentence_transformers import CrossEncoder  # optional dependency
+                _cross_encoder = CrossEncoder(model, device="cpu")
+                logger.info("Cross-encoder '%s' loaded", model)
+            except Exception as exc:
+                logger.warning("Cross-encoder '%s' unavailable (%s) — reranking with MMR only", model, exc)
+                _cross_encoder = False
+        return _cross_encoder or None
+
+
+def warm_up() -> None:
+    """Load the cross-encoder now (called from the app lifespan) so the first query stays in budget."""
+    if get_settings().cross_encoder_model:
+        _get_cross_encoder()
+
+
+def cross_encoder_scores(question: str, chunks: List[RetrievedChunk], budget_ms: float) -> List[float]:
+    """
+    Cross-encoder scores for chunks, in order, until RERANK_BUDGET_MS is spent: may cover only
+    a prefix of chunks (empty if the model is missing).
+    """
+    model = _get_cross_encoder()
+    if model is None:
+        return []
+    deadline = time.perf_counter() + budget_ms / 1000
+    scores: List[float] = []
+    for start in range(0, len(chunks), _CROSS_ENCODER_BATCH):
+        if time.perf_counter() > deadline:
+            logger.info("Cross-encoder budget of %d ms spent after %d/%d chunks — keeping the rest in order",
+                        budget_ms, len(scores), len(chunks))
+            break
+        pairs = [(question, c.text) for c in chunks[start : start + _CROSS_ENCODER_BATCH]]
+        scores.extend(float(s) for s in model.predict(pairs))
+    return scores
+
+
+def rerank(question: str, query_vector: Sequence[float], chunks: List[RetrievedChunk]) -> List[RetrievedChunk]:
+    """
+    Pick VECTOR_SEARCH_K of chunks. The pool is every candidate in score order, or with ENABLE_MMR
+    (when every chunk carries its embedding) the 2·VECTOR_SEARCH_K most relevant-yet-distinct
+    ones in MMR order. With CROSS_ENCODER_MODEL the pool is scored by the cross-encoder, best
+    first, and chunks it had no budget for follow in pool order. Chunks keep their retrieval scores.
+    """
+    settings = get_settings()
+    k = settings.vector_search_k
+    pool = chunks
+
+    if settings.enable_mmr and len(chunks) > 1:
+        if all(c.embedding is not None for c in chunks):
+            size = 2 * k if settings.cross_encoder_model else k
+            with _rerank_latency.time("mmr"):
+                order = mmr(query_vector, np.stack([c.embedding for c in chunks]), size, settings.mmr_lambda)
+            pool = [chunks[i] for i in order]
+        else:
+            logger.debug("Some retrieved chunks have no stored embedding — skipping MMR")
+
+    if settings.cross_encoder_model and len(pool) > 1:
+        with _rerank_latency.time("cross_encoder"):
+            scores = cross_encoder_scores(question, pool, settings.rerank_budget_ms)
+        scored = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        pool = [pool[i] for i in scored] + pool[len(scores):]
+
+    return pool[:k]
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+"""
+Background ingestion of uploaded files.
+
+/api/v1/upload streams the request body through spool_multipart() — the file part goes straight
+from the socket into a private temp directory, never buffered whole or copied twice — then calls
+submit() and returns 202 straight away;
+ingest_file() then runs on a small module-level thread pool (UPLOAD_WORKERS), so extraction,
+embedding and the Supabase insert never block the event loop. Clients poll get() through
+GET /api/v1/upload/{job_id}.
+
+Job state lives in this process only — with several API workers, poll the worker that
+accepted the upload (or run a single worker for uploads).
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Collection, Dict, List, Optional, Tuple
+
+from chatbot.config import get_settings
+from chatbot.services.ingestion_service import UploadResult, ingest_file
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for polling; the oldest finished ones are forgotten first
+MAX_JOBS = 1000
+
+# Upper bound for a non-file form field (e.g. collection)
+_MAX_FIELD_BYTES = 64 * 1024
+
+
+@dataclass
+class UploadJob:
+    job_id: str
+    collection: str
+    source: str
+    status: str = "queued"  # queued | running | succeeded | failed
+    stage: str = "queued"  # extracting | embedding | storing (per batch) | done
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+    result: Optional[UploadResult] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+
+# Module-level job table and worker pool
+_jobs: "OrderedDict[str, UploadJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+
+# Jobs not yet picked up by a worker → their spooled file (cleaned up if shutdown cancels them)
+_queued: Dict[str, Tuple[UploadJob, str]] = {}
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _jobs_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=get_settings().upload_workers, thread_name_prefix="upload")
+        return _pool
+
+
+def spool_path(filename: str) -> str:
+    """Path in a fresh private temp directory, keeping the original filename (extractors record it as the chunk source)."""
+    directory = tempfile.mkdtemp(prefix="chatbot-upload-")
+    return os.path.join(directory, os.path.basename(filename))
+
+
+def discard(file_path: str) -> None:
+    """Remove a spooled file and its temp directory."""
+    shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+
+@dataclass
+class UploadForm:
+    filename: Optional[str] = None  # of the file part, even when its type was refused
+    path: Optional[str] = None  # spooled file; None if there was no file part or its type was refused
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+class _MultipartSpool:
+    """python-multipart callbacks: file bytes are queued for flush(), other fields kept as text."""
+
+    def __init__(self, file_field: str, extensions: Optional[Collection[str]]) -> None:
+        self.form = UploadForm()
+        self._file_field = file_field
+        self._extensions = extensions
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._disposition = b""
+        self._kind = "skip"  # current part: file | field | skip
+        self._name = ""
+        self._value = bytearray()
+        self._pending: List[bytes] = []
+        self._accepted = False  # the file part is being (or was) spooled
+        self._out = None
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self) -> None:
+        self._disposition, self._kind, self._value = b"", "skip", bytearray()
+
+    def _header_end(self) -> None:
+        if bytes(self._header_field).lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _headers_finished(self) -> None:
+        from multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self._disposition)
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if filename is None:
+            self._kind = "field"
+        elif self._name == self._file_field and self.form.filename is None and filename:
+            self.form.filename = os.path.basename(filename.decode("utf-8", "replace"))
+            ext = os.path.splitext(self.form.filename)[1].lower()
+            # A refused type is never written to disk
+            if self._extensions is None or ext in self._extensions:
+                self._kind, self._accepted = "file", True
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._kind == "file":
+            self._pending.append(data[start:end])
+        elif self._kind == "field":
+            self._value.extend(data[start:end])
+            if len(self._value) > _MAX_FIELD_BYTES:
+                raise ValueError(f"Form field '{self._name}' is too large.")
+
+    def _part_end(self) -> None:
+        if self._kind == "field":
+            self.form.fields[self._name] = self._value.decode("utf-8", "replace")
+
+    @property
+    def needs_flush(self) -> bool:
+        # An accepted but empty file is still created, so ingestion reports it
+        return bool(self._pending) or (self._accepted and self._out is None)
+
+    def flush(self) -> None:
+        """Write queued file bytes (blocking — called on a worker thread)."""
+        if self._out is None:
+            self.form.path = spool_path(self.form.filename)
+            self._out = open(self.form.path, "wb")
+        self._out.write(b"".join(self._pending))
+        self._pending.clear()
+
+    def close(self) -> None:
+        if self._out is not None:
+            self._out.close()
+
+
+async def spool_multipart(
+    content_type: str,
+    body: AsyncIterator[bytes],
+    file_field: str = "file",
+    extensions: Optional[Collection[str]] = None,
+) -> UploadForm:
+    """
+    Parse a multipart/form-data body as it arrives. The file_field part is written block by block
+    to spool_path(its filename) on a worker thread, unless its extension is not in extensions;
+    other fields are returned as text. Raises ValueError on a malformed body.
+    """
+    from multipart.multipart import MultipartParser, parse_options_header
+
+    media_type, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if media_type != b"multipart/form-data" or not boundary:
+        raise ValueError("Expected a multipart/form-data upload.")
+
+    spool = _MultipartSpool(file_field, extensions)
+    parser = MultipartParser(boundary, spool.callbacks())
+    try:
+        async for chunk in body:
+            parser.write(chunk)
+            if spool.needs_flush:
+                await asyncio.to_thread(spool.flush)
+        parser.finalize()
+        if spool.needs_flush:
+            await asyncio.to_thread(spool.flush)
+    except BaseException:
+        spool.close()
+        if spool.form.path is not None:
+            discard(spool.form.path)
+        raise
+    spool.close()
+    return spool.form
+
+
+def submit(file_path: str, collection: str) -> UploadJob:
+    """Queue ingestion of a spooled upload; the file (and its temp directory) is removed when the job ends."""
+    job = UploadJob(
+        job_id=uuid.uuid4().hex,
+        collection=collection,
+        source=os.path.basename(file_path),
+        created_at=time.time(),
+    )
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        _queued[job.job_id] = (job, file_path)
+        _prune()
+    _get_pool().submit(_run, job, file_path)
+    logger.info("Upload job %s queued: '%s' → collection '%s'", job.job_id, job.source, collection)
+    return job
+
+
+def get(job_id: str) -> Optional[UploadJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _prune() -> None:
+    """Drop the oldest finished jobs beyond MAX_JOBS (caller holds _jobs_lock)."""
+    excess = len(_jobs) - MAX_JOBS
+    for job_id in [j.job_id for j in _jobs.values() if j.finished][:max(excess, 0)]:
+        del _jobs[job_id]
+
+
+def _set_stage(job: UploadJob, stage: str) -> None:
+    job.stage = stage
+
+
+def _run(job: UploadJob, file_path: str) -> None:
+    with _jobs_lock:
+        if _queued.pop(job.job_id, None) is None:
+            return  # cancelled by shutdown() just before this worker picked it up
+    job.status = "running"
+    try:
+        job.result = ingest_file(file_path, job.collection, progress=lambda stage: _set_stage(job, stage))
+        job.status, job.stage = "succeeded", "done"
+    except ValueError as exc:
+        job.status, job.error = "failed", str(exc)
+    except Exception as exc:
+        logger.exception("Upload job %s failed: %s", job.job_id, exc)
+        job.status, job.error = "failed", "Ingestion failed — see server logs."
+    finally:
+        job.finished_at = time.time()
+        discard(file_path)
+
+
+def shutdown() -> None:
+    """
+    Stop accepting work (called from the app lifespan): running jobs finish, queued ones are
+    cancelled — marked failed and their spooled files removed.
+    """
+    global _pool
+    with _jobs_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    pool.shutdown(wait=False, cancel_futures=True)
+    with _jobs_lock:
+        cancelled = list(_queued.values())
+        _queued.clear()
+    for job, file_path in cancelled:
+        job.status, job.error = "failed", "Server shut down before the upload was processed — please retry."
+        job.finished_at = time.time()
+        discard(file_path)
+    if cancelled:
+        logger.info("Cancelled %d queued upload jobs", len(cancelled))
@@ -6,6 +6,9 @@ from unittest.mock import MagicMock, patch
 import pytest
 from fastapi.testclient import TestClient
 
+# Keep the persistent embedding cache out of the working tree unless a test opts in
+os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
+
 
 @pytest.fixture
 def test_client():
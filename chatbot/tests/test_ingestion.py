@@ -56,6 +56,38 @@ class TestLoadAndChunk:
         finally:
             os.unlink(path)
 
+    def test_token_counts_come_from_the_splitter(self):
+        from chatbot.services import ingestion_service
+
+        class WordEncoding:
+            """One token per word — stands in for cl100k_base offline."""
+            def encode(self, text, disallowed_special=()):
+                return text.split()
+
+            def decode(self, ids):
+                return " ".join(ids)
+
+        text = " ".join(f"w{i}" for i in range(10))
+        with tempfile.NamedTemporaryFile(suffix=".txt", mode="w", delete=False) as f:
+            f.write(text)
+            path = f.name
+
+        try:
+            with patch.object(ingestion_service.tiktoken, "get_encoding", return_value=WordEncoding()), \
+                 patch.dict(ingestion_service._splitters, clear=True), \
+                 patch.object(ingestion_service.llm_adapter, "count_tokens", side_effect=AssertionError("re-tokenized")):
+                splitter = ingestion_service._get_splitter(4, 1)
+                assert splitter.split(text) == [
+                    ("w0 w1 w2 w3", 4), ("w3 w4 w5 w6", 4), ("w6 w7 w8 w9", 4),
+                ]
+                chunks = ingestion_service.load_and_chunk_file(path, 6, 2)
+        finally:
+            os.unlink(path)
+
+        assert [(c["text"], c["token_count"]) for c in chunks] == [
+            ("w0 w1 w2 w3 w4 w5", 6), ("w4 w5 w6 w7 w8 w9", 6),
+        ]
+
     def test_skips_unreadable_file(self):
         from chatbot.services.ingestion_service import load_and_chunk_documents
         # Non-existent file should be skipped without crashing
@@ -63,6 +95,244 @@ class TestLoadAndChunk:
         assert result == []
 
 
+class TestExtractors:
+    def test_pdf_vision_rasterizes_only_sparse_pages_concurrently(self, monkeypatch):
+        import threading
+        import time
+
+        from PIL import Image
+
+        from chatbot.adapters import llm_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import extractors
+
+        monkeypatch.setenv("VISION_DPI", "100")
+        get_settings.cache_clear()
+
+        rendered, in_flight, peak = [], [0], [0]
+        lock = threading.Lock()
+
+        def convert_from_path(path, dpi, first_page, last_page):
+            rendered.append((dpi, first_page, last_page))
+            return [Image.new("RGB", (4, 4))]
+
+        def vision_extract(image_bytes):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+            return "Scanned table | 42"
+
+        texts = ["Typed page with plenty of extractable text on it. " * 2] * 20
+        texts[3] = texts[17] = ""
+        with patch.object(extractors, "_extract_pdf_text", return_value=texts), \
+             patch("pdf2image.convert_from_path", side_effect=convert_from_path), \
+             patch.object(llm_adapter, "vision_extract", side_effect=vision_extract):
+            chunks = extractors.extract_pdf("scan.pdf")
+        get_settings.cache_clear()
+
+        assert sorted(rendered) == [(100, 4, 4), (100, 18, 18)]
+        assert peak[0] == 2
+        assert [c["page_num"] for c in chunks] == list(range(20))
+        assert chunks[3]["text"] == "Scanned table | 42"
+
+    def test_vision_extract_downscales_and_caches_by_file_hash(self, monkeypatch, tmp_path):
+        from io import BytesIO
+
+        import numpy as np
+        from PIL import Image
+
+        from chatbot.adapters import llm_adapter, vision_cache
+        from chatbot.config import get_settings
+
+        monkeypatch.setenv("VISION_MAX_SIDE", "500")
+        monkeypatch.setenv("VISION_CACHE_PATH", str(tmp_path / "vision.sqlite"))
+        get_settings.cache_clear()
+
+        def encode(img, fmt):
+            buf = BytesIO()
+            img.save(buf, format=fmt)
+            return buf.getvalue()
+
+        blocks = np.random.default_rng(0).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+        page = Image.fromarray(blocks).resize((1600, 1200), Image.Resampling.NEAREST)
+        sent = []
+
+        def request(image):
+            sent.append(image)
+            return f"text {len(sent)}"
+
+        with patch.object(llm_adapter, "_vision_request", side_effect=request):
+            assert llm_adapter.vision_extract(encode(page, "TIFF")) == "text 1"
+            assert llm_adapter.vision_extract(encode(page, "TIFF")) == "text 1"
+            # A re-upload after a restart: served from the SQLite file
+            vision_cache.close()
+            assert llm_adapter.vision_extract(encode(page, "TIFF")) == "text 1"
+            assert llm_adapter.vision_extract(encode(page.transpose(Image.Transpose.FLIP_LEFT_RIGHT), "JPEG")) == "text 2"
+        vision_cache.close()
+        get_settings.cache_clear()
+
+        assert [(image.mime, Image.open(BytesIO(image.data)).size) for image in sent] == [
+            ("image/png", (500, 375)),  # TIFF is not accepted by the API: downscaled and sent as PNG
+            ("image/jpeg", (500, 375)),
+        ]
+        assert vision_cache.sniff_mime(sent[1].data) == "image/jpeg"
+
+    def test_perceptual_dedup_needs_identical_pixels(self, monkeypatch):
+        from io import BytesIO
+
+        import numpy as np
+        from PIL import Image, ImageDraw
+
+        from chatbot.adapters import llm_adapter, vision_cache
+        from chatbot.config import get_settings
+
+        monkeypatch.setenv("VISION_DEDUP", "perceptual")
+        monkeypatch.setenv("VISION_CACHE_PATH", "")
+        get_settings.cache_clear()
+
+        def encode(img, fmt):
+            buf = BytesIO()
+            img.save(buf, format=fmt)
+            return buf.getvalue()
+
+        def invoice(total):
+            img = Image.new("RGB", (800, 1000), "white")
+            draw = ImageDraw.Draw(img)
+            for row in range(12):
+                draw.rectangle((60, 80 + 60 * row, 740, 100 + 60 * row), fill="black")
+            draw.text((600, 900), total, fill="black")
+            return img
+
+        first, second = invoice("1,234.00"), invoice("9,876.55")
+        assert vision_cache._perceptual_hash(first) == vision_cache._perceptual_hash(second)
+        assert not np.array_equal(np.asarray(first), np.asarray(second))
+
+        with patch.object(llm_adapter, "_vision_request", side_effect=["total 1,234.00", "total 9,876.55"]) as api:
+            assert llm_adapter.vision_extract(encode(first, "PNG")) == "total 1,234.00"
+            assert llm_adapter.vision_extract(encode(second, "PNG")) == "total 9,876.55"
+            # Same pixels in another container: the dHash candidate is confirmed and reused
+            assert llm_adapter.vision_extract(encode(first, "TIFF")) == "total 1,234.00"
+        vision_cache.close()
+        get_settings.cache_clear()
+        assert api.call_count == 2
+
+    def test_xlsx_streams_header_prefixed_row_windows_into_batched_upload(self, monkeypatch):
+        import openpyxl
+
+        from chatbot.adapters import supabase_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import extractors, ingestion_service
+
+        monkeypatch.setenv("CHUNK_SIZE", "60")
+        monkeypatch.setenv("CHUNK_OVERLAP", "10")
+        monkeypatch.setenv("INGEST_BATCH_SIZE", "10")
+        get_settings.cache_clear()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "sales.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.title = "Sales"
+            ws.append(["Region", "Product", "Units"])
+            for i in range(300):
+                ws.append(["North" if i % 2 else "South", f"SKU-{i:04d}", i])
+            wb.save(path)
+
+            windows = list(extractors.extract_excel(path))
+            inserted = []
+            with patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=lambda t, **_: [[0.0]] * len(t)), \
+                 patch.object(supabase_adapter, "insert_chunks", side_effect=lambda c, chunks, e: inserted.append(list(chunks)) or [0] * len(chunks)), \
+                 patch.object(ingestion_service.cache_adapter, "invalidate_semantic_cache"):
+                result = ingestion_service.ingest_file(path, "sales")
+        get_settings.cache_clear()
+
+        assert len(windows) > 1
+        assert all(w["text"].startswith("[Sheet: Sales] rows ") for w in windows)
+        assert all(w["text"].split("\n")[1] == "Region | Product | Units" for w in windows)
+        assert all(w["token_count"] <= 60 for w in windows)
+        rows = [line for w in windows for line in w["text"].split("\n")[2:]]
+        assert rows[0] == "South | SKU-0000 | 0" and rows[-1] == "North | SKU-0299 | 299" and len(rows) == 300
+
+        # Windows go to Supabase unsplit, in INGEST_BATCH_SIZE batches
+        assert result.chunks_indexed == len(windows)
+        assert [len(b) for b in inserted][:-1] == [10] * (len(inserted) - 1)
+        assert [c["text"] for b in inserted for c in b] == [w["text"] for w in windows]
+
+    def test_xlsx_drops_trailing_empty_cells_but_keeps_cell_values(self):
+        import openpyxl
+
+        from chatbot.services import extractors
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "pipes.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["Name", "Pattern", None])
+            ws.append(["or", "a|", None, None])
+            ws.append(["blank", None, "", None])
+            wb.save(path)
+            (window,) = extractors.extract_excel(path)
+
+        assert window["text"].split("\n")[1:] == ["Name | Pattern", "or | a|", "blank"]
+
+    def test_failed_upload_deletes_the_batches_it_already_stored(self, monkeypatch):
+        import itertools
+
+        from chatbot.adapters import supabase_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import extractors, ingestion_service
+
+        monkeypatch.setenv("INGEST_BATCH_SIZE", "2")
+        get_settings.cache_clear()
+
+        def route(path):
+            for i in range(3):
+                yield {"text": f"page {i}", "source": "doc.pdf", "page_num": i, "chunk_index": 0, "token_count": 2}
+            raise RuntimeError("vision API down")
+
+        ids = itertools.count(100)
+        with patch.object(extractors, "route", side_effect=route), \
+             patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=lambda t, **_: [[0.0]] * len(t)), \
+             patch.object(supabase_adapter, "insert_chunks", side_effect=lambda c, chunks, e: [next(ids) for _ in chunks]), \
+             patch.object(supabase_adapter, "delete_chunks") as delete, \
+             patch.object(ingestion_service.cache_adapter, "invalidate_semantic_cache") as invalidate:
+            with pytest.raises(RuntimeError):
+                ingestion_service.ingest_file("doc.pdf", "docs")
+        get_settings.cache_clear()
+
+        delete.assert_called_once_with([100, 101])
+        invalidate.assert_called_once_with("docs")
+
+    def test_pdf_text_layer_split_across_processes(self):
+        from pypdf import PdfWriter
+
+        from chatbot.services import extractors
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "blank.pdf")
+            writer = PdfWriter()
+            for _ in range(40):
+                writer.add_blank_page(width=72, height=72)
+            with open(path, "wb") as f:
+                writer.write(f)
+            assert extractors._extract_pdf_text(path, workers=2) == [""] * 40
+            pool = extractors._page_pool
+            assert extractors._extract_pdf_text(path, workers=2) == [""] * 40
+            assert extractors._page_pool is pool  # one pool shared by every upload
+            assert pool._mp_context.get_start_method() == "spawn"  # never fork the threaded API process
+
+            # Inside a pool worker (e.g. ingest()'s), pages are read in-process
+            with patch("multiprocessing.parent_process", return_value=object()), \
+                 patch.object(extractors, "_get_page_pool", side_effect=AssertionError("nested pool")):
+                assert extractors._extract_pdf_text(path, workers=2) == [""] * 40
+
+            extractors.shutdown()
+            assert extractors._page_pool is None and pool._shutdown_thread
+
+
 class TestVectorAdapter:
     def test_save_and_load_index(self):
         from chatbot.adapters import vector_adapter
@@ -79,7 +349,8 @@ class TestVectorAdapter:
 
             # Verify files were created
             assert os.path.exists(os.path.join(tmpdir, "test-col", "index.faiss"))
-            assert os.path.exists(os.path.join(tmpdir, "test-col", "index.pkl"))
+            assert os.path.exists(os.path.join(tmpdir, "test-col", "chunks_text.bin"))
+            assert os.path.exists(os.path.join(tmpdir, "test-col", "chunks_offsets.npy"))
 
             # Load and search
             assert vector_adapter.is_index_loaded("test-col")
@@ -87,6 +358,53 @@ class TestVectorAdapter:
             assert len(results) >= 1
             assert any(r.source == "a.pdf" for r in results)
 
+    def test_migrates_legacy_pickled_metadata(self):
+        import pickle
+
+        import faiss
+        import numpy as np
+        from chatbot.adapters import vector_adapter
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "legacy")
+            os.makedirs(path)
+            vectors = np.eye(3, 4, dtype=np.float32)
+            index = faiss.IndexFlatIP(4)
+            index.add(vectors)
+            faiss.write_index(index, os.path.join(path, "index.faiss"))
+            # id 1 was tombstoned in the old format (dropped from the dict)
+            with open(os.path.join(path, "index.pkl"), "wb") as f:
+                pickle.dump({
+                    0: {"text": "zero", "source": "a.pdf", "page_num": 0},
+                    2: {"text": "two ü", "source": "b.pdf", "page_num": 3},
+                }, f)
+
+            assert vector_adapter.load_index(tmpdir, collection="legacy")
+            _, store = vector_adapter._index_cache["legacy"]
+            assert len(store) == 3 and store.deleted_count == 1
+            assert store.get(1) is None
+            assert store.get(2) == {"text": "two ü", "source": "b.pdf", "page_num": 3, "chunk_index": 0, "token_count": 0}
+
+            results = vector_adapter.search(vectors[1].tolist(), k=2, collection="legacy")
+            assert {r.vector_id for r in results} == {0, 2}
+            vector_adapter._index_cache.pop("legacy", None)
+
+    def test_search_batch_matches_single_queries(self):
+        import numpy as np
+
+        from chatbot.adapters import vector_adapter
+
+        rng = np.random.default_rng(11)
+        embeddings = rng.standard_normal((50, 8)).tolist()
+        metadata = {i: {"text": f"c{i}", "source": f"{i}.txt", "page_num": 0} for i in range(50)}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vector_adapter.save_index(embeddings, metadata, tmpdir, collection="batch-col")
+            queries = rng.standard_normal((6, 8))
+            batch = vector_adapter.search_batch(queries, k=3, collection="batch-col")
+            singles = [vector_adapter.search(q.tolist(), k=3, collection="batch-col") for q in queries]
+            vector_adapter.unload_index("batch-col")
+        assert [[c.vector_id for c in r] for r in batch] == [[c.vector_id for c in r] for r in singles]
+
     def test_load_returns_false_for_missing_index(self):
         from chatbot.adapters import vector_adapter
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -96,3 +414,580 @@ class TestVectorAdapter:
     def test_is_index_loaded_false_before_load(self):
         from chatbot.adapters import vector_adapter
         assert not vector_adapter.is_index_loaded("definitely-not-loaded-xyz")
+
+    @pytest.mark.parametrize("index_type", ["hnsw", "ivfpq"])
+    def test_ann_index_type_recorded_and_reloaded(self, index_type, monkeypatch):
+        import json
+
+        import faiss
+        import numpy as np
+
+        from chatbot.adapters import vector_adapter
+        from chatbot.config import get_settings
+
+        monkeypatch.setenv("FAISS_INDEX_TYPE", index_type)
+        monkeypatch.setenv("INDEX_TRAIN_SIZE", "500")
+        get_settings.cache_clear()
+        rng = np.random.default_rng(7)
+        embeddings = rng.standard_normal((600, 16)).astype("float32").tolist()
+        metadata = {i: {"text": f"chunk {i}", "source": f"{i}.txt", "page_num": 0} for i in range(600)}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vector_adapter.save_index(embeddings, metadata, tmpdir, collection=f"ann-{index_type}")
+            with open(os.path.join(tmpdir, f"ann-{index_type}", "index.json")) as f:
+                assert json.load(f)["type"] == index_type
+
+            assert vector_adapter.reload_index(tmpdir, collection=f"ann-{index_type}")
+            # IVF's id → list map exists before any search, so reconstructing never mutates a shared index
+            ivf = faiss.try_extract_index_ivf(vector_adapter._index_cache[f"ann-{index_type}"][0])
+            assert ivf is None or ivf.direct_map.type != faiss.DirectMap.NoMap
+            results = vector_adapter.search(embeddings[42], k=3, collection=f"ann-{index_type}")
+            stored = vector_adapter.search(embeddings[42], k=3, collection=f"ann-{index_type}", with_embeddings=True)
+            residency = vector_adapter.residency_stats()[f"ann-{index_type}"]
+            vector_adapter.unload_index(f"ann-{index_type}")
+        assert results[0].source == "42.txt"
+        # Stored vectors come back normalized (PQ-decoded for IVF-PQ, so only approximately equal)
+        query = np.asarray(embeddings[42]) / np.linalg.norm(embeddings[42])
+        assert results[0].embedding is None and float(stored[0].embedding @ query) > 0.8
+        assert residency["mmap"] is (index_type == "ivfpq")
+        assert residency["vectors"] == 600
+        get_settings.cache_clear()
+
+    def test_memory_budget_evicts_least_recently_used(self, monkeypatch):
+        import numpy as np
+
+        from chatbot.adapters import vector_adapter
+        from chatbot.config import get_settings
+
+        # 2000 × 64-dim flat vectors ≈ 0.5 MB per index, so a 1 MB budget holds two
+        embeddings = np.random.default_rng(3).standard_normal((2000, 64)).tolist()
+        metadata = {i: {"text": f"c{i}", "source": "a.txt", "page_num": 0} for i in range(2000)}
+        names = ("lru-a", "lru-b", "lru-c")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in names:
+                vector_adapter.save_index(embeddings, metadata, tmpdir, collection=name)
+            for name in list(vector_adapter.residency_stats()):
+                vector_adapter.unload_index(name)
+
+            monkeypatch.setenv("INDEX_MEMORY_BUDGET_MB", "1")
+            get_settings.cache_clear()
+            assert vector_adapter.load_index(tmpdir, "lru-a")
+            assert vector_adapter.load_index(tmpdir, "lru-b")
+            vector_adapter.search(embeddings[0], k=1, collection="lru-a")  # a is now hotter than b
+            assert vector_adapter.load_index(tmpdir, "lru-c")
+            resident = list(vector_adapter.residency_stats())
+            for name in names:
+                vector_adapter.unload_index(name)
+        get_settings.cache_clear()
+        assert resident == ["lru-a", "lru-c"]
+
+
+    def test_chunk_store_keeps_token_counts_and_reads_older_stores(self):
+        from chatbot.adapters.chunk_store import ChunkStore, ChunkStoreWriter
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            writer = ChunkStoreWriter(tmpdir)
+            writer.add([{"text": "alpha beta", "source": "a.pdf", "token_count": 2}])
+            writer.commit()
+            assert ChunkStore(tmpdir).get(0)["token_count"] == 2
+
+            # Stores written before the column existed report 0 (= count on demand)
+            os.remove(os.path.join(tmpdir, "chunks_tokens.npy"))
+            assert ChunkStore(tmpdir).get(0)["token_count"] == 0
+            writer = ChunkStoreWriter(tmpdir, append=True)
+            writer.add([{"text": "gamma", "source": "b.pdf", "token_count": 1}])
+            writer.commit()
+            store = ChunkStore(tmpdir)
+            assert [store.get(i)["token_count"] for i in range(2)] == [0, 1]
+
+
+class TestSparseIndex:
+    def test_tokenize_keeps_identifiers_whole_and_split(self):
+        from chatbot.adapters import sparse_index
+        assert sparse_index.tokenize("What is the price of AB-1234?") == ["price", "ab-1234", "ab", "1234"]
+
+    def test_bm25_finds_exact_keyword_and_skips_tombstones(self):
+        from chatbot.adapters import sparse_index
+        from chatbot.adapters.chunk_store import ChunkStoreWriter
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            writer = ChunkStoreWriter(tmpdir)
+            writer.add([
+                {"text": "General warranty terms for all pumps.", "source": "a.pdf"},
+                {"text": "Replacement seal kit XR-220 fits the pump housing.", "source": "b.pdf"},
+                {"text": "Pump housing XR-220 (discontinued).", "source": "c.pdf"},
+                {"text": "Pumps pumps pumps.", "source": "d.pdf"},
+            ])
+            writer.remove([2])
+            writer.commit()
+            assert sparse_index.build(tmpdir) == 3
+
+            hits = sparse_index.search(os.path.dirname(tmpdir), os.path.basename(tmpdir), "seal for xr-220", k=5)
+            assert hits[0][0] == 1
+            assert all(vid != 2 for vid, _ in hits)
+            assert sparse_index.search(os.path.dirname(tmpdir), os.path.basename(tmpdir), "zzz-unknown", k=5) == []
+
+
+    def test_update_merges_only_new_rows_and_matches_a_full_build(self):
+        import shutil
+
+        from chatbot.adapters import sparse_index
+        from chatbot.adapters.chunk_store import ChunkStoreWriter
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "col")
+            writer = ChunkStoreWriter(path)
+            writer.add([
+                {"text": "General warranty terms for all pumps.", "source": "a.pdf"},
+                {"text": "Replacement seal kit XR-220 fits the pump housing.", "source": "b.pdf"},
+            ])
+            writer.commit()
+            sparse_index.build(path)
+
+            writer = ChunkStoreWriter(path, append=True)
+            writer.add([{"text": "Seal kit XR-330 replaces the XR-220 seal.", "source": "b.pdf"}])
+            writer.remove([1])
+            writer.commit()
+            tokenized = []
+            real_tokenize = sparse_index.tokenize
+            with patch.object(sparse_index, "tokenize", side_effect=lambda t: tokenized.append(t) or real_tokenize(t)):
+                assert sparse_index.update(path) == 2
+            assert tokenized == ["Seal kit XR-330 replaces the XR-220 seal."]  # old rows are not re-read
+
+            shutil.copytree(path, os.path.join(root, "fresh"))
+            sparse_index.build(os.path.join(root, "fresh"))
+            for query in ["xr-220 seal", "pumps warranty", "housing"]:
+                assert sparse_index.search(root, "col", query, k=5) == sparse_index.search(root, "fresh", query, k=5)
+            assert all(vid != 1 for vid, _ in sparse_index.search(root, "col", "housing xr-220", k=5))
+
+            meta = os.path.join(path, sparse_index.META_FILE)
+            mtime = os.stat(meta).st_mtime_ns
+            assert sparse_index.update(path) == 2  # nothing changed: nothing rewritten
+            assert os.stat(meta).st_mtime_ns == mtime
+
+
+def _fake_chunk(path, chunk_size, chunk_overlap, timings=None):
+    """One chunk per file — keeps incremental tests independent of tiktoken."""
+    with open(path, encoding="utf-8") as f:
+        return [{"text": f.read(), "source": os.path.basename(path), "page_num": 0, "chunk_index": 0}]
+
+
+def _fake_embed(texts, **_):
+    return [[float(len(t)), 1.0, 0.5, 0.25] for t in texts]
+
+
+@pytest.fixture
+def in_process_ingest(monkeypatch):
+    """Run the load/chunk stage in-process so patched loaders apply."""
+    from chatbot.config import get_settings
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    get_settings.cache_clear()
+    yield
+    get_settings.cache_clear()
+
+
+@pytest.mark.usefixtures("in_process_ingest")
+class TestIncrementalIngest:
+    def _write(self, path, text):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_rerun_only_embeds_changed_files(self, monkeypatch):
+        from chatbot.config import get_settings
+        from chatbot.services import ingestion_service
+
+        monkeypatch.setenv("INGEST_COMPACTION_RATIO", "0.9")
+        get_settings.cache_clear()
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as indexed_dir:
+            self._write(os.path.join(input_dir, "a.txt"), "alpha")
+            self._write(os.path.join(input_dir, "b.txt"), "bravo")
+
+            with patch.object(ingestion_service, "load_and_chunk_file", side_effect=_fake_chunk), \
+                 patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=_fake_embed) as embed:
+                first = ingestion_service.ingest(input_dir, indexed_dir, "inc-col")
+                assert first.documents_processed == 2
+
+                second = ingestion_service.ingest(input_dir, indexed_dir, "inc-col")
+                assert second.documents_processed == 0
+                assert second.documents_unchanged == 2
+
+                self._write(os.path.join(input_dir, "b.txt"), "bravo, edited")
+                third = ingestion_service.ingest(input_dir, indexed_dir, "inc-col")
+                assert third.documents_processed == 1
+                assert embed.call_args_list[-1].args[0] == ["bravo, edited"]
+
+            manifest = ingestion_service.load_manifest(os.path.join(indexed_dir, "inc-col"))
+            assert manifest["files"]["b.txt"]["vector_ids"] == [2, 3]
+            assert manifest["ntotal"] == 3
+        get_settings.cache_clear()
+
+    def test_ivfpq_fallback_to_flat_is_rebuilt_on_the_next_run(self, monkeypatch):
+        from chatbot.config import get_settings
+        from chatbot.services import ingestion_service
+
+        monkeypatch.setenv("FAISS_INDEX_TYPE", "ivfpq")
+        get_settings.cache_clear()
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as indexed_dir:
+            self._write(os.path.join(input_dir, "a.txt"), "alpha")
+            with patch.object(ingestion_service, "load_and_chunk_file", side_effect=_fake_chunk), \
+                 patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=_fake_embed):
+                ingestion_service.ingest(input_dir, indexed_dir, "small-col")
+                manifest = ingestion_service.load_manifest(os.path.join(indexed_dir, "small-col"))
+                assert manifest["index_type"] == "flat"  # one vector: too few to train IVF-PQ
+
+                # Not reused as an IVF-PQ index: the next run rebuilds (and retrains, given enough vectors)
+                second = ingestion_service.ingest(input_dir, indexed_dir, "small-col")
+                assert second.documents_processed == 1
+        get_settings.cache_clear()
+
+    def test_deleted_file_is_tombstoned(self, monkeypatch):
+        from chatbot.adapters import vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import ingestion_service
+
+        monkeypatch.setenv("INGEST_COMPACTION_RATIO", "0.9")
+        get_settings.cache_clear()
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as indexed_dir:
+            for name in ("a.txt", "b.txt", "c.txt"):
+                self._write(os.path.join(input_dir, name), name)
+
+            with patch.object(ingestion_service, "load_and_chunk_file", side_effect=_fake_chunk), \
+                 patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=_fake_embed):
+                ingestion_service.ingest(input_dir, indexed_dir, "tomb-col")
+                os.unlink(os.path.join(input_dir, "c.txt"))
+                result = ingestion_service.ingest(input_dir, indexed_dir, "tomb-col")
+
+            assert result.documents_removed == 1
+            hits = vector_adapter.search([5.0, 1.0, 0.5, 0.25], k=3, collection="tomb-col")
+            assert {h.source for h in hits} == {"a.txt", "b.txt"}
+        get_settings.cache_clear()
+
+    def test_full_flag_rebuilds_everything(self):
+        from chatbot.services import ingestion_service
+
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as indexed_dir:
+            self._write(os.path.join(input_dir, "a.txt"), "alpha")
+            with patch.object(ingestion_service, "load_and_chunk_file", side_effect=_fake_chunk), \
+                 patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=_fake_embed):
+                ingestion_service.ingest(input_dir, indexed_dir, "full-col")
+                result = ingestion_service.ingest(input_dir, indexed_dir, "full-col", full=True)
+            assert result.documents_processed == 1
+            assert result.vectors_indexed == 1
+
+    def test_embeds_in_bounded_batches(self, monkeypatch):
+        from chatbot.config import get_settings
+        from chatbot.services import ingestion_service
+
+        monkeypatch.setenv("INGEST_BATCH_SIZE", "2")
+        get_settings.cache_clear()
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as indexed_dir:
+            for i in range(5):
+                self._write(os.path.join(input_dir, f"doc{i}.txt"), f"document {i}")
+            with patch.object(ingestion_service, "load_and_chunk_file", side_effect=_fake_chunk), \
+                 patch.object(ingestion_service.llm_adapter, "embed_texts", side_effect=_fake_embed) as embed:
+                result = ingestion_service.ingest(input_dir, indexed_dir, "batch-col")
+
+        assert result.vectors_indexed == 5
+        assert [len(c.args[0]) for c in embed.call_args_list] == [2, 2, 1]
+
+
+class TestAsyncEmbedding:
+    def test_batches_are_bounded_by_tokens_and_items(self):
+        from chatbot.adapters.llm_adapter import plan_embedding_batches
+        texts = ["aaaa", "bb", "cccccc", "d", "eeeeeeeeee"]
+        batches = plan_embedding_batches(texts, max_tokens=8, max_items=2, token_counter=len)
+        assert batches == [(0, 2, 6), (2, 4, 7), (4, 5, 10)]
+
+    async def test_known_token_counts_are_not_recounted(self):
+        from chatbot.adapters import llm_adapter
+
+        async def create(model, input):
+            return MagicMock(data=[MagicMock(embedding=[1.0]) for _ in input])
+
+        client = MagicMock()
+        client.embeddings.create = create
+        with patch.object(llm_adapter, "count_tokens", return_value=3) as count:
+            result = await llm_adapter._aembed_uncached(["known", "new"], client, token_counts={"known": 7})
+        assert result == [[1.0], [1.0]]
+        assert [c.args[0] for c in count.call_args_list] == ["new"]
+
+    async def test_results_keep_input_order_and_retry_on_429(self, monkeypatch):
+        import asyncio
+
+        import httpx
+        from openai import RateLimitError
+
+        from chatbot.adapters import llm_adapter
+        from chatbot.config import get_settings
+
+        monkeypatch.setenv("EMBEDDING_BATCH_MAX_ITEMS", "2")
+        monkeypatch.setenv("EMBEDDING_BATCH_MAX_TOKENS", "8")
+        get_settings.cache_clear()
+        monkeypatch.setattr(llm_adapter, "count_tokens", len)
+        calls = {"n": 0}
+
+        async def create(model, input):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                response = httpx.Response(429, headers={"retry-after": "0"}, request=httpx.Request("POST", "http://x"))
+                raise RateLimitError("slow down", response=response, body=None)
+            await asyncio.sleep(0.01 if input[0] == "first" else 0)  # finish out of order
+            return MagicMock(data=[MagicMock(embedding=[float(len(text))]) for text in input])
+
+        client = MagicMock()
+        client.embeddings.create = create
+        plans = []
+        real_plan = llm_adapter.plan_embedding_batches
+
+        def plan(*args, **kwargs):
+            plans.append(real_plan(*args, **kwargs))
+            return plans[-1]
+
+        with patch.object(llm_adapter, "plan_embedding_batches", side_effect=plan):
+            result = await llm_adapter.aembed_texts(["first", "second!", "3"], client=client)
+
+        # Split by the patched token count (5 | 7+1), not by the item cap
+        assert plans == [[(0, 1, 5), (1, 3, 8)]]
+        assert result == [[5.0], [7.0], [1.0]]
+        assert calls["n"] == 3
+        get_settings.cache_clear()
+
+
+@pytest.fixture
+def embedding_cache_file(monkeypatch, tmp_path):
+    from chatbot.adapters import embedding_cache
+    from chatbot.config import get_settings
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+    get_settings.cache_clear()
+    yield embedding_cache
+    embedding_cache.close()
+    get_settings.cache_clear()
+
+
+class TestEmbeddingCache:
+    def test_round_trip_is_keyed_by_model(self, embedding_cache_file):
+        cache = embedding_cache_file
+        cache.put_many("model-a", ["hello"], [[0.5, 0.25]])
+        assert cache.get_many("model-a", ["hello", "other"]) == [[0.5, 0.25], None]
+        assert cache.get_many("model-b", ["hello"]) == [None]
+
+    def test_embed_texts_only_sends_misses(self, embedding_cache_file):
+        from chatbot.adapters import llm_adapter
+
+        with patch.object(llm_adapter, "_embed_uncached", side_effect=lambda texts, *_: [[1.0, float(len(t))] for t in texts]) as api:
+            llm_adapter.embed_texts(["one", "two"])
+            result = llm_adapter.embed_texts(["two", "three", "three"])
+
+        assert result == [[1.0, 3.0], [1.0, 5.0], [1.0, 5.0]]
+        assert api.call_args_list[-1].args[0] == ["three"]
+
+    def test_evicts_least_recently_used_over_budget(self, embedding_cache_file, monkeypatch):
+        from chatbot.config import get_settings
+        cache = embedding_cache_file
+        monkeypatch.setenv("EMBEDDING_CACHE_MAX_MB", "1")
+        get_settings.cache_clear()
+
+        vector = [0.1] * 1536  # 6 KB per row → ~170 rows per MB
+        texts = [f"text {i}" for i in range(200)]
+        cache.put_many("m", texts[:100], [vector] * 100)
+        cache.put_many("m", texts[100:], [vector] * 100)  # newer batch pushes the cache over 1 MB
+
+        assert cache.stats()["size_bytes"] <= 1024 * 1024
+        assert all(v is not None for v in cache.get_many("m", texts[100:]))  # newest batch kept
+        assert None in cache.get_many("m", texts[:100])  # older batch evicted first
+
+    def test_eviction_counts_rows_written_by_another_process(self, embedding_cache_file, monkeypatch):
+        import sqlite3
+
+        import numpy as np
+
+        from chatbot.config import get_settings
+        cache = embedding_cache_file
+        monkeypatch.setenv("EMBEDDING_CACHE_MAX_MB", "1")
+        get_settings.cache_clear()
+
+        vector = [0.1] * 1536
+        cache.put_many("m", ["ours"], [vector])  # opens the file; this process has seen ~6 KB
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        other = sqlite3.connect(get_settings().embedding_cache_path)
+        other.executemany(
+            "INSERT INTO embeddings (model, text_hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            [("m", f"other {i}".encode(), blob, len(blob), 0.0) for i in range(200)],
+        )
+        other.commit()
+        other.close()
+
+        cache.put_many("m", ["new"], [vector])
+        assert cache._stored_bytes(cache._get_conn()) <= 1024 * 1024
+        assert cache.stats()["size_bytes"] == cache._stored_bytes(cache._get_conn())
+        assert None not in cache.get_many("m", ["ours", "new"])  # the other process's older rows went first
+
+    def test_hits_only_touch_rows_not_used_recently(self, embedding_cache_file):
+        cache = embedding_cache_file
+        cache.put_many("m", ["fresh", "old"], [[1.0], [2.0]])
+        conn = cache._get_conn()
+        conn.execute("UPDATE embeddings SET last_used = 0 WHERE text_hash = ?", (cache._text_hash("old"),))
+        before = dict(conn.execute("SELECT text_hash, last_used FROM embeddings"))
+
+        cache.get_many("m", ["fresh", "old"])
+        after = dict(conn.execute("SELECT text_hash, last_used FROM embeddings"))
+        assert after[cache._text_hash("fresh")] == before[cache._text_hash("fresh")]
+        assert after[cache._text_hash("old")] > 0
+
+
+class TestUploadJobs:
+    @staticmethod
+    def _wait(job_id):
+        import time
+
+        from chatbot.services import upload_jobs
+        for _ in range(200):
+            job = upload_jobs.get(job_id)
+            if job.finished:
+                return job
+            time.sleep(0.01)
+        raise AssertionError("upload job did not finish")
+
+    @staticmethod
+    def _spool(filename, data):
+        from chatbot.services import upload_jobs
+        path = upload_jobs.spool_path(filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_spooled_upload_is_ingested_in_background_and_cleaned_up(self):
+        import threading
+
+        from chatbot.services import upload_jobs
+        from chatbot.services.ingestion_service import UploadResult
+
+        release = threading.Event()
+        seen = {}
+
+        def ingest_file(path, collection, progress):
+            seen["source"] = os.path.basename(path)
+            with open(path, "rb") as f:
+                seen["bytes"] = f.read()
+            progress("embedding")
+            release.wait(5)
+            return UploadResult(collection=collection, source="report.pdf", chunks_indexed=7, elapsed_seconds=0.1)
+
+        path = self._spool("../../report.pdf", b"%PDF-1.4 " * 1000)
+        with patch.object(upload_jobs, "ingest_file", side_effect=ingest_file):
+            job = upload_jobs.submit(path, "docs")
+            for _ in range(200):
+                if upload_jobs.get(job.job_id).stage == "embedding":
+                    break
+                threading.Event().wait(0.01)
+            assert upload_jobs.get(job.job_id).status == "running"
+            release.set()
+            job = self._wait(job.job_id)
+
+        assert job.status == "succeeded" and job.result.chunks_indexed == 7
+        assert seen == {"source": "report.pdf", "bytes": b"%PDF-1.4 " * 1000}
+        assert not os.path.exists(os.path.dirname(path))
+
+    @staticmethod
+    def _multipart(parts, boundary="XyZ"):
+        body = b""
+        for name, filename, data in parts:
+            disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+            body += f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+        return f"multipart/form-data; boundary={boundary}", body + f"--{boundary}--\r\n".encode()
+
+    async def test_multipart_body_is_streamed_into_the_spool_file(self):
+        from chatbot.services import upload_jobs
+
+        data = bytes(range(256)) * 400  # binary, with bytes that look like CR/LF and dashes
+        content_type, body = self._multipart([("file", "../scan.png", data), ("collection", None, b"docs")])
+
+        async def chunks():
+            for i in range(0, len(body), 7):  # split across boundaries and headers
+                yield body[i:i + 7]
+
+        form = await upload_jobs.spool_multipart(content_type, chunks(), extensions={".png"})
+        try:
+            assert form.filename == "scan.png" and form.fields == {"collection": "docs"}
+            with open(form.path, "rb") as f:
+                assert f.read() == data
+        finally:
+            upload_jobs.discard(form.path)
+
+    async def test_refused_file_type_is_never_written(self):
+        from chatbot.services import upload_jobs
+
+        content_type, body = self._multipart([("file", "tool.exe", b"MZ" * 100)])
+
+        async def chunks():
+            yield body
+
+        with patch.object(upload_jobs, "spool_path") as spool_path:
+            form = await upload_jobs.spool_multipart(content_type, chunks(), extensions={".pdf"})
+        assert form.filename == "tool.exe" and form.path is None
+        spool_path.assert_not_called()
+
+    def test_upload_route_spools_and_queues_the_file(self, test_client, auth_headers):
+        from chatbot.services import upload_jobs
+
+        seen = {}
+
+        def submit(path, collection):
+            with open(path, "rb") as f:
+                seen.update(source=os.path.basename(path), data=f.read(), collection=collection)
+            upload_jobs.discard(path)
+            return upload_jobs.UploadJob(job_id="j1", collection=collection, source=os.path.basename(path))
+
+        with patch.object(upload_jobs, "submit", side_effect=submit):
+            response = test_client.post(
+                "/api/v1/upload",
+                headers=auth_headers,
+                files={"file": ("report.pdf", b"%PDF-1.4 body", "application/pdf")},
+                data={"collection": "docs"},
+            )
+            refused = test_client.post(
+                "/api/v1/upload", headers=auth_headers, files={"file": ("tool.exe", b"MZ", "application/octet-stream")},
+            )
+        assert response.status_code == 202 and response.json()["job_id"] == "j1"
+        assert seen == {"source": "report.pdf", "data": b"%PDF-1.4 body", "collection": "docs"}
+        assert refused.status_code == 415
+
+    def test_failed_ingestion_reports_error(self):
+        from chatbot.services import upload_jobs
+
+        path = self._spool("empty.docx", b"")
+        with patch.object(upload_jobs, "ingest_file", side_effect=ValueError("No text could be extracted from 'empty.docx'.")):
+            job = self._wait(upload_jobs.submit(path, "docs").job_id)
+        assert job.status == "failed" and "No text" in job.error
+        assert upload_jobs.get("no-such-job") is None
+
+    def test_shutdown_fails_queued_jobs_and_removes_their_files(self, monkeypatch):
+        import threading
+
+        from chatbot.config import get_settings
+        from chatbot.services import upload_jobs
+
+        monkeypatch.setenv("UPLOAD_WORKERS", "1")
+        get_settings.cache_clear()
+        monkeypatch.setattr(upload_jobs, "_pool", None)
+        release = threading.Event()
+        started = threading.Event()
+
+        def ingest_file(path, collection, progress):
+            started.set()
+            release.wait(5)
+            raise ValueError("stopped")
+
+        with patch.object(upload_jobs, "ingest_file", side_effect=ingest_file):
+            paths = [self._spool(f"doc{i}.txt", b"x") for i in range(3)]
+            jobs = [upload_jobs.submit(path, "docs") for path in paths]
+            assert started.wait(5)
+            upload_jobs.shutdown()
+            release.set()
+            running = self._wait(jobs[0].job_id)
+        get_settings.cache_clear()
+
+        assert running.error == "stopped"
+        for job, path in zip(jobs[1:], paths[1:]):
+            assert job.status == "failed" and "shut down" in job.error
+            assert not os.path.exists(os.path.dirname(path))
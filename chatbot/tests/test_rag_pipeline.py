@@ -67,6 +67,18 @@ class TestContextTokenBudget:
         assert accepted == []
 
 
+    def test_uses_stored_token_counts_without_tokenizing(self, sample_chunks):
+        from dataclasses import replace
+
+        from chatbot.adapters import llm_adapter
+        from chatbot.services.query_service import build_context_block
+
+        counted = [replace(c, token_count=10) for c in sample_chunks]
+        with patch.object(llm_adapter, "count_tokens", side_effect=AssertionError("tokenized")):
+            _, accepted = build_context_block(counted, max_tokens=25)
+        assert len(accepted) == 2
+
+
 class TestDynamicThreshold:
     def test_filters_low_scoring_chunks(self, sample_chunks):
         """Chunks below threshold_ratio * max_score should be excluded."""
@@ -90,6 +102,251 @@ class TestDynamicThreshold:
         assert len(filtered) == 3
 
 
+class TestHybridFusion:
+    def test_keyword_match_below_dense_threshold_survives_fusion(self, sample_chunks):
+        from chatbot.adapters import vector_adapter
+        from chatbot.adapters.vector_adapter import RetrievedChunk
+        from chatbot.services import query_service
+
+        part_number = RetrievedChunk(text="Part XR-220 seal kit.", source="parts.pdf", page_num=4, score=0.41, vector_id=9)
+        dense = sample_chunks + [part_number]  # 0.41 < 0.8 × 0.95 — dense thresholding alone drops it
+        sparse_hits = [(9, 12.3), (0, 2.1)]
+
+        with patch.object(vector_adapter, "get_chunks", return_value=[part_number, sample_chunks[0]]):
+            fused = query_service.fuse_hybrid(dense, sparse_hits, "default")
+
+        ids = [c.vector_id for c in fused]
+        assert ids[0] == 0  # ranked high by both lists
+        assert 9 in ids
+        assert 2 not in ids  # below the dense threshold and no keyword match
+
+    def test_rrf_scores_sum_over_lists(self, sample_chunks):
+        from chatbot.services.query_service import reciprocal_rank_fusion
+        fused = reciprocal_rank_fusion([sample_chunks, list(reversed(sample_chunks))], k=3, rrf_k=60)
+        assert fused[0].score == pytest.approx(1 / 61 + 1 / 63)
+        assert len(fused) == 3
+
+
+class TestReranker:
+    def _chunks(self):
+        import numpy as np
+
+        from chatbot.adapters.vector_adapter import RetrievedChunk
+
+        vectors = {
+            "a": [0.90, 0.10, 0.00],
+            "a-overlap": [0.90, 0.11, 0.00],  # near-duplicate of a (overlapping chunk)
+            "b": [0.60, 0.00, 0.80],
+        }
+        return [
+            RetrievedChunk(text=name, source=f"{name}.pdf", page_num=0, score=score, vector_id=i,
+                           embedding=np.asarray(vec, dtype=np.float32))
+            for i, ((name, vec), score) in enumerate(zip(vectors.items(), [0.99, 0.98, 0.90]))
+        ]
+
+    def test_mmr_prefers_a_distinct_chunk_over_a_near_duplicate(self):
+        import numpy as np
+
+        from chatbot.services import reranker
+
+        chunks = self._chunks()
+        embeddings = np.stack([c.embedding for c in chunks])
+        assert reranker.mmr([1.0, 0.0, 0.0], embeddings, k=2, lambda_mult=0.5) == [0, 2]
+        assert reranker.mmr([1.0, 0.0, 0.0], embeddings, k=2, lambda_mult=1.0) == [0, 1]
+
+    def test_prepare_context_reranks_candidates_and_cross_encoder_respects_budget(self, monkeypatch):
+        import time
+
+        from chatbot.config import get_settings
+        from chatbot.services import query_service, reranker
+
+        class FakeCrossEncoder:
+            delay = 0.0
+
+            def predict(self, pairs):
+                time.sleep(self.delay)
+                return [{"a": 0.1, "a-overlap": 0.05, "b": 0.9}[text] for _, text in pairs]
+
+        model = FakeCrossEncoder()
+        monkeypatch.setattr(reranker, "_get_cross_encoder", lambda: model)
+        monkeypatch.setenv("ENABLE_MMR", "true")
+        monkeypatch.setenv("MMR_LAMBDA", "0.5")
+        monkeypatch.setenv("VECTOR_SEARCH_K", "2")
+        monkeypatch.setenv("THRESHOLD_RATIO", "0.5")
+        monkeypatch.setenv("CROSS_ENCODER_MODEL", "fake")
+        monkeypatch.setenv("RERANK_BUDGET_MS", "1000")
+        get_settings.cache_clear()
+        assert reranker.candidate_k() == 20
+
+        prepared = query_service.prepare_context(self._chunks(), question="q", query_vector=[1.0, 0.0, 0.0])
+        assert [s["filename"] for s in prepared.sources] == ["b.pdf", "a.pdf"]
+
+        # Out of budget after the first batch: the MMR order stands
+        model.delay = 0.01
+        monkeypatch.setattr(reranker, "_CROSS_ENCODER_BATCH", 1)
+        monkeypatch.setenv("RERANK_BUDGET_MS", "1")
+        get_settings.cache_clear()
+        prepared = query_service.prepare_context(self._chunks(), question="q", query_vector=[1.0, 0.0, 0.0])
+        get_settings.cache_clear()
+        assert [s["filename"] for s in prepared.sources] == ["a.pdf", "b.pdf"]
+
+    def test_cross_encoder_picks_from_every_candidate(self, monkeypatch):
+        from chatbot.adapters.vector_adapter import RetrievedChunk
+        from chatbot.config import get_settings
+        from chatbot.services import reranker
+
+        class FakeCrossEncoder:
+            def predict(self, pairs):
+                return [float(text.split()[1]) for _, text in pairs]  # prefers the last candidates
+
+        monkeypatch.setattr(reranker, "_get_cross_encoder", lambda: FakeCrossEncoder())
+        monkeypatch.setenv("VECTOR_SEARCH_K", "3")
+        monkeypatch.setenv("CROSS_ENCODER_MODEL", "fake")
+        monkeypatch.setenv("RERANK_BUDGET_MS", "1000")
+        get_settings.cache_clear()
+        chunks = [
+            RetrievedChunk(text=f"c {i}", source="doc.pdf", page_num=i, score=1.0 - i / 100, vector_id=i)
+            for i in range(reranker.candidate_k())
+        ]
+        picked = reranker.rerank("q", [1.0], chunks)
+        get_settings.cache_clear()
+        assert [c.text for c in picked] == ["c 19", "c 18", "c 17"]
+
+
+class TestLLMPool:
+    def _pool(self, monkeypatch, **env):
+        from chatbot.adapters import llm_pool
+        from chatbot.config import get_settings
+
+        monkeypatch.setenv("LLM_ENDPOINTS", "groq:fast-model,ollama:llama3.1:8b")
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        get_settings.cache_clear()
+        llm_pool.reset()
+        pool = llm_pool.get_pool()
+        assert [e.name for e in pool.endpoints] == ["groq:fast-model", "ollama:llama3.1:8b"]
+        assert [e.client.max_retries for e in pool.endpoints] == [0, 0]  # failover replaces client retries
+        return pool
+
+    def test_routes_to_fastest_healthy_endpoint_and_fails_over(self, monkeypatch):
+        from chatbot.adapters import llm_pool
+        from chatbot.config import get_settings
+
+        pool = self._pool(monkeypatch, LLM_UNHEALTHY_ERROR_RATE="0.5")
+        fast, slow = pool.endpoints
+        for _ in range(5):
+            fast.record(0.1, ok=True)
+            slow.record(0.4, ok=True)
+        assert pool.ranked() == [fast, slow]
+
+        def call(endpoint):
+            if endpoint is fast:
+                raise RuntimeError("503")
+            return endpoint.model
+
+        # Errors fail over to the next endpoint, and failures push the fast one down the ranking
+        for _ in range(5):
+            assert pool.complete(call) == "llama3.1:8b"
+        assert pool.ranked() == [slow, fast]
+        assert fast.failures_since_success == 2
+
+        # Once half the window failed, it is skipped altogether
+        for _ in range(3):
+            fast.record(0.1, ok=False)
+        assert not fast.healthy()
+        assert pool.ranked() == [slow, fast]
+        assert pool.stats()["groq:fast-model"]["healthy"] is False
+        get_settings.cache_clear()
+        llm_pool.reset()
+
+    def test_failing_endpoint_without_successes_ranks_last(self, monkeypatch):
+        from chatbot.adapters import llm_pool
+        from chatbot.config import get_settings
+
+        pool = self._pool(monkeypatch)
+        broken, working = pool.endpoints
+        assert pool.ranked() == [broken, working]  # neither called yet: explored in order
+        working.record(0.4, ok=True)
+        broken.record(0.01, ok=False)
+        assert pool.ranked() == [working, broken]
+        get_settings.cache_clear()
+        llm_pool.reset()
+
+    def test_sync_hedge_returns_the_first_answer(self, monkeypatch):
+        import time
+
+        from chatbot.adapters import llm_pool
+        from chatbot.config import get_settings
+
+        pool = self._pool(monkeypatch, LLM_HEDGE="true", LLM_HEDGE_MIN_MS="20")
+        primary, backup = pool.endpoints
+        for _ in range(5):
+            primary.record(0.01, ok=True)
+            backup.record(0.05, ok=True)
+
+        def call(endpoint):
+            time.sleep(0.5 if endpoint is primary else 0.01)
+            return endpoint.name
+
+        start = time.perf_counter()
+        assert pool.complete(call) == "ollama:llama3.1:8b"
+        assert time.perf_counter() - start < 0.3  # the slow primary is not waited on
+        get_settings.cache_clear()
+        llm_pool.reset()
+
+    def test_sync_hedge_fails_over_when_both_fail(self, monkeypatch):
+        import time
+
+        from chatbot.adapters import llm_pool
+        from chatbot.config import get_settings
+
+        pool = self._pool(monkeypatch, LLM_HEDGE="true", LLM_HEDGE_MIN_MS="20")
+        primary, backup = pool.endpoints
+        for _ in range(5):
+            primary.record(0.01, ok=True)
+            backup.record(0.05, ok=True)
+
+        def call(endpoint):
+            time.sleep(0.1 if endpoint is primary else 0.01)
+            raise RuntimeError(endpoint.name)
+
+        with pytest.raises(RuntimeError):
+            pool.complete(call)
+        assert primary.failures_since_success == 1 and backup.failures_since_success == 1
+        get_settings.cache_clear()
+        llm_pool.reset()
+
+    async def test_hedges_a_slow_primary_and_cancels_the_loser(self, monkeypatch):
+        import asyncio
+        import time
+
+        from chatbot.adapters import llm_pool
+        from chatbot.config import get_settings
+
+        pool = self._pool(monkeypatch, LLM_HEDGE="true", LLM_HEDGE_MIN_MS="20")
+        primary, backup = pool.endpoints
+        for _ in range(5):
+            primary.record(0.01, ok=True)
+            backup.record(0.05, ok=True)
+        cancelled = []
+
+        async def call(endpoint):
+            try:
+                await asyncio.sleep(1.0 if endpoint is primary else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(endpoint.name)
+                raise
+            return endpoint.name
+
+        start = time.perf_counter()
+        assert await pool.acomplete(call) == "ollama:llama3.1:8b"
+        assert time.perf_counter() - start < 0.5
+        await asyncio.sleep(0)
+        assert cancelled == ["groq:fast-model"]
+        get_settings.cache_clear()
+        llm_pool.reset()
+
+
 class TestSchemaValidation:
     def test_valid_session_id(self):
         from chatbot.models.schemas import QueryRequest
@@ -160,3 +417,582 @@ class TestCacheAdapter:
         assert len(history) <= 4  # max 2 turns * 2 messages
         cache_adapter.clear_history(sid)
         get_settings.cache_clear()
+
+    def test_redis_save_is_one_pipelined_rpush_ltrim_expire(self, monkeypatch):
+        from chatbot.adapters import cache_adapter
+
+        class FakePipeline:
+            def __init__(self, redis):
+                self.redis, self.ops = redis, []
+            def rpush(self, key, *values):
+                self.ops.append(("rpush", key, values))
+            def ltrim(self, key, start, end):
+                self.ops.append(("ltrim", key, start, end))
+            def expire(self, key, ttl):
+                self.ops.append(("expire", key, ttl))
+            def execute(self):
+                self.redis.executed.append(self.ops)
+                for op in self.ops:
+                    if op[0] == "rpush":
+                        self.redis.lists.setdefault(op[1], []).extend(op[2])
+                    elif op[0] == "ltrim":
+                        self.redis.lists[op[1]] = self.redis.lists[op[1]][op[2]:]
+
+        class FakeRedis:
+            def __init__(self):
+                self.lists, self.executed = {}, []
+            def pipeline(self):
+                return FakePipeline(self)
+            def lrange(self, key, start, end):
+                return self.lists.get(key, [])[start:]
+            def get(self, key):
+                raise AssertionError("history must not be read back to save a turn")
+
+        fake = FakeRedis()
+        monkeypatch.setattr(cache_adapter, "_redis", fake)
+        monkeypatch.setattr(cache_adapter, "_redis_available", True)
+        monkeypatch.setenv("MAX_HISTORY_TURNS", "1")
+        from chatbot.config import get_settings
+        get_settings.cache_clear()
+
+        cache_adapter.save_history("list-session", "Q0", "A0")
+        cache_adapter.save_history("list-session", "Q1", "A1")
+        get_settings.cache_clear()
+
+        assert len(fake.executed) == 2
+        assert [op[0] for op in fake.executed[0]] == ["rpush", "ltrim", "expire"]
+        assert [m["content"] for m in cache_adapter.get_history("list-session")] == ["Q1", "A1"]
+
+    def test_memory_fallback_is_bounded_and_expires(self, monkeypatch):
+        from chatbot.adapters import cache_adapter
+        from chatbot.config import get_settings
+
+        monkeypatch.setattr(cache_adapter, "_memory_store", type(cache_adapter._memory_store)())
+        monkeypatch.setenv("MEMORY_HISTORY_MAX_SESSIONS", "2")
+        get_settings.cache_clear()
+        for sid in ["mem-a", "mem-b", "mem-c"]:
+            cache_adapter.save_history(sid, "Q", "A")
+        assert list(cache_adapter._memory_store) == ["mem-b", "mem-c"]
+
+        clock = cache_adapter.time.monotonic() + get_settings().cache_ttl + 1
+        monkeypatch.setattr(cache_adapter.time, "monotonic", lambda: clock)
+        assert cache_adapter.get_history("mem-b") == []
+        cache_adapter.save_history("mem-d", "Q", "A")
+        get_settings.cache_clear()
+        assert list(cache_adapter._memory_store) == ["mem-d"]
+
+
+    def test_history_summary_folds_old_turns_in_background(self, monkeypatch):
+        from chatbot.adapters import cache_adapter
+        from chatbot.config import get_settings
+
+        calls = []
+
+        def summarize(summary, messages):
+            calls.append((summary, [m["content"] for m in messages]))
+            # A turn saved while the summary is being written must survive the fold
+            if len(calls) == 1:
+                cache_adapter._memory_append("summary-session", cache_adapter._turn("Q-late", "A-late"), 100)
+            return f"summary#{len(calls)}"
+
+        cache_adapter.set_summarizer(summarize)
+        monkeypatch.setenv("ENABLE_HISTORY_SUMMARY", "true")
+        monkeypatch.setenv("HISTORY_SUMMARY_THRESHOLD_TOKENS", "10000")
+        monkeypatch.setenv("HISTORY_SUMMARY_KEEP_TURNS", "1")
+        monkeypatch.setenv("MAX_HISTORY_TURNS", "2")
+        get_settings.cache_clear()
+        sid = "summary-session"
+        try:
+            monkeypatch.setattr(cache_adapter, "schedule_summary", lambda session_id: None)
+            for i in range(3):
+                cache_adapter.save_history(sid, f"Q{i}", f"A{i}")
+            # Three turns exceed the two-turn prompt window: everything but the last turn is folded
+            assert cache_adapter._summarize_session(sid)
+            history = cache_adapter.get_history(sid)
+        finally:
+            cache_adapter.set_summarizer(None)
+            cache_adapter.clear_history(sid)
+            get_settings.cache_clear()
+
+        assert calls == [("", ["Q0", "A0", "Q1", "A1"])]
+        assert history[0]["role"] == "system" and history[0]["content"].endswith("summary#1")
+        assert [m["content"] for m in history[1:]] == ["Q2", "A2", "Q-late", "A-late"]
+
+    def test_save_history_schedules_summary_off_the_request_path(self, monkeypatch):
+        import threading
+
+        from chatbot.adapters import cache_adapter
+        from chatbot.config import get_settings
+
+        release = threading.Event()
+
+        def slow_summary(summary, messages):
+            release.wait(timeout=5)
+            return "short"
+
+        cache_adapter.set_summarizer(slow_summary)
+        monkeypatch.setenv("ENABLE_HISTORY_SUMMARY", "true")
+        monkeypatch.setenv("HISTORY_SUMMARY_THRESHOLD_TOKENS", "1")
+        monkeypatch.setenv("HISTORY_SUMMARY_KEEP_TURNS", "1")
+        get_settings.cache_clear()
+        sid = "summary-session-02"
+        try:
+            cache_adapter.save_history(sid, "Q0", "A0")  # one turn: nothing to fold
+            while sid in cache_adapter._summarizing:
+                threading.Event().wait(0.01)
+            cache_adapter.save_history(sid, "Q1", "A1")  # returns while the summarizer is still blocked
+            assert [m["content"] for m in cache_adapter.get_history(sid)] == ["Q0", "A0", "Q1", "A1"]
+            future = cache_adapter.schedule_summary(sid)
+            assert future is None  # a fold for this session is already in flight
+            release.set()
+            for _ in range(100):
+                if cache_adapter.get_history(sid)[0]["role"] == "system":
+                    break
+                threading.Event().wait(0.01)
+            history = cache_adapter.get_history(sid)
+        finally:
+            release.set()
+            cache_adapter.set_summarizer(None)
+            cache_adapter.clear_history(sid)
+            get_settings.cache_clear()
+
+        assert [m["content"] for m in history] == ["Summary of the earlier conversation:\nshort", "Q1", "A1"]
+
+
+class TestQueryCaches:
+    def test_repeat_question_embedding_served_from_lru(self):
+        from chatbot.adapters import llm_adapter
+        with patch.object(llm_adapter, "_embed_query_uncached", return_value=[0.1, 0.2]) as api:
+            llm_adapter.embed_query("what projects has X done? lru-test")
+            llm_adapter.embed_query("what projects has X done? lru-test")
+        assert api.call_count == 1
+
+    @staticmethod
+    def _fake_redis():
+        from chatbot.adapters import cache_adapter
+
+        class FakePipeline:
+            def __init__(self, redis):
+                self.redis, self.calls = redis, []
+            def __getattr__(self, name):
+                return lambda *args: self.calls.append((name, args))
+            def execute(self):
+                return [getattr(self.redis, name)(*args) for name, args in self.calls]
+
+        class FakeRedis:
+            """Just enough of redis-py for the semantic cache."""
+            def __init__(self):
+                self.data, self.lranges = {}, []
+            def get(self, key):
+                return self.data.get(key)
+            def incr(self, key):
+                return self.incrby(key, 1)
+            def incrby(self, key, amount):
+                self.data[key] = int(self.data.get(key, 0)) + amount
+                return self.data[key]
+            def rpush(self, key, value):
+                self.data.setdefault(key, []).append(value)
+                return len(self.data[key])
+            def lrange(self, key, start, end):
+                assert not cache_adapter._semantic_lock.locked()  # no Redis round trip under the lock
+                self.lranges.append((start, end))
+                items = self.data.get(key, [])
+                return items[start:] if end == -1 else items[start:end + 1]
+            def ltrim(self, key, start, end):
+                self.data[key] = self.data.get(key, [])[start:]
+            def hset(self, key, field, value):
+                self.data.setdefault(key, {})[field] = value
+            def hget(self, key, field):
+                return self.data.get(key, {}).get(field)
+            def hdel(self, key, *fields):
+                for field in fields:
+                    self.data.get(key, {}).pop(field, None)
+            def expire(self, key, ttl):
+                pass
+            def pipeline(self):
+                return FakePipeline(self)
+
+        return FakeRedis()
+
+    def test_semantic_cache_matches_near_duplicates_until_invalidated(self, monkeypatch):
+        from chatbot.adapters import cache_adapter
+        from chatbot.config import get_settings
+
+        monkeypatch.setenv("ENABLE_SEMANTIC_CACHE", "true")
+        get_settings.cache_clear()
+        monkeypatch.setattr(cache_adapter, "_redis", self._fake_redis())
+        monkeypatch.setattr(cache_adapter, "_redis_available", True)
+
+        sources = [{"filename": "cv.pdf", "page_num": 1}]
+        cache_adapter.semantic_store("sem-col", [1.0, 0.0, 0.0], "Three projects.", sources)
+
+        hit = cache_adapter.semantic_lookup("sem-col", [0.99, 0.01, 0.0])
+        assert hit == {"answer": "Three projects.", "sources": sources}
+        assert cache_adapter.semantic_lookup("sem-col", [0.0, 1.0, 0.0]) is None
+        assert cache_adapter.semantic_lookup("other-col", [1.0, 0.0, 0.0]) is None
+
+        cache_adapter.invalidate_semantic_cache("sem-col")
+        assert cache_adapter.semantic_lookup("sem-col", [1.0, 0.0, 0.0]) is None
+        get_settings.cache_clear()
+
+    def test_semantic_mirror_resyncs_after_the_keys_expire(self, monkeypatch):
+        from chatbot.adapters import cache_adapter
+        from chatbot.config import get_settings
+
+        fake = self._fake_redis()
+        monkeypatch.setenv("ENABLE_SEMANTIC_CACHE", "true")
+        get_settings.cache_clear()
+        monkeypatch.setattr(cache_adapter, "_redis", fake)
+        monkeypatch.setattr(cache_adapter, "_redis_available", True)
+
+        axes = [[1.0 if i == j else 0.0 for j in range(8)] for i in range(8)]
+        for i in (0, 1):
+            cache_adapter.semantic_store("exp-col", axes[i], f"answer to Q{i}", [])
+        assert cache_adapter.semantic_lookup("exp-col", axes[1])["answer"] == "answer to Q1"
+
+        fake.data.clear()  # SEMANTIC_CACHE_TTL passed: both keys expired
+        for i in (5, 6):
+            cache_adapter.semantic_store("exp-col", axes[i], f"answer to NEW Q{i}", [])
+        assert cache_adapter.semantic_lookup("exp-col", axes[1]) is None
+        assert cache_adapter.semantic_lookup("exp-col", axes[5])["answer"] == "answer to NEW Q5"
+        assert cache_adapter.semantic_lookup("exp-col", axes[6])["answer"] == "answer to NEW Q6"
+        get_settings.cache_clear()
+
+
+    def test_full_semantic_cache_evicts_oldest_entries(self, monkeypatch):
+        from chatbot.adapters import cache_adapter
+        from chatbot.config import get_settings
+
+        fake = self._fake_redis()
+        monkeypatch.setenv("ENABLE_SEMANTIC_CACHE", "true")
+        monkeypatch.setenv("SEMANTIC_CACHE_MAX_ENTRIES", "4")
+        get_settings.cache_clear()
+        monkeypatch.setattr(cache_adapter, "_redis", fake)
+        monkeypatch.setattr(cache_adapter, "_redis_available", True)
+
+        axes = [[1.0 if i == j else 0.0 for j in range(8)] for i in range(8)]
+        for i in range(4):
+            cache_adapter.semantic_store("full-col", axes[i], f"A{i}", [])
+        assert cache_adapter.semantic_lookup("full-col", axes[3])["answer"] == "A3"  # mirror holds 0..3
+
+        cache_adapter.semantic_store("full-col", axes[4], "A4", [])  # a full cache still admits it, evicting 0
+        fake.lranges.clear()
+        assert cache_adapter.semantic_lookup("full-col", axes[0]) is None
+        assert fake.lranges == [(2, -1)]  # realigned: re-read entry 3 (now at index 2) plus the new one
+        assert [cache_adapter.semantic_lookup("full-col", axes[i])["answer"] for i in range(1, 5)] == ["A1", "A2", "A3", "A4"]
+        mirror = cache_adapter._semantic_mirror["full-col"]
+        assert (mirror.base, len(mirror.ids)) == (1, 4)
+        assert len(fake.data["semantic_cache:v2:full-col:0:answers"]) == 4
+        get_settings.cache_clear()
+
+
+class TestBatchQuery:
+    def test_embed_queries_dedups_and_reuses_lru(self):
+        from chatbot.adapters import llm_adapter
+
+        def fake_embed(texts, batch_size):
+            return [[float(len(t)), 1.0] for t in texts]
+
+        with patch.object(llm_adapter, "_embed_query_uncached", return_value=[9.0, 9.0]):
+            llm_adapter.embed_query("batch-lru-hit")
+        with patch.object(llm_adapter, "_embed_uncached", side_effect=fake_embed) as api:
+            vectors = llm_adapter.embed_queries(["batch-a", "batch-lru-hit", "batch-a", "batch-bb"])
+
+        assert api.call_count == 1
+        assert api.call_args[0][0] == ["batch-a", "batch-bb"]  # one request, duplicates and LRU hits removed
+        assert vectors == [[7.0, 1.0], [9.0, 9.0], [7.0, 1.0], [8.0, 1.0]]
+
+    def test_batch_reports_per_question_errors(self, sample_chunks, monkeypatch):
+        from chatbot.adapters import llm_adapter, vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.models.schemas import BatchQueryRequest
+        from chatbot.services import chatbot_service, query_service
+
+        monkeypatch.setenv("ENABLE_CONTENT_SAFETY", "false")
+        monkeypatch.setenv("VECTOR_BACKEND", "faiss")
+        get_settings.cache_clear()
+        request = BatchQueryRequest(questions=["What is the return policy?", "\x00\x01", "Refunds?"])
+        with patch.object(llm_adapter, "embed_queries", return_value=[[1.0], [1.0]]) as embed, \
+             patch.object(vector_adapter, "load_index", return_value=True), \
+             patch.object(vector_adapter, "search_batch", return_value=[sample_chunks, []]) as search, \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])), \
+             patch.object(llm_adapter, "chat_completion", return_value="30 days."):
+            response = chatbot_service.process_batch_query(request)
+        get_settings.cache_clear()
+
+        assert embed.call_count == 1 and search.call_count == 1
+        first, invalid, unanswerable = response.results
+        assert first.answer == "30 days." and first.has_context
+        assert first.sources[0].filename == "policy.pdf"
+        assert invalid.error and not invalid.has_context
+        assert unanswerable.error is None and not unanswerable.has_context
+
+    def test_batch_supabase_failures_stay_per_question(self, sample_chunks, monkeypatch):
+        from chatbot.adapters import llm_adapter, supabase_adapter
+        from chatbot.config import get_settings
+        from chatbot.models.schemas import BatchQueryRequest
+        from chatbot.services import chatbot_service, query_service
+
+        monkeypatch.setenv("ENABLE_CONTENT_SAFETY", "false")
+        monkeypatch.setenv("VECTOR_BACKEND", "supabase")
+        get_settings.cache_clear()
+
+        def embed_one(question):
+            if question == "bad embed":
+                raise RuntimeError("embedding API down")
+            return [float(len(question))]
+
+        def search(collection, query_vec, k, with_embeddings):
+            if query_vec == [float(len("bad search"))]:
+                raise RuntimeError("RPC timeout")
+            return sample_chunks
+
+        request = BatchQueryRequest(questions=["Refunds?", "bad embed", "bad search"])
+        with patch.object(llm_adapter, "embed_queries", side_effect=RuntimeError("batch rejected")), \
+             patch.object(llm_adapter, "embed_query", side_effect=embed_one), \
+             patch.object(supabase_adapter, "search", side_effect=search) as rpc, \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])), \
+             patch.object(llm_adapter, "chat_completion", return_value="30 days."):
+            response = chatbot_service.process_batch_query(request)
+        get_settings.cache_clear()
+
+        assert rpc.call_count == 2  # the question whose embedding failed is not searched
+        ok, bad_embed, bad_search = response.results
+        assert ok.answer == "30 days." and ok.error is None
+        assert bad_embed.error and bad_search.error
+
+
+class TestSupabasePool:
+    def test_search_uses_prepared_statement_with_per_query_tuning(self, monkeypatch):
+        import threading
+
+        from chatbot import metrics
+        from chatbot.adapters import supabase_adapter
+
+        executed = []
+
+        class FakeCursor:
+            def __enter__(self):
+                return self
+            def __exit__(self, *exc):
+                return False
+            def execute(self, query, params):
+                executed.append((query, params))
+            def fetchall(self):
+                return [(7, "Part XR-220", "parts.pdf", 2, 4, 0.91)]
+
+        class FakeConn:
+            closed = 0
+            def cursor(self):
+                return FakeCursor()
+            def commit(self):
+                pass
+            def rollback(self):
+                pass
+
+        class FakePool:
+            def __init__(self):
+                self.returned = 0
+            def getconn(self):
+                return FakeConn()
+            def putconn(self, conn, close=False):
+                self.returned += 1
+
+        pool = FakePool()
+        monkeypatch.setattr(supabase_adapter, "_pool", pool)
+        monkeypatch.setattr(supabase_adapter, "_pool_slots", threading.BoundedSemaphore(1))
+
+        chunks = supabase_adapter.search("default", [0.1, 0.2], k=3, ef_search=100)
+
+        assert chunks[0].vector_id == 7 and chunks[0].score == pytest.approx(0.91) and chunks[0].token_count == 4
+        query, params = executed[0]
+        assert "EXECUTE chatbot_search" in query and "set_config" in query
+        assert params[:4] == ["hnsw.ef_search", "100", "ivfflat.probes", "10"]
+        assert pool.returned == 1
+        exported = metrics.render_prometheus()
+        assert 'chatbot_supabase_query_seconds_count{op="search"}' in exported
+        assert "chatbot_supabase_pool_wait_seconds_bucket" in exported
+
+    def test_histogram_buckets_are_cumulative(self):
+        from chatbot.metrics import Histogram
+        h = Histogram("t_seconds", "test", buckets=(0.1, 1.0))
+        for v in (0.05, 0.5, 5.0):
+            h.observe(v)
+        assert h.snapshot()[""]["buckets"] == [1, 2, 3]
+        assert 't_seconds_bucket{le="+Inf"} 3' in h.render()
+
+
+class TestAsyncPipeline:
+    async def test_retrieval_overlaps_moderation_and_flagged_query_never_reaches_llm(self, sample_chunks, monkeypatch):
+        import asyncio
+
+        from chatbot.adapters import cache_adapter, llm_adapter, vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.models.schemas import QueryRequest
+        from chatbot.services import chatbot_service, query_service
+
+        monkeypatch.setenv("VECTOR_BACKEND", "faiss")
+        get_settings.cache_clear()
+        events = []
+
+        async def slow_moderation(text):
+            events.append("moderation start")
+            await asyncio.sleep(0.05)
+            events.append("moderation end")
+            return False
+
+        async def embed(text):
+            events.append("embed")
+            return [1.0, 0.0]
+
+        llm = MagicMock()
+        with patch.object(llm_adapter, "amoderate", side_effect=slow_moderation), \
+             patch.object(llm_adapter, "aembed_query", side_effect=embed), \
+             patch.object(llm_adapter, "achat_completion", llm), \
+             patch.object(vector_adapter, "load_index", return_value=True), \
+             patch.object(vector_adapter, "search", return_value=sample_chunks), \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])):
+            request = QueryRequest(question="Something flagged", session_id="async-session-01")
+            with pytest.raises(chatbot_service.ContentSafetyError):
+                await chatbot_service.aprocess_query(request)
+        get_settings.cache_clear()
+
+        assert events.index("embed") < events.index("moderation end")
+        llm.assert_not_called()
+        assert cache_adapter.get_history("async-session-01") == []
+
+    async def test_answers_and_saves_history(self, sample_chunks, monkeypatch):
+        from chatbot.adapters import cache_adapter, llm_adapter, vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import query_service
+
+        monkeypatch.setenv("VECTOR_BACKEND", "faiss")
+        get_settings.cache_clear()
+
+        async def answer(messages):
+            return "30 days."
+
+        async def embed(text):
+            return [1.0, 0.0]
+
+        with patch.object(llm_adapter, "aembed_query", side_effect=embed), \
+             patch.object(llm_adapter, "achat_completion", side_effect=answer), \
+             patch.object(vector_adapter, "load_index", return_value=True), \
+             patch.object(vector_adapter, "search", return_value=sample_chunks), \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])):
+            result = await query_service.arun_rag_pipeline("Return policy?", "async-session-02")
+        get_settings.cache_clear()
+
+        assert result.answer == "30 days." and result.has_context
+        assert result.sources == [{"filename": "policy.pdf", "page_num": 1}]
+        assert cache_adapter.get_history("async-session-02")[-1]["content"] == "30 days."
+        cache_adapter.clear_history("async-session-02")
+
+    async def test_stream_sends_sources_then_tokens_and_saves_history_at_end(self, sample_chunks, monkeypatch):
+        from chatbot.adapters import cache_adapter, llm_adapter, vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import query_service
+
+        monkeypatch.setenv("VECTOR_BACKEND", "faiss")
+        get_settings.cache_clear()
+
+        async def embed(text):
+            return [1.0, 0.0]
+
+        async def stream(messages):
+            for delta in ["30 ", "days."]:
+                # Nothing is persisted while tokens are still flowing
+                assert cache_adapter.get_history("stream-session-01") == []
+                yield delta
+
+        with patch.object(llm_adapter, "aembed_query", side_effect=embed), \
+             patch.object(llm_adapter, "astream_chat_completion", side_effect=stream), \
+             patch.object(vector_adapter, "load_index", return_value=True), \
+             patch.object(vector_adapter, "search", return_value=sample_chunks), \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])):
+            events = [e async for e in query_service.astream_rag_pipeline("Return policy?", "stream-session-01")]
+        get_settings.cache_clear()
+
+        assert [name for name, _ in events] == ["sources", "token", "token", "done"]
+        assert events[0][1]["sources"] == [{"filename": "policy.pdf", "page_num": 1}]
+        assert events[-1][1] == {"answer": "30 days.", "has_context": True}
+        assert cache_adapter.get_history("stream-session-01")[-1]["content"] == "30 days."
+        cache_adapter.clear_history("stream-session-01")
+
+    async def test_precheck_overlaps_moderation_and_stages_are_timed(self, sample_chunks, monkeypatch):
+        import asyncio
+
+        from chatbot.adapters import cache_adapter, llm_adapter, vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.services import query_service
+
+        monkeypatch.setenv("VECTOR_BACKEND", "faiss")
+        monkeypatch.setenv("ENABLE_RELEVANCE_PRECHECK", "true")
+        get_settings.cache_clear()
+        events = []
+
+        async def moderation():
+            await asyncio.sleep(0.05)
+            events.append("moderation end")
+
+        async def chat(messages):
+            if messages[0]["role"] == "user":
+                events.append("precheck")
+                return "YES"
+            events.append("llm")
+            return "30 days."
+
+        async def embed(text):
+            return [1.0, 0.0]
+
+        timer = query_service.StageTimer()
+        with patch.object(llm_adapter, "aembed_query", side_effect=embed), \
+             patch.object(llm_adapter, "achat_completion", side_effect=chat), \
+             patch.object(vector_adapter, "load_index", return_value=True), \
+             patch.object(vector_adapter, "search", return_value=sample_chunks), \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])):
+            result = await query_service.arun_rag_pipeline(
+                "Return policy?", "timed-session-01", gate=moderation(), timer=timer
+            )
+        get_settings.cache_clear()
+
+        assert result.answer == "30 days."
+        assert events == ["precheck", "moderation end", "llm"]
+        assert {"moderation", "history", "embed", "search", "prompt", "precheck", "gate_wait", "llm", "save"} <= set(timer.stages)
+        assert "gate_wait;dur=" in timer.header() and "total;dur=" in timer.header()
+        cache_adapter.clear_history("timed-session-01")
+
+    def test_sync_moderation_runs_alongside_retrieval_and_gates_the_llm(self, sample_chunks, monkeypatch):
+        import threading
+
+        from chatbot.adapters import llm_adapter, vector_adapter
+        from chatbot.config import get_settings
+        from chatbot.models.schemas import QueryRequest
+        from chatbot.services import chatbot_service, query_service
+
+        monkeypatch.setenv("VECTOR_BACKEND", "faiss")
+        get_settings.cache_clear()
+        embedded = threading.Event()
+
+        def moderate(text):
+            # Only finishes once the pipeline has embedded the question on the calling thread
+            assert embedded.wait(timeout=5)
+            return False
+
+        def embed(text):
+            embedded.set()
+            return [1.0, 0.0]
+
+        llm = MagicMock()
+        with patch.object(llm_adapter, "moderate", side_effect=moderate), \
+             patch.object(llm_adapter, "embed_query", side_effect=embed), \
+             patch.object(llm_adapter, "chat_completion", llm), \
+             patch.object(vector_adapter, "load_index", return_value=True), \
+             patch.object(vector_adapter, "search", return_value=sample_chunks), \
+             patch.object(query_service, "build_context_block", return_value=("ctx", sample_chunks[:1])):
+            request = QueryRequest(question="Something flagged", session_id="sync-session-01")
+            with pytest.raises(chatbot_service.ContentSafetyError):
+                chatbot_service.process_query(request)
+        get_settings.cache_clear()
+
+        llm.assert_not_called()